@@ -18,7 +18,6 @@ import lxml.html
 import time
 import socket
 import threading
-import requests
 # import urllib2    urllib2 deprecated in python3
 import lavender.config as cfg
 import tushare as ts
@@ -26,19 +25,54 @@ import lavender.constant as ct
 import numpy as np
 import pandas as pd
 import stock_code as sc
+from functools import partial
+from manifest import Manifest
+from scheduler import Scheduler
+from db_writer import DbWriter, insert_frame
+from fetcher import Fetcher
+from fin_statement_parser import parse_fin_statement
+from lavender.util.StatementStore import statement_store
 from lxml import etree
-from bs4 import BeautifulSoup
 from datetime import datetime
-from sqlalchemy import create_engine
 # from urllib2 import urlopen, Request     python2
 # from pandas.compat import StringIO        python2
 from io import StringIO
 
 
-def _get_fin_statement(code, fin_state_type, years, retry_count=3, pause=0.001):
+def _submit_fin_statement(fetcher, code, fin_state_type, years):
+    """
+    start fetching the year pages of a financial statement.
+    Returns:
+        <list: concurrent.futures.Future>: one for each year.
+    """
+    return [fetcher.submit(ct.FIN_STATE_SITE % (fin_state_type, code, str(year)), encoding="GBK")
+            for year in years]
+
+
+def _collect_fin_statement(pages):
+    """
+    parse the fetched year pages of a financial statement.
+    Args:
+        pages: <list: concurrent.futures.Future>: see _submit_fin_statement.
+    Returns:
+        state_data: <pd.DataFrame>
+    Raises:
+        the error of the first year failed after all its retries.
+    """
+    state_data = pd.concat([parse_fin_statement(page.result()) for page in pages])
+    dates = pd.to_datetime(state_data.index)
+    # print(dates.month / 3)
+    # state_data["season"] = dates.month / 4 + 1
+    state_data["season"] = dates.month / 3
+    state_data["year"] = dates.year
+    return state_data
+
+
+def _get_fin_statement(code, fin_state_type, years, fetcher=None):
     """
     Get selected financial statement of selected stock code from 
-    the Sina website.
+    the Sina website. Pages of the years are fetched at the same time,
+    and a failed page is retried by itself.
 
 
     Args:
@@ -47,53 +81,61 @@ def _get_fin_statement(code, fin_state_type, years, retry_count=3, pause=0.001):
                                          利润表："ProfitStatement"
                                          现金流量表："CashFlow"
         years: <list: int>:
-        retry_count: <int>:
-        pause: 
+        fetcher: <fetcher.Fetcher>: default: a new one for this code.
     Returns:
-        state_data: <pd.DataFrame>
+        state_data: <pd.DataFrame>: None if some year failed.
     """
     ct.write_head()
-    for _ in range(retry_count):
-        state_data = pd.DataFrame()
-        try:
-            for year in years:
-                ct.write_console()
-                response = requests.get(ct.FIN_STATE_SITE % (fin_state_type, code, str(year)))
-                response.encoding = "GBK"
-                markup = response.text
-                markup = markup.replace('--', "")     # fill '--' with NaN
-                # markup = markup.replace('--', "0")    # fill '--' with 0
-                soup = BeautifulSoup(markup, "html5lib", )
-                # Don't use <tbody> tag, because soup.find_all('tbody') would catch <table> tags as well!
-                table_node = soup.find_all('table', attrs={'id': 'BalanceSheetNewTable0'})[0]
-                # print(ct.FIN_STATE_SITE % (fin_state_type, code, year))
-                tbody_node = str(table_node.tbody).replace("tbody", "table")
-                # print(tbody_node)
-                df = pd.read_html(tbody_node, header=0, index_col=0)[0]
-
-                # debug: data of 603801/603938 have duplicated columns in 2014-2016
-                # http://money.finance.sina.com.cn/corp/go.php/vFD_BalanceSheet/stockid/603801/ctrl/2016/displaytype/4.phtml
-                # update on 2019.11.05, the bad data have been fixed.
-                # df.columns = map(lambda x: x[:10], df.columns)
-
-                df.dropna(axis=1, how="all", inplace=True)
-                # All columns of the first row equal nan, drop it.
-                df = df[pd.notna(df.index)]
-
-                # Is there any duplicates?
-                # df = df.T.drop_duplicates().T
-                state_data = state_data.append(df.transpose().iloc[::-1])
-                time.sleep(pause)
-
-            dates = pd.to_datetime(state_data.index)
-            # print(dates.month / 3)
-            # state_data["season"] = dates.month / 4 + 1
-            state_data["season"] = dates.month / 3
-            state_data["year"] = dates.year
-            return state_data
-        except Exception as e:
-            print(e)
-            print("Try Again...")
+    own_fetcher = fetcher is None
+    fetcher = Fetcher() if own_fetcher else fetcher
+    try:
+        return _collect_fin_statement(_submit_fin_statement(fetcher, code, fin_state_type, years))
+    except Exception as e:
+        print(e)
+        return None
+    finally:
+        if own_fetcher:
+            fetcher.close()
+
+
+def _fetch_fin_statements(jobs, fin_state_type, fetcher=None):
+    """
+    Get financial statements of many codes, with pages of all the codes and
+    years fetched in the same pool of connections.
+    Args:
+        jobs: <list: tuple>: (code, years).
+        fin_state_type: <str>: see _get_fin_statement.
+        fetcher: <fetcher.Fetcher>: default: a new one.
+    Yields:
+        code: <str>
+        state_data: <pd.DataFrame>: None if some year failed.
+        error: <str>: error of the failed year, None if successful.
+    """
+    own_fetcher = fetcher is None
+    fetcher = Fetcher() if own_fetcher else fetcher
+    try:
+        # pages of a few codes ahead are kept in flight, so the pool never idles
+        # while a code is being parsed and saved.
+        n_ahead = max(2, 2 * fetcher.n_thread)
+        in_flight = list()
+        jobs = iter(jobs)
+        while True:
+            while len(in_flight) < n_ahead:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                code, years = job
+                in_flight.append((code, _submit_fin_statement(fetcher, code, fin_state_type, years)))
+            if not in_flight:
+                break
+            code, pages = in_flight.pop(0)
+            try:
+                yield code, _collect_fin_statement(pages), None
+            except Exception as e:
+                yield code, None, "%s: %s" % (type(e).__name__, e)
+    finally:
+        if own_fetcher:
+            fetcher.close()
 
 
 def get_fin_states_csv(statement, retry_count=3):
@@ -128,6 +170,126 @@ def get_fin_states_csv(statement, retry_count=3):
                 time.sleep(0.1)
 
 
+# (years after, month, day) of the deadline of the reports of each season.
+_REPORT_DEADLINES = {1: (0, 4, 30), 2: (0, 8, 31), 3: (0, 10, 31), 4: (1, 4, 30)}
+_COUNT_KEYS = ["inserted", "revised", "unchanged"]
+
+
+def _report_deadline(year, season):
+    """
+    the date by which all the reports of a season are published.
+    """
+    years_after, month, day = _REPORT_DEADLINES[season]
+    return datetime(year + years_after, month, day)
+
+
+def _is_season_closed(year, season, fetch_time):
+    """
+    whether reports of a season fetched at fetch_time can't be new or revised any more,
+    i.e. fetched cfg.report_revision_days days after the deadline of the reports.
+    Args:
+        fetch_time: <datetime>
+    """
+    return (fetch_time - _report_deadline(year, season)).days >= cfg.report_revision_days
+
+
+def _add_counts(total, counts):
+    for key in _COUNT_KEYS:
+        total[key] += counts.get(key, 0)
+
+
+def _print_counts(counts, unit="rows"):
+    print("%s%d %s inserted, %d revised, %d unchanged." % (
+        ct.NEW_LINE_CHAR, counts["inserted"], unit, counts["revised"], counts["unchanged"]))
+
+
+def _row_hashes(table_data):
+    """
+    hash of the values of each row of a table.
+    """
+    return ["%016x" % row_hash for row_hash in
+            pd.util.hash_pandas_object(table_data[sorted(table_data.columns)], index=False).values]
+
+
+def _upsert_season(conn, table, year, season, table_data, counts):
+    """
+    save the rows of a season of a table which are new or revised in the writer's
+    transaction(see DataCollecting/db_writer.py). Rows are keyed on (code, year, season),
+    and a hash of each row saved is kept in the table "<table>_hashes". Rows saved
+    before hashes were kept count as revised once.
+    Args:
+        conn: <sqlite3.Connection>
+        table_data: <pd.DataFrame>: a row for each code.
+        counts: <dict>: where the numbers of rows "inserted", "revised" and "unchanged" are put.
+    Returns:
+        <int>: number of rows saved.
+    """
+    hash_table = "%s_hashes" % table
+    conn.execute("CREATE TABLE IF NOT EXISTS '%s' (code TEXT NOT NULL, year INTEGER NOT NULL, "
+                 "season INTEGER NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (code, year, season)) "
+                 "WITHOUT ROWID" % hash_table)
+    stored = dict(conn.execute("SELECT code, hash FROM '%s' WHERE year = ? AND season = ?" % hash_table,
+                               (year, season)))
+    saved = set()
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+        conn.execute("CREATE INDEX IF NOT EXISTS 'ix_%s_key' ON '%s' (code, year, season)" % (table, table))
+        saved = set(code for code, in conn.execute(
+            "SELECT DISTINCT code FROM '%s' WHERE year = ? AND season = ?" % table, (year, season)))
+
+    codes = [str(code) for code in table_data["code"]]
+    hashes = _row_hashes(table_data)
+    changed = [code not in saved or stored.get(code) != row_hash for code, row_hash in zip(codes, hashes)]
+    revised = [code for code, is_changed in zip(codes, changed) if is_changed and code in saved]
+    if revised:
+        conn.executemany("DELETE FROM '%s' WHERE code = ? AND year = ? AND season = ?" % table,
+                         [(code, year, season) for code in revised])
+    n_rows = insert_frame(conn, table, table_data[changed]) if any(changed) else 0
+    conn.executemany("INSERT OR REPLACE INTO '%s' (code, year, season, hash) VALUES (?, ?, ?, ?)" % hash_table,
+                     [(code, year, season, row_hash)
+                      for code, row_hash, is_changed in zip(codes, hashes, changed) if is_changed])
+    conn.execute("CREATE INDEX IF NOT EXISTS 'ix_%s_key' ON '%s' (code, year, season)" % (table, table))
+
+    counts["inserted"] = sum(changed) - len(revised)
+    counts["revised"] = len(revised)
+    counts["unchanged"] = len(codes) - sum(changed)
+    return n_rows
+
+
+def _submit_statement(writer, state_type, code, state_data, on_commit, on_error, counts=None):
+    """
+    queue a financial statement of a stock to the writer of the statement store.
+    Args:
+        writer: <db_writer.DbWriter>
+        on_commit: <function>: called without arguments once the statement is saved.
+        on_error: <function>: called with the code and the error if it failed.
+        counts: <dict>: None to replace all the periods in state_data. Otherwise only the
+                        periods new or revised are saved, and the numbers of periods
+                        "inserted", "revised" and "unchanged" are added to it once committed.
+    """
+    def failed(error):
+        # items added by the job rolled back are not in the database any more.
+        statement_store.forget_items()
+        on_error(code, "%s: %s" % (type(error).__name__, error))
+
+    if counts is None:
+        writer.submit(partial(statement_store.write_rows, statement=state_type, code=code, data=state_data),
+                      on_commit=on_commit, on_error=failed)
+        return
+
+    period_counts = dict()
+
+    def write(conn):
+        period_counts.update(statement_store.upsert_rows(conn, state_type, code, state_data))
+        return period_counts["inserted"] + period_counts["revised"]
+
+    def committed():
+        _add_counts(counts, period_counts)
+        if on_commit is not None:
+            on_commit()
+
+    writer.submit(write, on_commit=committed, on_error=failed)
+
+
 class BasicsDownloader:
     """
     class for downloading fundamental data of stocks.
@@ -146,160 +308,278 @@ class BasicsDownloader:
 
     def get_fin_state(self, state_type):
         """
-        创建财务报表数据库文件，文件已存在强制下载则可能导致重复或遗漏。
+        创建财务报表数据库(see util/StatementStore.py)。
+        Progress is recorded in a manifest(see DataCollecting/manifest.py), so running
+        it again after an interruption downloads only the codes not done.
         Returns:
+            <dict>: key: <str>: code failed. value: <str>: error.
         """
         if state_type not in ct.FIN_STATE_NAME:
             raise AttributeError
-    
-        db_path = os.path.join(self.db_dir, "Statement_%s.db" % state_type)
-        engine = create_engine(r"sqlite:///%s" % db_path)
-    
-        if os.path.exists(db_path):
-            cmd = raw_input("Data Base already exists!, still generate data base? (Y/N)")
+
+        manifest = Manifest("Statement_%s" % state_type)
+
+        # nothing to resume from.
+        if len(manifest) == 0 and len(statement_store.codes(state_type)) > 0:
+            cmd = input("Data Base already exists!, still generate data base? (Y/N)")
             if cmd == "Y":
                 pass
             else:
                 return
     
         stock_list = sc.get_stock_codes()
-        codes = stock_list.code
-        names = stock_list.name
-
-        for code, name in zip(codes, names):
-            print("\r%s" % name)
-            state_data = _get_fin_statement(code, state_type, self.years)
-            if len(state_data) != 0:
-                state_data.to_sql(code, engine, if_exists='append')
+        codes = list(stock_list.code)
+        names = dict(zip(stock_list.code, stock_list.name))
+
+        pending = manifest.pending(codes)
+        print("%d of %d codes to download." % (len(pending), len(codes)))
+        jobs = [(code, self.years) for code in pending]
+        # statements are saved by the writer thread while the next ones are fetched,
+        # and a code is marked done once its statement is committed.
+        with DbWriter(statement_store.db_path, connect=statement_store.connect) as writer:
+            for code, state_data, error in _fetch_fin_statements(jobs, state_type):
+                print("\r%s" % names[code])
+                if state_data is None:
+                    manifest.mark_failed(code, error)
+                    continue
+                # periods saved by an interrupted try are replaced, not duplicated.
+                _submit_statement(writer, state_type, code, state_data,
+                                  partial(manifest.mark_done, code, state_data), manifest.mark_failed)
+        manifest.compact()
+        return manifest.failed
 
     def update_fin_state(self, state_type):
         """
-        更新财务报表数据库文件
+        更新财务报表数据库
+        Pages of a code are fetched from the year of its last period saved on, or from
+        the next year if the annual report of that year can't be revised any more.
+        Only the periods new or revised are saved(see StatementStore.upsert_rows),
+        so a failed code keeps its old data.
         Args:
             state_type:
         Returns:
+            <dict>:
+                "inserted", "revised", "unchanged": <int>: number of periods.
+                "failed": <dict>: key: <str>: code failed. value: <str>: error.
         """
-        db_path = os.path.join(self.db_dir, "Statement_%s.db" % state_type)
-        conn = sqlite3.connect(db_path)
-        latest_year = datetime.now().year
+        now = datetime.now()
+        latest_year = now.year
 
         stock_list = sc.get_stock_codes()
-        codes = stock_list.code
-        names = stock_list.name
+        names = dict(zip(stock_list.code, stock_list.name))
+
+        last_periods = statement_store.last_periods(state_type)
+        jobs = list()
+        for code in stock_list.code:
+            first_year = 1990
+            if code in last_periods:
+                year, season = last_periods[code]
+                first_year = year + 1 if season == 4 and _is_season_closed(year, season, now) else year
+            if first_year <= latest_year:
+                jobs.append((code, range(int(first_year), int(latest_year) + 1)))
+
+        counts = dict((key, 0) for key in _COUNT_KEYS)
+        failed = dict()
+        with DbWriter(statement_store.db_path, connect=statement_store.connect) as writer:
+            for code, state_data, error in _fetch_fin_statements(jobs, state_type):
+                print("\r%s" % names[code])
+                if state_data is None:
+                    failed[code] = error
+                    continue
+                if code not in last_periods:
+                    print("Table not exits, initialization...")
+                _submit_statement(writer, state_type, code, state_data, None, failed.__setitem__, counts)
+        _print_counts(counts, "periods")
+        return dict(counts, failed=failed)
 
-        for code, name in zip(codes, names):
-            print("\r%s" % name)
-            try:
-                cursor = conn.execute("SELECT DISTINCT year FROM '%s'" % code)
-                last_year = cursor.fetchall()[-1][0]
-                years = range(int(last_year), int(latest_year) + 1)
-                conn.execute("DELETE FROM '%s' WHERE year >= %s" % (code, last_year))
-                conn.commit()
-            except sqlite3.OperationalError:
-                print("Table not exits, initialization...")
-                years = range(1990, int(latest_year) + 1)
-
-            engine = create_engine(r"sqlite:///%s" % db_path)
-            state_data = _get_fin_statement(code, state_type, years)
-            if len(state_data) != 0:
-                state_data.to_sql(code, engine, if_exists='append')
-        conn.close()
+    def _confirm_table(self, table, manifest):
+        """
+        ask whether to download a table again if its database exists and
+        there's no manifest to resume from.
+        """
+        if table not in ct.TABLES:
+            raise AttributeError
+        db_path = os.path.join(self.db_dir, "%s.db" % table)
+        if os.path.exists(db_path) and len(manifest) == 0:
+            cmd = input("Data Base of %s already exists!, still generate data base? (Y/N)" % table)
+            return cmd == "Y"
+        return True
 
-    def get_table(self, table):
+    def get_tables(self, tables=ct.TABLES, n_thread=None, max_retry=None, rate=None):
+        """
+        Get financial tables from Sina using tushare package and save data in sqlite
+        databases, fetching the (table, year, season) units in worker threads.
+        Seasons done are recorded in a manifest of each table(see DataCollecting/manifest.py)
+        and skipped when running it again.
+        Args:
+            tables: <list: str>: see get_table.
+            n_thread: <int>: number of seasons fetched at the same time, 1 to fetch them
+                             one after another. default: cfg.download_threads.
+            max_retry: <int>: retries of a failed season. default: cfg.download_retries.
+            rate: <float>: most requests per second. default: cfg.download_rate.
+        Returns:
+            <dict>: key: <str>: table. value: <dict>: key: <str>: "year:season" failed.
+                                                      value: <str>: error.
+        """
+        manifests = dict()
+        for table in tables:
+            manifest = Manifest("table_%s" % table)
+            if self._confirm_table(table, manifest):
+                manifests[table] = manifest
+
+        units = [(table, year, season) for year in self.years for season in range(4, 5)
+                 for table, manifest in manifests.items() if not manifest.is_done("%s:%s" % (year, season))]
+        self._download_tables(units, manifests, n_thread=n_thread, max_retry=max_retry, rate=rate)
+        for manifest in manifests.values():
+            manifest.compact()
+        return dict((table, manifest.failed) for table, manifest in manifests.items())
+
+    def get_table(self, table, n_thread=None, max_retry=None, rate=None):
         """
         Get financial tables from Sina using tushare package and save data in sqlite database.
+        Seasons done are recorded in a manifest(see DataCollecting/manifest.py) and
+        skipped when running it again.
         Args:
             table: <str>: Financial table, support 'report', 'profit', 'operation', 
                           'growth', 'debtpaying', 'cashflow'
+            n_thread, max_retry, rate: see get_tables.
+        Returns:
+            <dict>: key: <str>: "year:season" failed. value: <str>: error.
         """
-        if table not in ct.TABLES:
-            raise AttributeError
-
-        db_path = os.path.join(self.db_dir, "%s.db" % table)
-        engine = create_engine(r"sqlite:///%s" % db_path)
+        return self.get_tables([table], n_thread=n_thread, max_retry=max_retry, rate=rate).get(table)
 
-        if os.path.exists(db_path):
-            cmd = raw_input("Data Base already exists!, still generate data base? (Y/N)")
-            if cmd == "Y":
-                pass
-            else:
+    def _download_season(self, table, year, season):
+        """
+        download a season of a table.
+        Returns:
+            <pd.DataFrame>: None if there's no data in the season.
+        """
+        print("%sget %s data in %s S%s..." % (ct.NEW_LINE_CHAR, table, year, season))
+        try:
+            table_data = getattr(ts, "get_%s_data" % table)(year, season)
+        except IOError:
+            print("No data in %s S%s" % (year, season))
+            return None
+        table_data['year'] = year
+        table_data['season'] = season
+
+        # data in "debtpaying" table contain "--" characters.
+        # Numeric columns in DataFrame couldn't compare with a string.
+        table_data[table_data[table_data.columns[table_data.dtypes == "object"]] == "--"] = np.nan
+
+        if table == "report":
+            # Since distributions in report table contain Chinese characters and Nan.
+            # Pandas DataFrame use "unicode" type when Chinese characters appear,
+            # use "float" type when there are no Chinese characters. While sqlite3 save
+            # all the distributions as float, this may raise error when loading data
+            # from sqlite3 database. So force all distribution data to "unicode" here.
+            table_data.distrib = table_data.distrib.astype("unicode")
+        # tushare has a bug: get duplicate rows of None for some
+        # stock, like 601229.
+        table_data.drop_duplicates(subset=["code", "year", "season"], inplace=True)
+        return table_data
+
+    def _download_tables(self, units, manifests=None, n_thread=None, max_retry=None, rate=None):
+        """
+        download (table, year, season) units in worker threads(see DataCollecting/scheduler.py),
+        a failed unit retried by itself, and save them through a writer thread for
+        each table(see DataCollecting/db_writer.py). A unit saves the rows of its
+        season new or revised(see _upsert_season), so downloading it again never
+        duplicates rows.
+        Args:
+            units: <list: tuple>: (table, year, season).
+            manifests: <dict>: key: <str>: table. value: <manifest.Manifest>: where the
+                               seasons done or failed are recorded. default: none.
+            n_thread, max_retry, rate: see get_tables.
+        Returns:
+            <dict>:
+                "inserted", "revised", "unchanged": <int>: number of rows(see _upsert_season).
+                "failed": <dict>: key: <str>: "table:year:season" failed. value: <str>: error.
+        """
+        manifests = dict() if manifests is None else manifests
+        writers = dict((table, DbWriter(os.path.join(self.db_dir, "%s.db" % table)))
+                       for table in dict.fromkeys(table for table, _, _ in units))
+        counts = dict((key, 0) for key in _COUNT_KEYS)
+        failed = dict()
+
+        def mark_failed(unit, error):
+            table, year, season = unit
+            failed["%s:%s:%s" % unit] = "%s: %s" % (type(error).__name__, error) \
+                if isinstance(error, Exception) else error
+            if table in manifests:
+                manifests[table].mark_failed("%s:%s" % (year, season), failed["%s:%s:%s" % unit])
+
+        def download(unit):
+            table, year, season = unit
+            manifest = manifests.get(table)
+            period = "%s:%s" % (year, season)
+            table_data = self._download_season(table, year, season)
+            if table_data is None:
+                if manifest is not None:
+                    manifest.mark_done(period)
                 return
+            # rows saved by an interrupted try are left alone or replaced, not duplicated.
+            season_counts = dict()
 
-        for year in self.years:
-            for season in range(4, 5):
-                print("%sget data in %s S%s..." % (ct.NEW_LINE_CHAR, year, season))
-                try:
-                    table_data = getattr(ts, "get_%s_data" % table)(year, season)
-                except IOError:
-                    print("No data in %s S%s" % (year, season))
-                    continue
-                table_data['year'] = year
-                table_data['season'] = season
-
-                # data in "debtpaying" table contain "--" characters.
-                # Numeric columns in DataFrame couldn't compare with a string.
-                table_data[table_data[table_data.columns[table_data.dtypes == "object"]] == "--"] = np.nan
-
-                if table == "report":
-                    # Since distributions in report table contain Chinese characters and Nan.
-                    # Pandas DataFrame use "unicode" type when Chinese characters appear,
-                    # use "float" type when there are no Chinese characters. While sqlite3 save
-                    # all the distributions as float, this may raise error when loading data
-                    # from sqlite3 database. So force all distribution data to "unicode" here.
-                    table_data.distrib = table_data.distrib.astype("unicode")
-                # print table_data[table_data.code=="000651"]
-                # tushare has a bug: get duplicate rows of None for some
-                # stock, like 601229.
-                table_data.drop_duplicates(inplace=True)  # subset=["code", "year", "season"], inplace=True)
-                # print table_data[table_data.code=="000651"]
-                table_data.to_sql(table, engine, if_exists='append')
-
-    def update_table(self, table):
+            def committed():
+                _add_counts(counts, season_counts)
+                if manifest is not None:
+                    manifest.mark_done(period, table_data)
+
+            writers[table].submit(partial(_upsert_season, table=table, year=year, season=season,
+                                          table_data=table_data, counts=season_counts),
+                                  on_commit=committed, on_error=partial(mark_failed, unit))
+
+        for writer in writers.values():
+            writer.start()
+        try:
+            scheduler = Scheduler(download, n_thread=n_thread, max_retry=max_retry, rate=rate)
+            report = scheduler.run(units, name_of=lambda unit: "%s:%s:%s" % unit)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        for name, error in report["failed"].items():
+            table, year, season = name.split(":")
+            mark_failed((table, int(year), int(season)), error)
+        _print_counts(counts)
+        return dict(counts, failed=failed)
+
+    def update_table(self, table, n_thread=None, max_retry=None, rate=None):
         """
-        Update tables from the last season till the most recent year.
+        Update tables from the last season till the most recent year. Seasons not over
+        yet, and seasons fetched cfg.report_revision_days days after the deadline of
+        their reports, can't have new or revised reports and are not fetched again.
+        Only the rows new or revised are saved(see _upsert_season).
         Args:
             table: <str>: Financial table, support 'report', 'profit', 'operation', 
                           'growth', 'debtpaying', 'cashflow'
+            n_thread, max_retry, rate: see get_tables.
+        Returns:
+            <dict>: see _download_tables.
         """
         db_path = os.path.join(self.db_dir, "%s.db" % table)
         conn = sqlite3.connect(db_path)
         cursor = conn.execute("SELECT DISTINCT year FROM %s" % table)
 
         last_year = cursor.fetchall()[-1][0]
-        latest_year = datetime.now().year
-        years = range(int(last_year), int(latest_year) + 1)
-        conn.execute("DELETE FROM %s WHERE year >= %s" % (table, last_year))
-        conn.commit()
+        now = datetime.now()
         conn.close()
 
-        engine = create_engine(r"sqlite:///%s" % db_path)
-        for year in years:
+        manifest = Manifest("table_%s" % table)
+        units = list()
+        for year in range(int(last_year), now.year + 1):
             for season in range(1, 5):
-                print("%sUpdating data in %s S%s..." % (ct.NEW_LINE_CHAR, year, season))
-                try:
-                    table_data = getattr(ts, "get_%s_data" % table)(year, season)
-                except IOError:
-                    print("No data in %s S%s" % (year, season))
+                if now < datetime(year + season // 4, 3 * season % 12 + 1, 1):
                     continue
-                table_data['year'] = year
-                table_data['season'] = season
-
-                # data in "debtpaying" table contain "--" characters.
-                # Numeric columns in DataFrame couldn't compare with a string.
-                table_data[table_data[table_data.columns[table_data.dtypes == "object"]] == "--"] = np.nan
-
-                if table == "report":
-                    # Since distributions in report table contain Chinese characters and
-                    # Nan. Pandas DataFrame uses "unicode" type when Chinese characters appear,
-                    # uses "float" type when there are no Chinese characters. While sqlite3 save
-                    # all the distributions as "float", this may raise error when loading data
-                    # from sqlite3 database. So force all distribution data to "unicode" here.
-                    table_data.distrib = table_data.distrib.astype("unicode")
-
-                # tushare has a bug: get duplicate rows of None for some
-                # stock, like 601229.
-                table_data.drop_duplicates(subset=["code", "year", "season"], inplace=True)
-                table_data.to_sql(table, engine, if_exists='append')
+                entry = manifest.entries.get("%s:%s" % (year, season))
+                if manifest.is_done("%s:%s" % (year, season)) and _is_season_closed(
+                        year, season, datetime.strptime(entry["time"], "%Y-%m-%d %H:%M:%S")):
+                    continue
+                units.append((table, year, season))
+        report = self._download_tables(units, {table: manifest}, n_thread=n_thread, max_retry=max_retry,
+                                       rate=rate)
+        manifest.compact()
+        return report
 
 
 if __name__ == "__main__":
@@ -314,7 +594,7 @@ if __name__ == "__main__":
     # for state_type in ct.FIN_STATE_NAME:
     #     downloader.get_fin_state(state_type)
     #     downloader.update_fin_state(state_type)
-    print(_get_fin_statement("603938", "BalanceSheet", range(2017, 2019), retry_count=1))
+    print(_get_fin_statement("603938", "BalanceSheet", range(2017, 2019)))
 
     # get_fin_states_csv("ProfitStatement")
     # downloader.update_fin_state("BalanceSheet")
@@ -0,0 +1,210 @@
+"""
+Writer stage of downloads into SQLite databases.
+
+Download threads put write jobs on a bounded queue, and one writer thread,
+owning the only connection to the database, runs them in large transactions
+committed every cfg.db_batch_rows rows or cfg.db_flush_seconds seconds, so
+downloading and parsing go on while the data are being written. Each job
+runs in a savepoint of the transaction: a failed job is rolled back alone.
+Callbacks of a job are called once its transaction is committed(or failed),
+so progress records like manifests never run ahead of the database.
+"""
+
+import os
+import time
+import queue
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+import lavender.config as cfg
+
+
+def _sql_type(dtype):
+    # the same types as pandas.DataFrame.to_sql gives sqlite columns.
+    if dtype.kind == "f":
+        return "REAL"
+    if dtype.kind in "iub":
+        return "INTEGER"
+    if dtype.kind == "M":
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def insert_frame(conn, table, frame):
+    """
+    insert the rows of a DataFrame into a table with executemany, creating the
+    table or adding columns if needed. The index is not saved.
+    Args:
+        conn: <sqlite3.Connection>
+        table: <str>: table name.
+        frame: <pandas.DataFrame>
+    Returns:
+        <int>: number of rows inserted.
+    """
+    columns = [str(column) for column in frame.columns]
+    existing = [row[1] for row in conn.execute("PRAGMA table_info('%s')" % table)]
+    if not existing:
+        conn.execute("CREATE TABLE '%s' (%s)" % (table, ", ".join(
+            '"%s" %s' % (column, _sql_type(dtype)) for column, dtype in zip(columns, frame.dtypes))))
+    else:
+        for column, dtype in zip(columns, frame.dtypes):
+            if column not in existing:
+                conn.execute('ALTER TABLE \'%s\' ADD COLUMN "%s" %s' % (table, column, _sql_type(dtype)))
+    values = frame.astype(object).where(pd.notna(frame), None).values.tolist()
+    conn.executemany("INSERT INTO '%s' (%s) VALUES (%s)" % (
+        table, ", ".join('"%s"' % column for column in columns), ", ".join("?" * len(columns))),
+        [[value.item() if isinstance(value, np.generic) else value for value in row] for row in values])
+    return len(values)
+
+
+class DbWriter:
+    """
+    one thread writing jobs into a database in batched transactions.
+    Members:
+        n_rows: <int>: number of rows committed.
+        n_commits: <int>: number of transactions committed.
+        n_failed: <int>: number of jobs failed.
+    """
+    def __init__(self, db_path, connect=None, batch_rows=None, flush_seconds=None, queue_size=None):
+        """
+        Args:
+            db_path: <str>: path of the database.
+            connect: <function>: open the database, e.g. StatementStore.connect.
+                                 default: sqlite3.connect(db_path).
+            batch_rows: <int>: rows written before a commit. default: cfg.db_batch_rows.
+            flush_seconds: <float>: longest time a transaction stays open. default: cfg.db_flush_seconds.
+            queue_size: <int>: most jobs waiting. default: cfg.db_queue_size.
+        """
+        self.db_path = db_path
+        self._connect = connect if connect is not None else self._connect_db
+        self.batch_rows = cfg.db_batch_rows if batch_rows is None else batch_rows
+        self.flush_seconds = cfg.db_flush_seconds if flush_seconds is None else flush_seconds
+        self._queue = queue.Queue(maxsize=cfg.db_queue_size if queue_size is None else queue_size)
+        self._thread = None
+        self._error = None
+        self.n_rows = 0
+        self.n_commits = 0
+        self.n_failed = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, write, on_commit=None, on_error=None):
+        """
+        queue a job, waiting while the queue is full.
+        Args:
+            write: <function>: called with the connection in the writer thread,
+                               returns the number of rows written.
+            on_commit: <function>: called without arguments once the job is committed.
+            on_error: <function>: called with the exception if the job failed.
+        """
+        self._queue.put((write, on_commit, on_error))
+
+    def close(self):
+        """
+        write the jobs left, commit and stop the writer thread.
+        Raises:
+            the error which stopped the writer, if any.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _connect_db(self):
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        return sqlite3.connect(self.db_path)
+
+    @staticmethod
+    def _call(function, *args):
+        if function is not None:
+            function(*args)
+
+    def _fail(self, job, error):
+        self.n_failed += 1
+        self._call(job[2], error)
+
+    def _run(self):
+        try:
+            conn = self._connect()
+            conn.isolation_level = None     # transactions are managed here.
+        except Exception as err:
+            self._error = err
+            self._drain(err)
+            return
+
+        batch = list()      # jobs written in the open transaction.
+        batch_rows = 0
+        started = None
+        job = False
+        try:
+            while True:
+                timeout = None if started is None else max(0.0, started + self.flush_seconds - time.monotonic())
+                try:
+                    job = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    job = False
+                if job:
+                    if started is None:
+                        conn.execute("BEGIN")
+                        started = time.monotonic()
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        n_rows = job[0](conn) or 0
+                        conn.execute("RELEASE job")
+                        batch.append(job)
+                        batch_rows += n_rows
+                    except Exception as err:
+                        conn.execute("ROLLBACK TO job")
+                        conn.execute("RELEASE job")
+                        self._fail(job, err)
+                if started is not None and (job is None or batch_rows >= self.batch_rows or
+                                            time.monotonic() - started >= self.flush_seconds):
+                    self._commit(conn, batch, batch_rows)
+                    batch, batch_rows, started = list(), 0, None
+                if job is None:
+                    break
+        except Exception as err:
+            self._error = err
+            for failed in batch:
+                self._fail(failed, err)
+            if job is not None:     # close() has not been called yet.
+                self._drain(err)
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch, batch_rows):
+        try:
+            conn.execute("COMMIT")
+        except sqlite3.Error as err:
+            conn.execute("ROLLBACK")
+            for job in batch:
+                self._fail(job, err)
+            return
+        self.n_rows += batch_rows
+        self.n_commits += 1
+        for job in batch:
+            self._call(job[1])
+
+    def _drain(self, error):
+        """
+        fail the jobs left after the writer stopped, so producers never block.
+        """
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            self._fail(job, error)
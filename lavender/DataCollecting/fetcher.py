@@ -0,0 +1,111 @@
+"""
+Concurrent fetcher of web pages over pooled HTTP connections.
+
+Each worker thread keeps its own requests.Session, whose connection pool
+keeps the connections to the site alive between pages, instead of opening
+a new TCP/TLS connection for every page. A page is retried on its own with
+exponential backoff when it fails, and all the requests pass through one
+rate limiter(see DataCollecting/scheduler.py).
+"""
+
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import lavender.config as cfg
+from scheduler import RateLimiter
+
+
+class Fetcher:
+    """
+    fetch pages in a pool of threads.
+    """
+    def __init__(self, n_thread=None, max_retry=None, backoff=None, rate=None, timeout=10.0):
+        """
+        Args:
+            n_thread: <int>: number of pages fetched at the same time. default: cfg.download_threads.
+            max_retry: <int>: retries of a failed page. default: cfg.download_retries.
+            backoff: <float>: seconds to wait before the first retry, doubled for each of the
+                              next ones. default: cfg.download_backoff.
+            rate: <float>: most requests per second, None for no limit. default: cfg.download_rate.
+            timeout: <float>: seconds to wait for the server.
+        """
+        self.n_thread = cfg.download_threads if n_thread is None else n_thread
+        self.max_retry = cfg.download_retries if max_retry is None else max_retry
+        self.backoff = cfg.download_backoff if backoff is None else backoff
+        rate = cfg.download_rate if rate is None else rate
+        self.limiter = RateLimiter(rate) if rate else None
+        self.timeout = timeout
+
+        self._local = threading.local()
+        self._sessions = list()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(self.n_thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def session(self):
+        """
+        <requests.Session>: session of the current thread.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def get(self, url, encoding=None):
+        """
+        fetch a page in the current thread, retrying it if failed.
+        Args:
+            url: <str>
+            encoding: <str>: encoding of the page, e.g. "GBK". default: the one in headers.
+        Returns:
+            <str>: text of the page.
+        Raises:
+            requests.RequestException: the last error if all the tries failed.
+        """
+        for attempt in range(self.max_retry + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                response.raise_for_status()
+                if encoding is not None:
+                    response.encoding = encoding
+                return response.text
+            except requests.RequestException as err:
+                if attempt == self.max_retry:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                print("%s: %s, retry in %.1f s..." % (url, err, delay))
+                time.sleep(delay * (1 + 0.1 * random.random()))
+
+    def submit(self, url, encoding=None):
+        """
+        fetch a page in the thread pool.
+        Returns:
+            <concurrent.futures.Future>: result: text of the page.
+        """
+        return self._executor.submit(self.get, url, encoding)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = list()
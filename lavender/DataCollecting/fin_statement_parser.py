@@ -0,0 +1,230 @@
+"""
+Parser of financial statement pages of the Sina website
+(e.g. http://money.finance.sina.com.cn/corp/go.php/vFD_BalanceSheet/stockid/600519/ctrl/2016/displaytype/4.phtml).
+
+parse_fin_statement reads the cells of the statement table straight from an
+lxml tree by XPath, and hands the rows of text to the same pandas TextParser
+pandas.read_html uses, so its DataFrame is identical to the one of
+parse_fin_statement_soup, the former way of parsing the whole page with the
+html5lib backend of BeautifulSoup and parsing the table again with read_html.
+benchmark() compares the two on the sample pages in cfg.sample_page_dir:
+a few pages in the layout of the website come with the repository, so it
+runs offline, and save_sample_pages() downloads more.
+"""
+
+import os
+import re
+import time
+from io import StringIO
+
+import lxml.html
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+import lavender.config as cfg
+import lavender.constant as ct
+
+TABLE_ID = "BalanceSheetNewTable0"
+PAGE_EXT = ".html"
+# the same as pandas.read_html.
+_RE_WHITESPACE = re.compile(r"[\r\n]+|\s{2,}")
+_HTML_PARSER = lxml.html.HTMLParser(recover=True)
+
+
+def _cell_text(cell):
+    return _RE_WHITESPACE.sub(" ", cell.text_content()).strip()
+
+
+def _expand_spans(rows):
+    """
+    text of cells of rows, the text of a cell with "colspan" or "rowspan" copied
+    to the cells it spans, the same as pandas.read_html.
+    Args:
+        rows: <list: lxml.html.HtmlElement>: <tr> elements.
+    Returns:
+        <list: list: str>
+    """
+    all_texts = list()
+    remainder = list()      # (column, text, rows left) of cells spanning down.
+    for tr in rows:
+        texts = list()
+        next_remainder = list()
+        index = 0
+        for td in tr.xpath("./td|./th"):
+            while remainder and remainder[0][0] <= index:
+                prev_index, prev_text, prev_rowspan = remainder.pop(0)
+                texts.append(prev_text)
+                if prev_rowspan > 1:
+                    next_remainder.append((prev_index, prev_text, prev_rowspan - 1))
+                index += 1
+            text = _cell_text(td)
+            rowspan = int(td.get("rowspan") or 1)
+            colspan = int(td.get("colspan") or 1)
+            for _ in range(colspan):
+                texts.append(text)
+                if rowspan > 1:
+                    next_remainder.append((index, text, rowspan - 1))
+                index += 1
+        for prev_index, prev_text, prev_rowspan in remainder:
+            texts.append(prev_text)
+            if prev_rowspan > 1:
+                next_remainder.append((prev_index, prev_text, prev_rowspan - 1))
+        all_texts.append(texts)
+        remainder = next_remainder
+
+    # rows only made of cells spanning down from the last rows.
+    while remainder:
+        next_remainder = list()
+        texts = list()
+        for prev_index, prev_text, prev_rowspan in remainder:
+            texts.append(prev_text)
+            if prev_rowspan > 1:
+                next_remainder.append((prev_index, prev_text, prev_rowspan - 1))
+        all_texts.append(texts)
+        remainder = next_remainder
+    return all_texts
+
+
+def _statement_rows(markup):
+    """
+    <tr> elements of the body of the statement table.
+    """
+    document = lxml.html.document_fromstring(markup, parser=_HTML_PARSER)
+    tables = document.xpath("//table[@id=$table_id]", table_id=TABLE_ID)
+    if not tables:
+        raise ValueError("table %s not found!" % TABLE_ID)
+    # rows outside <tbody> belong to an implied one, as html5lib parses them.
+    tbodies = tables[0].xpath(".//tbody")
+    body = tbodies[0] if tbodies else tables[0]
+
+    # hidden elements are dropped and line breaks kept, as pandas.read_html does.
+    for element in body.xpath(".//style"):
+        element.drop_tree()
+    for element in body.xpath(".//*[@style]"):
+        if "display:none" in element.get("style", "").replace(" ", ""):
+            element.drop_tree()
+    for br in body.xpath(".//br"):
+        br.tail = "\n" + (br.tail or "")
+    return body.xpath("./tr")
+
+
+def _to_statement(df):
+    """
+    clean a parsed statement table and turn dates to index.
+    """
+    # debug: data of 603801/603938 have duplicated columns in 2014-2016
+    # http://money.finance.sina.com.cn/corp/go.php/vFD_BalanceSheet/stockid/603801/ctrl/2016/displaytype/4.phtml
+    # update on 2019.11.05, the bad data have been fixed.
+    # df.columns = map(lambda x: x[:10], df.columns)
+
+    df.dropna(axis=1, how="all", inplace=True)
+    # All columns of the first row equal nan, drop it.
+    df = df[pd.notna(df.index)]
+
+    # Is there any duplicates?
+    # df = df.T.drop_duplicates().T
+    return df.transpose().iloc[::-1]
+
+
+def parse_fin_statement(markup):
+    """
+    parse a year page of a financial statement.
+    Args:
+        markup: <str>: html of the page.
+    Returns:
+        <pd.DataFrame>: dates as index, items as columns, dates descending.
+    """
+    markup = markup.replace('--', "")     # fill '--' with NaN
+    texts = _expand_spans(_statement_rows(markup))
+    if not texts:
+        raise ValueError("table %s is empty!" % TABLE_ID)
+    # ragged rows are filled with empty cells.
+    width = max(len(row) for row in texts)
+    texts = [row + [""] * (width - len(row)) for row in texts]
+    with TextParser(texts, header=0, index_col=0, thousands=",", skiprows=0) as parser:
+        df = parser.read()
+    return _to_statement(df)
+
+
+def parse_fin_statement_soup(markup):
+    """
+    parse a year page of a financial statement with BeautifulSoup and
+    pandas.read_html, the former parser kept as reference for benchmark().
+    """
+    from bs4 import BeautifulSoup
+    markup = markup.replace('--', "")     # fill '--' with NaN
+    soup = BeautifulSoup(markup, "html5lib", )
+    # Don't use <tbody> tag, because soup.find_all('tbody') would catch <table> tags as well!
+    table_node = soup.find_all('table', attrs={'id': TABLE_ID})[0]
+    tbody_node = str(table_node.tbody).replace("tbody", "table")
+    df = pd.read_html(StringIO(tbody_node), header=0, index_col=0)[0]
+    return _to_statement(df)
+
+
+def save_sample_pages(codes, years, fin_state_types=ct.FIN_STATE_NAME, page_dir=None):
+    """
+    save statement pages from the Sina website as samples for benchmark().
+    Args:
+        codes: <list: str>
+        years: <list: int>
+        fin_state_types: <list: str>: e.g. ["BalanceSheet"].
+        page_dir: <str>: default: cfg.sample_page_dir.
+    Returns:
+        <int>: number of pages saved.
+    """
+    from fetcher import Fetcher
+    page_dir = cfg.sample_page_dir if page_dir is None else page_dir
+    if not os.path.exists(page_dir):
+        os.makedirs(page_dir)
+    jobs = [(fin_state_type, code, year) for fin_state_type in fin_state_types
+            for code in codes for year in years]
+    with Fetcher() as fetcher:
+        pages = [fetcher.submit(ct.FIN_STATE_SITE % (fin_state_type, code, str(year)), encoding="GBK")
+                 for fin_state_type, code, year in jobs]
+        for (fin_state_type, code, year), page in zip(jobs, pages):
+            file_name = "%s_%s_%s%s" % (fin_state_type, code, year, PAGE_EXT)
+            with open(os.path.join(page_dir, file_name), "w", encoding="utf-8") as fout:
+                fout.write(page.result())
+    return len(jobs)
+
+
+def benchmark(page_dir=None, repeat=3):
+    """
+    time the parsers on sample pages, and check they give the same data.
+    Args:
+        page_dir: <str>: directory of pages saved by save_sample_pages. default: cfg.sample_page_dir.
+        repeat: <int>: times each page is parsed, the best time is taken.
+    Returns:
+        <pd.DataFrame>: page names as index, columns:
+            "lxml_ms", "soup_ms": milliseconds to parse the page.
+            "identical": whether the two DataFrames are the same.
+    """
+    page_dir = cfg.sample_page_dir if page_dir is None else page_dir
+    rows = dict()
+    for file_name in sorted(os.listdir(page_dir)):
+        if not file_name.endswith(PAGE_EXT):
+            continue
+        with open(os.path.join(page_dir, file_name), encoding="utf-8") as fin:
+            markup = fin.read()
+        results = dict()
+        row = dict()
+        for name, parse in [("lxml", parse_fin_statement), ("soup", parse_fin_statement_soup)]:
+            times = list()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                results[name] = parse(markup)
+                times.append(time.perf_counter() - start)
+            row["%s_ms" % name] = 1000 * min(times)
+        row["identical"] = results["lxml"].equals(results["soup"]) and \
+            results["lxml"].columns.equals(results["soup"].columns)
+        rows[os.path.splitext(file_name)[0]] = row
+    result = pd.DataFrame.from_dict(rows, orient="index", columns=["lxml_ms", "soup_ms", "identical"])
+    print(result)
+    print("mean per page: lxml %.2f ms, soup %.2f ms, %.1fx faster, %d of %d identical."
+          % (result.lxml_ms.mean(), result.soup_ms.mean(), result.soup_ms.mean() / result.lxml_ms.mean(),
+             result.identical.sum(), len(result)))
+    return result
+
+
+if __name__ == "__main__":
+    benchmark()
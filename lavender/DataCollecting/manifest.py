@@ -0,0 +1,127 @@
+"""
+Checkpoint manifest of long downloads.
+
+A manifest records the state of every unit of work of a download(a stock
+code, or a year and season of a table): done, with the number of rows and
+a hash of the content saved, or failed, with the error. It is kept as an
+append-only file of json lines in cfg.manifest_dir, the last line of a key
+being its state, so a crash loses at most the line being written. A
+download started again skips the keys done and retries the others.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import pandas as pd
+
+import lavender.config as cfg
+
+DONE = "done"
+FAILED = "failed"
+MANIFEST_EXT = ".jsonl"
+
+
+def content_hash(data):
+    """
+    Args:
+        data: <pandas.DataFrame>: data saved.
+    Returns:
+        <str>: sha1 of the values and index of data.
+    """
+    return hashlib.sha1(pd.util.hash_pandas_object(data, index=True).values.tobytes()).hexdigest()
+
+
+class Manifest:
+    """
+    states of the units of work of a download.
+    Members:
+        path: <str>: path of the manifest file.
+        entries: <dict>: key: <str>. value: <dict>: the last state, having "status"
+                 and "time", with "hash" and "rows" if done, or "error" if failed.
+    """
+    def __init__(self, name, manifest_dir=None):
+        """
+        Args:
+            name: <str>: name of the download, e.g. "table_report".
+            manifest_dir: <str>: default: cfg.manifest_dir.
+        """
+        manifest_dir = cfg.manifest_dir if manifest_dir is None else manifest_dir
+        if not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+        self.path = os.path.join(manifest_dir, name + MANIFEST_EXT)
+        self.entries = dict()
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as fin:
+                for line in fin:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the line being written when the download stopped.
+                        continue
+                    self.entries[entry.pop("key")] = entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_done(self, key):
+        entry = self.entries.get(str(key))
+        return entry is not None and entry["status"] == DONE
+
+    def pending(self, keys):
+        """
+        keys not done yet, failed or never tried.
+        """
+        return [key for key in keys if not self.is_done(key)]
+
+    @property
+    def failed(self):
+        """
+        <dict>: key: <str>. value: <str>: the last error of keys failed.
+        """
+        return dict((key, entry["error"]) for key, entry in self.entries.items()
+                    if entry["status"] == FAILED)
+
+    def _write(self, key, entry):
+        entry["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self.entries[str(key)] = entry
+            with open(self.path, "a") as fout:
+                fout.write(json.dumps(dict(entry, key=str(key))) + "\n")
+                fout.flush()
+
+    def mark_done(self, key, data=None):
+        """
+        Args:
+            key: <str>
+            data: <pandas.DataFrame>: data saved for the key, None if there's none.
+        """
+        if data is None or len(data) == 0:
+            self._write(key, {"status": DONE, "rows": 0, "hash": None})
+        else:
+            self._write(key, {"status": DONE, "rows": len(data), "hash": content_hash(data)})
+
+    def mark_failed(self, key, error):
+        self._write(key, {"status": FAILED, "error": str(error)})
+
+    def compact(self):
+        """
+        rewrite the file with one line per key.
+        """
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as fout:
+                for key, entry in self.entries.items():
+                    fout.write(json.dumps(dict(entry, key=key)) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def reset(self):
+        """
+        forget all the states, to download everything again.
+        """
+        with self._lock:
+            self.entries = dict()
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,178 @@
+"""
+Work-queue scheduler of download tasks.
+
+Tasks are fed through a bounded queue to a fixed number of worker threads.
+A task raising an exception is retried with exponential backoff, and all
+the attempts of all the workers pass through one rate limiter, so the data
+source sees no more than the configured number of requests per second.
+Progress is printed while the tasks run, and the tasks still failing after
+all the retries are reported when the workers are joined.
+"""
+
+import time
+import queue
+import random
+import threading
+
+import lavender.config as cfg
+import lavender.constant as ct
+
+
+class RateLimiter:
+    """
+    token bucket shared by threads.
+    """
+    def __init__(self, rate, burst=1):
+        """
+        Args:
+            rate: <float>: tokens added per second.
+            burst: <int>: most tokens kept, i.e. requests allowed at once after an idle time.
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        take a token, waiting until one is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Scheduler:
+    """
+    run a function on tasks in worker threads, with retries and rate limiting.
+    """
+    def __init__(self, worker, n_thread=None, max_retry=None, backoff=None, max_backoff=60.0,
+                 rate=None, queue_size=None, report_interval=5.0):
+        """
+        Args:
+            worker: <function>: called with a task, failed if raising an exception.
+            n_thread: <int>: number of worker threads. default: cfg.download_threads.
+            max_retry: <int>: number of retries of a failed task. default: cfg.download_retries.
+            backoff: <float>: seconds to wait before the first retry, doubled for each
+                              of the next ones. default: cfg.download_backoff.
+            max_backoff: <float>: longest wait before a retry, in seconds.
+            rate: <float>: most attempts per second of all the workers, None for no limit.
+                           default: cfg.download_rate.
+            queue_size: <int>: most tasks waiting in the queue. default: 2 * n_thread.
+            report_interval: <float>: seconds between progress reports.
+        """
+        self.worker = worker
+        self.n_thread = cfg.download_threads if n_thread is None else n_thread
+        self.max_retry = cfg.download_retries if max_retry is None else max_retry
+        self.backoff = cfg.download_backoff if backoff is None else backoff
+        self.max_backoff = max_backoff
+        rate = cfg.download_rate if rate is None else rate
+        self.limiter = RateLimiter(rate) if rate else None
+        self.queue_size = 2 * self.n_thread if queue_size is None else queue_size
+        self.report_interval = report_interval
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reset(0)
+
+    def _reset(self, total):
+        self.total = total
+        self.done = 0
+        self.retries = 0
+        self.failed = dict()
+        self._start = time.monotonic()
+        self._last_report = self._start
+
+    def _run_task(self, task, name):
+        for attempt in range(self.max_retry + 1):
+            if self._stop.is_set():
+                return
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                self.worker(task)
+                break
+            except Exception as err:
+                if attempt == self.max_retry:
+                    with self._lock:
+                        self.failed[name] = "%s: %s" % (type(err).__name__, err)
+                    break
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                print("%s failed(%s), retry in %.1f s..." % (name, err, delay))
+                with self._lock:
+                    self.retries += 1
+                # jitter keeps workers failing together from retrying together.
+                self._stop.wait(delay * (1 + 0.1 * random.random()))
+        with self._lock:
+            self.done += 1
+            if time.monotonic() - self._last_report >= self.report_interval:
+                self._last_report = time.monotonic()
+                self._print_progress()
+
+    def _work(self, tasks, name_of):
+        while True:
+            task = tasks.get()
+            try:
+                if task is None:
+                    return
+                self._run_task(task, name_of(task))
+            finally:
+                tasks.task_done()
+
+    def _print_progress(self):
+        seconds = time.monotonic() - self._start
+        print("%s%d/%d done, %d failed, %d retries, %.2f tasks/s%s"
+              % (ct.NEW_LINE_CHAR, self.done, self.total, len(self.failed), self.retries,
+                 self.done / seconds if seconds > 0 else 0.0, ct.NEW_LINE_CHAR))
+
+    def run(self, tasks, name_of=str):
+        """
+        run the worker on all the tasks and wait for them to finish.
+        Args:
+            tasks: <list>: tasks passed to the worker.
+            name_of: <function>: name of a task in reports, e.g. the code of a stock.
+        Returns:
+            <dict>:
+                "total": <int>: number of tasks.
+                "done": <int>: number of tasks finished, successful or not.
+                "failed": <dict>: key: <str>: name of task. value: <str>: the last error.
+                "retries": <int>: number of retries.
+                "seconds": <float>: time used.
+        """
+        tasks = list(tasks)
+        self._reset(len(tasks))
+        self._stop.clear()
+        task_queue = queue.Queue(maxsize=self.queue_size)
+        threads = [threading.Thread(target=self._work, args=(task_queue, name_of))
+                   for _ in range(self.n_thread)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for task in tasks:
+                task_queue.put(task)
+        except KeyboardInterrupt:
+            # workers drop the tasks left and quit.
+            self._stop.set()
+            raise
+        finally:
+            for _ in threads:
+                task_queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        self._print_progress()
+        if self.failed:
+            print("failed tasks:")
+            for name in sorted(self.failed):
+                print("    %s: %s" % (name, self.failed[name]))
+        return {"total": self.total, "done": self.done, "failed": dict(self.failed),
+                "retries": self.retries, "seconds": time.monotonic() - self._start}
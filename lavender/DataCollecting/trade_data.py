@@ -8,14 +8,19 @@
                          Build a class and add data-updating method.
 """
 
+import io
 import pandas as pd
 import tushare as ts
 import lavender.constant as ct
 import stock_code as sc
 import datetime
-import threading
 import os
 import lavender.config as cfg
+from scheduler import Scheduler
+from manifest import Manifest
+import lavender.util.KLineStore as Ks
+import lavender.util.IncrementalIndicator as Ii
+from lavender.util.IndicatorCache import cache_code
 
 
 def next_day_str(date_str, date_format="%Y-%m-%d"):
@@ -37,17 +42,24 @@ class StockDownloader:
     Class to download stock history data from Sina.
     """
     def __init__(self, date_range='1990-01-01:', index=False,
-                 autype='hfq', method="get_k_data"):
+                 autype='hfq', method="get_k_data", save_format="both", source=ts):
         """
         Args:
             autype: 
             method: <str>: the function name used to get stock data in tushare.
                             support: "get_k_data", "get_h_data".
+            save_format: <str>: "csv": save csv files only;
+                                "bin": save memory-mapped columnar store only (see util/KLineStore.py);
+                                "both": save both of them.
+            source: <module>: data source having the function of method, tushare by default.
+                              A local fake module can stand in for it in tests.
         """
+        self.source = source
         self.code_dir = cfg.stock_code_dir
         self.autype = autype
         self.method = method
         self.index = index
+        self.save_format = save_format
         if self.index:
             self.save_dir = cfg.index_dir
         else:
@@ -61,9 +73,7 @@ class StockDownloader:
             stock_list = sc.get_stock_codes()
         codes_list = list(stock_list.code)
         names_list = list(stock_list.name)
-        self.code_pool = zip(codes_list, names_list)
-
-        self.lock = threading.Lock()
+        self.code_pool = list(zip(codes_list, names_list))
 
         self.st_date, self.ed_date = date_range.strip().split(':')
         if len(self.st_date) == 0:
@@ -72,6 +82,69 @@ class StockDownloader:
             self.ed_date = None
         self.data_name = "%s"+ct.FILE_EXT['csv']
 
+    def _save_stock_data(self, df, code):
+        """
+        save K-line data of a stock in the formats selected by self.save_format.
+        Args:
+            df: <pandas.DataFrame>: K-line data with dates as index.
+            code: <str>
+        """
+        save_path = os.path.join(self.save_dir, self.data_name % code)
+        if self.save_format in ["csv", "both"]:
+            df.to_csv(save_path)
+        if self.save_format in ["bin", "both"]:
+            # read back the csv, so the store holds exactly what a csv reader gets.
+            if self.save_format == "both":
+                df = pd.read_csv(save_path, index_col=0, parse_dates=True)
+            Ks.write_store(df, Ks.store_dir_for(save_path))
+
+    def _as_saved(self, df):
+        """
+        K-line data as it is read back after being saved: the csv parser may
+        round floats differently from the downloaded values.
+        """
+        if self.save_format in ["csv", "both"]:
+            return pd.read_csv(io.StringIO(df.to_csv()), index_col=0)
+        return df
+
+    def _append_stock_data(self, df, code):
+        """
+        append K-line data of new dates to the saved data of a stock, in the
+        formats selected by self.save_format, without rewriting the old rows.
+        Args:
+            df: <pandas.DataFrame>: K-line data with dates as index.
+            code: <str>
+        """
+        save_path = os.path.join(self.save_dir, self.data_name % code)
+        store_dir = Ks.store_dir_for(save_path)
+        # checked before the csv file is appended, which makes the store look stale.
+        store_fresh = Ks.is_fresh(store_dir, save_path)
+        if self.save_format in ["csv", "both"]:
+            Ks.append_csv(df, save_path)
+        if self.save_format in ["bin", "both"]:
+            if store_fresh:
+                Ks.append_store(self._as_saved(df), store_dir)
+            elif self.save_format == "both":
+                Ks.write_store(pd.read_csv(save_path, index_col=0, parse_dates=True), store_dir)
+            else:
+                Ks.write_store(df, store_dir)
+
+    def _last_saved_date(self, code):
+        """
+        get the last saved date of a stock, reading only the end of its data.
+        Returns:
+            <str>: "YYYY-MM-DD", None if no row is saved.
+        """
+        data_path = os.path.join(self.save_dir, self.data_name % code)
+        if os.path.exists(data_path):
+            return Ks.last_csv_date(data_path)
+        last_date = Ks.last_store_date(Ks.store_dir_for(data_path))
+        return None if last_date is None else last_date.strftime("%Y-%m-%d")
+
+    def _has_stock_data(self, code):
+        data_path = os.path.join(self.save_dir, self.data_name % code)
+        return os.path.exists(data_path) or Ks.is_fresh(Ks.store_dir_for(data_path))
+
     def _download_stock_data(self, code, overwrite=False, **kwargs):
         """
         Args:
@@ -80,14 +153,15 @@ class StockDownloader:
             **kwargs:
     
         Returns:
+            <pandas.DataFrame>: data saved, None if the data already exist.
         """
         if not os.path.exists(self.save_dir):
             os.makedirs(self.save_dir)
         save_path = os.path.join(self.save_dir, self.data_name % code)
-        if not overwrite and os.path.exists(save_path):
+        if not overwrite and self._has_stock_data(code):
             print("%s already exist!" % save_path)
         else:
-            df = getattr(ts, self.method)(code, **kwargs)
+            df = getattr(self.source, self.method)(code, **kwargs)
             if not df.empty:
                 # "get_k_data" use a range of numbers as index,
                 # while "get_h_data" use date as index.
@@ -95,67 +169,99 @@ class StockDownloader:
                     df = df.set_index("date")
                 except KeyError:
                     pass
-                df.sort_index().to_csv(save_path)
+                df = df.sort_index()
+                self._save_stock_data(df, code)
+            return df
 
-    def _get_market_stock_data(self):
+    def _is_downloaded(self, code):
         """
-        get "Fu Quan" data from Sina website using tushare.
+        check if a stock is done in the manifest of downloading and its data are not gone.
         """
-        while self.code_pool:
-            with self.lock:
-                try:
-                    code, stock_name = self.code_pool.pop()
-                except IndexError:
-                    pass
+        if not self.manifest.is_done(code):
+            return False
+        return self.manifest.entries[code]["rows"] == 0 or self._has_stock_data(code)
 
-            print("%s get data: %s %s" % (ct.NEW_LINE_CHAR, stock_name, ct.NEW_LINE_CHAR))
-            self._download_stock_data(code, start=self.st_date, end=self.ed_date,
+    def _get_market_stock_data(self, task):
+        """
+        get "Fu Quan" data of a stock from Sina website using tushare.
+        Args:
+            task: <tuple>: (code, stock name).
+        """
+        code, stock_name = task
+        print("%s get data: %s %s" % (ct.NEW_LINE_CHAR, stock_name, ct.NEW_LINE_CHAR))
+        # a file left by an interrupted download may be incomplete, so overwrite it.
+        df = self._download_stock_data(code, overwrite=True, start=self.st_date, end=self.ed_date,
+                                       autype=self.autype, index=self.index)
+        self.manifest.mark_done(code, df)
+
+    def _update_stock_data(self, code):
+        """
+        download the K-line data of a stock after its last saved date, and append it.
+        """
+        last_date = self._last_saved_date(code) if self._has_stock_data(code) else None
+        if last_date is None:
+            self._download_stock_data(code, overwrite=True, start=self.st_date, end=self.ed_date,
                                       autype=self.autype, index=self.index)
+            return
 
-    def _update_code_list_stock_data(self):
+        continue_date = next_day_str(last_date)
+        print(continue_date)
+        new_data = getattr(self.source, self.method)(code, start=continue_date, end=self.ed_date,
+                                            autype=self.autype, index=self.index)
+        if new_data.empty:
+            return
+        # "get_k_data" use a range of numbers as index,
+        # while "get_h_data" use date as index.
+        try:
+            new_data = new_data.set_index("date")
+        except KeyError:
+            pass
+        new_data = new_data.sort_index()
+        new_data.index = new_data.index.astype(str)
+        new_data = new_data[new_data.index > last_date]
+        if new_data.empty:
+            return
+        self._append_stock_data(new_data, code)
+        if cfg.indicator_cache_enabled:
+            # extend cached indicators by the new bars instead of recomputing them.
+            Ii.extend_code(cache_code(self.save_dir, code), self._as_saved(new_data), last_date)
+
+    def _update_code_list_stock_data(self, task):
         """
-        Update stocks listed in code list files.
+        Update a stock listed in code list files.
+        Args:
+            task: <tuple>: (code, stock name).
         """
+        code, stock_name = task
+        print("%s update data: %s %s" % (ct.NEW_LINE_CHAR, stock_name, ct.NEW_LINE_CHAR))
+        self._update_stock_data(code)
 
-        while self.code_pool:
-            with self.lock:
-                try:
-                    code, stock_name = self.code_pool.pop()
-                except IndexError:
-                    pass
+    def run(self, mod="update", n_thread=None, max_retry=None, rate=None):
+        """
+        download or update the stocks in the code pool, and wait for them to finish.
+        Args:
+            mod: <str>: "update": download data after the last saved date;
+                        otherwise: download the whole data of stocks, resuming from
+                        the manifest of the former run(see DataCollecting/manifest.py).
+            n_thread: <int>: number of threads. default: cfg.download_threads.
+            max_retry: <int>: retries of a failed stock. default: cfg.download_retries.
+            rate: <float>: most requests per second. default: cfg.download_rate.
+        Returns:
+            <dict>: report of the run, with codes failed in "failed"(see Scheduler.run).
+        """
+        worker = self._update_code_list_stock_data if mod == "update" else self._get_market_stock_data
+        scheduler = Scheduler(worker, n_thread=n_thread, max_retry=max_retry, rate=rate)
+        if mod == "update":
+            return scheduler.run(self.code_pool, name_of=lambda task: task[0])
 
-                print("%s update data: %s %s" % (ct.NEW_LINE_CHAR, stock_name, ct.NEW_LINE_CHAR))
-                stock_file = os.path.join(self.save_dir, code+ct.FILE_EXT['csv'])
-
-                if not os.path.exists(stock_file):
-                    self._download_stock_data(code, start=self.st_date, end=self.ed_date,
-                                              autype=self.autype, index=self.index)
-                else:
-                    data_path = os.path.join(self.save_dir, self.data_name % code)
-                    old_data = pd.read_csv(data_path, index_col=0)
-                    continue_date = next_day_str(old_data.index[-1])
-                    print(continue_date)
-                    new_data = getattr(ts, self.method)(code, start=continue_date, end=self.ed_date,
-                                                        autype=self.autype, index=self.index)
-
-                    if not new_data.empty:
-                        # "get_k_data" use a range of numbers as index,
-                        # while "get_h_data" use date as index.
-                        try:
-                            new_data = new_data.set_index("date")
-                        except KeyError:
-                            pass
-                        new_data = new_data.sort_index()
-                        new_data.index = new_data.index.astype(str)
-                        concat_data = pd.concat([old_data, new_data])
-                        concat_data.to_csv(data_path)
-
-    def run(self, mod="update", n_thread=10):
-        for i_thread in range(n_thread):
-            if mod == "update":
-                threading.Thread(target=self._update_code_list_stock_data).start()
-            else:
-                threading.Thread(target=self._get_market_stock_data).start()
+        self.manifest = Manifest("kline_%s" % os.path.basename(os.path.normpath(self.save_dir)))
+        tasks = [task for task in self.code_pool if not self._is_downloaded(task[0])]
+        print("%d of %d stocks to download." % (len(tasks), len(self.code_pool)))
+        report = scheduler.run(tasks, name_of=lambda task: task[0])
+        for code, error in report["failed"].items():
+            self.manifest.mark_failed(code, error)
+        self.manifest.compact()
+        return report
 
 
 if __name__ == "__main__":
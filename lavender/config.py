@@ -5,6 +5,8 @@ import os
 support_window = 20
 resistance_window = 20
 lag_window = 500
+# memory budget of the process-wide K line cache(see util/KLineCache.py), in bytes.
+kline_cache_bytes = 1024 * 1024 * 1024
 
 # work_dir = r"C:\Users\Administrator\Desktop\lavender\lavender"
 work_dir = os.path.dirname(__file__)
@@ -19,14 +21,55 @@ table_dir = os.path.join(root_data_dir, table_subdir)
 kline_dir = os.path.join(root_data_dir, daily_kline_subdir)
 index_dir = os.path.join(root_data_dir, index_subdir)
 
+# memory-mapped columnar copies of the K-line csv files (see util/KLineStore.py),
+# each stored beside its csv directory with a "_bin" suffix.
+bin_dir_suffix = "_bin"
+kline_bin_dir = kline_dir + bin_dir_suffix
+index_bin_dir = index_dir + bin_dir_suffix
+
+# master trading calendar built from the index data (see util/TradeCalendar.py)
+calendar_path = os.path.join(root_data_dir, "calendar", "trade_days.npy")
+# first trading dates of stocks built from their K lines (see util/ListingIndex.py)
+listing_index_path = os.path.join(root_data_dir, "calendar", "listing_dates.csv")
+
+# whole-market panel of daily K lines (see util/PanelStore.py)
+panel_dir = os.path.join(root_data_dir, "panel")
+market_panel_path = os.path.join(panel_dir, "market.panel")
+
+# on-disk cache of K-line indicators(see util/IndicatorCache.py)
+indicator_cache_enabled = True
+indicator_cache_dir = os.path.join(root_data_dir, "cache", "indicators")
+indicator_cache_bytes = 2 * 1024 * 1024 * 1024
+
+# downloading(see DataCollecting/scheduler.py)
+download_threads = 10
+download_retries = 3
+download_backoff = 1.0      # seconds before the first retry, doubled for each next one.
+download_rate = 5.0         # most requests per second to the data source, 0 for no limit.
+# checkpoints of downloads(see DataCollecting/manifest.py)
+manifest_dir = os.path.join(root_data_dir, "manifest")
+# writing downloads into databases(see DataCollecting/db_writer.py)
+db_batch_rows = 200000      # rows written in a transaction before it is committed.
+db_flush_seconds = 5.0      # longest time a transaction stays open.
+db_queue_size = 32          # most frames waiting for the writer.
+report_revision_days = 30   # days after the deadline of a season's reports updates still fetch it.
+
+# database of financial statements of all the stocks(see util/StatementStore.py)
+statement_db_path = os.path.join(table_dir, "statements.db")
+
 # directories of financial statements
 balance_sheet_dir = os.path.join(root_data_dir, "fin_stat", "balance")
 profit_statement_dir = os.path.join(root_data_dir, "fin_stat", "income")
 cash_flow_dir = os.path.join(root_data_dir, "fin_stat", "cash_flow")
+# sample pages of financial statements(see DataCollecting/fin_statement_parser.py)
+sample_page_dir = os.path.join(root_data_dir, "fin_stat", "samples")
 
 # directory of filtered stocks
 pool_dir = os.path.join(work_dir, "result", "pool")
 
+# directory of back test results of pools(see strategy/parallel.py)
+backtest_result_dir = os.path.join(work_dir, "result", "backtest")
+
 # directory of pictures output
 root_pic_dir = os.path.join(work_dir, "result", "pics")
 fundamental_pic_dir = os.path.join(root_pic_dir, "fundamental")
@@ -74,6 +74,23 @@ def get_years(year_range):
     return years
 
 
+def split_date_range(date_range):
+    """
+    split a string of date range.
+    Args:
+        date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD", dates could be partial
+                           (like "2012:2016") or empty (like "2012:").
+    Returns:
+        st_date, ed_date: <str>: None for empty dates.
+    """
+    st_date, ed_date = date_range.strip().split(':')
+    if len(st_date) == 0:
+        st_date = None
+    if len(ed_date) == 0:
+        ed_date = None
+    return st_date, ed_date
+
+
 def gen_engine(table_name):
     """
     Args:
@@ -8,8 +8,9 @@ history: 2016.06.05 Initiated
 """
 
 from pylab import *
-from strategy import Strategy
+from lavender.strategy.strategy import Strategy
 from lavender.util.DailyKLineIO import KLine
+from lavender.util.TradeCalendar import trade_calendar
 from decimal import Decimal as Dec
 import pandas as pd
 import lavender.config as cfg
@@ -21,6 +22,305 @@ import os
 import time
 
 
+def hold_states(exist, buy, sell):
+    """
+    holding states of trading at open time, the same as the loop in BackTest.trade_open:
+    on days the indicators exist, a "buy" signal makes the stock held from the next
+    day when not holding, and a "sell" signal sold on the next day when holding.
+    Args:
+        exist: <numpy.ndarray: bool>: whether indicators exist on each day.
+        buy: <numpy.ndarray: bool>: buy signals on each day.
+        sell: <numpy.ndarray: bool>: sell signals on each day.
+    Returns:
+        <numpy.ndarray: bool>: whether the stock is held till close on each day.
+    """
+    exist = numpy.asarray(exist, dtype=bool)
+    buy = numpy.asarray(buy, dtype=bool) & exist
+    sell = numpy.asarray(sell, dtype=bool) & exist
+    ndays = len(exist)
+    # the state to hold or not after each signal day, NaN on days without signals.
+    events = numpy.full(ndays, numpy.nan)
+    events[buy & ~sell] = 1.0
+    events[sell & ~buy] = 0.0
+    conflicts = numpy.flatnonzero(buy & sell)
+    if len(conflicts):
+        # with both signals the state switches, so it depends on the former state.
+        is_event = ~numpy.isnan(events)
+        is_event[conflicts] = True
+        last_event = numpy.maximum.accumulate(numpy.where(is_event, numpy.arange(ndays), -1))
+        for iday in conflicts:
+            last = last_event[iday - 1] if iday > 0 else -1
+            events[iday] = 1.0 - events[last] if last >= 0 else 1.0
+    state = pd.Series(events).ffill().fillna(0.0).values
+    # the state decided on the last day is taken on days the indicators exist.
+    is_hold = numpy.zeros(ndays, dtype=bool)
+    is_hold[1:] = state[:-1] == 1.0
+    return is_hold & exist
+
+
+def open_trade_returns(exist, hold, open_price, close_price, brokerage, stamp_duty):
+    """
+    daily returns of trading at open time with given holding states.
+    As in BackTest.trade_open, days the indicators don't exist return nothing.
+    Args:
+        exist: <numpy.ndarray: bool>: whether indicators exist on each day.
+        hold: <numpy.ndarray: bool>: whether the stock is held till close on each day.
+        open_price: <numpy.ndarray>
+        close_price: <numpy.ndarray>
+        brokerage: <float>
+        stamp_duty: <float>
+    Returns:
+        <numpy.ndarray>: daily returns.
+    """
+    open_price = numpy.asarray(open_price, dtype=float)
+    close_price = numpy.asarray(close_price, dtype=float)
+    prev_hold = numpy.zeros(len(hold), dtype=bool)
+    prev_hold[1:] = hold[:-1]
+    prev_close = numpy.full(len(close_price), numpy.nan)
+    prev_close[1:] = close_price[:-1]
+
+    daily_return = numpy.zeros(len(hold))
+    # go on holding
+    keep = hold & prev_hold
+    daily_return[keep] = (close_price[keep] - prev_close[keep]) / prev_close[keep]
+    # buy in the stock once open
+    buy_in = hold & ~prev_hold
+    daily_return[buy_in] = close_price[buy_in] / open_price[buy_in] / (1 + brokerage) - 1
+    # sell the stock once open
+    sell_out = numpy.asarray(exist, dtype=bool) & ~hold & prev_hold
+    daily_return[sell_out] = open_price[sell_out] / prev_close[sell_out] * (1 - brokerage - stamp_duty) - 1
+    return daily_return
+
+
+def portfolio_open_trades(exist, buy, sell, open_price, close_price, high_price, low_price,
+                          brokerage, stamp_duty, n_units=10):
+    """
+    trade a bucket of stocks at open time, with (days x codes) matrices.
+    Each day is one step of vector operations over codes, following Portfolio.trade_open:
+        1. a stock to hold(bought on a "buy" signal) is bought at open with a unit
+           position(1/n_units of the net value), if cash is enough and it's not limit up.
+        2. a stock to sell(on a "sell" signal) is sold at open, unless it's limit down,
+           then it is held on and sold on the next day.
+        3. suspended stocks are held on with their values unchanged.
+    Buys and sells on the same day are settled in the order of codes.
+    Args:
+        exist: <numpy.ndarray: bool>: whether indicators exist, False while suspended.
+        buy: <numpy.ndarray: bool>: buy signals.
+        sell: <numpy.ndarray: bool>: sell signals.
+        open_price: <numpy.ndarray>: NaN while suspended.
+        close_price: <numpy.ndarray>: NaN while suspended.
+        high_price: <numpy.ndarray>: NaN while suspended.
+        low_price: <numpy.ndarray>: NaN while suspended.
+        brokerage: <float>
+        stamp_duty: <float>
+        n_units: <int>: number of unit positions in the net value.
+    Returns:
+        <dict>: "net_value", "daily_return", "cash_held": <numpy.ndarray>: (days).
+                "holdings": <numpy.ndarray>: (days x codes), values of stocks held at close.
+    """
+    ndays, ncodes = close_price.shape
+    # close price of the last trading day of each stock.
+    prev_close = pd.DataFrame(close_price).ffill().shift(1).values
+    with numpy.errstate(invalid="ignore"):
+        buy_ok = ~((high_price == low_price) & (high_price > prev_close))
+        sell_ok = ~((high_price == low_price) & (high_price < prev_close))
+    exist = exist & ~numpy.isnan(close_price)
+
+    net_value = numpy.empty(ndays)
+    daily_return = numpy.empty(ndays)
+    cash_list = numpy.empty(ndays)
+    holdings = numpy.zeros((ndays, ncodes))
+
+    net, cash = 1.0, 1.0
+    value = numpy.zeros(ncodes)
+    held = numpy.zeros(ncodes, dtype=bool)
+    to_hold = numpy.zeros(ncodes, dtype=bool)
+    for iday in range(ndays):
+        ex = exist[iday]
+        close, open_, last_close = close_price[iday], open_price[iday], prev_close[iday]
+        delta = 0.0
+
+        # go on holding, or fail to sell.
+        keep = ex & held & (to_hold | ~sell_ok[iday])
+        delta += numpy.sum((close[keep] - last_close[keep]) / last_close[keep] * value[keep])
+        value[keep] = close[keep] / last_close[keep] * value[keep]
+
+        # sell the stock once open.
+        sell_out = ex & held & ~to_hold & sell_ok[iday]
+        proceeds = numpy.zeros(ncodes)
+        proceeds[sell_out] = open_[sell_out] / last_close[sell_out] * (1 - brokerage - stamp_duty) * value[sell_out]
+        delta += numpy.sum(proceeds[sell_out] - value[sell_out])
+        value[sell_out] = 0.0
+        held[sell_out] = False
+
+        # buy in the stock once open, with cash left after the former codes are traded.
+        position = net / n_units
+        buy_in = ex & to_hold & ~held
+        rejected = buy_in & ~buy_ok[iday]
+        for icode in numpy.flatnonzero(sell_out | (buy_in & buy_ok[iday])):
+            if sell_out[icode]:
+                cash += proceeds[icode]
+            elif Dec(str(cash)) < Dec(str(position)):
+                rejected[icode] = True
+            else:
+                cash -= position
+        bought = buy_in & ~rejected
+        delta += numpy.sum((close[bought] / open_[bought] / (1 + brokerage) - 1) * position)
+        value[bought] = close[bought] * position / open_[bought] / (1 + brokerage)
+        held[bought] = True
+
+        # prepare to trade on the next day.
+        signal_buy = ex & ~to_hold & buy[iday]
+        to_hold[rejected | (ex & held & to_hold & sell[iday])] = False
+        to_hold[signal_buy] = True
+
+        daily_return[iday] = delta / net
+        net += delta
+        net_value[iday] = net
+        cash_list[iday] = cash
+        holdings[iday] = value
+    return {"net_value": net_value, "daily_return": daily_return,
+            "cash_held": cash_list, "holdings": holdings}
+
+
+def _draw_down_states(net_value):
+    """
+    running states of net value curves, days along the first axis.
+    Returns:
+        prev_high: <numpy.ndarray>: the highest net value before each day(at least 0).
+        last_index: <function>: last_index(mask) gives, for each day, the index of the
+                    last day(up to the day) where mask is True, -1 if none.
+    """
+    ndays = net_value.shape[0]
+    prev_high = numpy.zeros(net_value.shape)
+    if ndays > 1:
+        prev_high[1:] = numpy.fmax.accumulate(numpy.fmax(net_value[:-1], 0.0), axis=0)
+    days = numpy.arange(ndays).reshape((-1,) + (1,) * (net_value.ndim - 1))
+
+    def last_index(mask):
+        return numpy.maximum.accumulate(numpy.where(mask, days, -1), axis=0)
+    return prev_high, last_index
+
+
+def draw_downs(net_value):
+    """
+    max draw down of net value curves, the same as PerformanceMeasure.max_draw_down.
+    Args:
+        net_value: <numpy.ndarray>: (days) or (days x curves).
+    Returns:
+        draw_down_max: <numpy.ndarray>: max draw down of each curve.
+        st_index: <numpy.ndarray: int>: index of the day of the last high before it, -1 if none.
+        ed_index: <numpy.ndarray: int>: index of the day it happened, -1 if no draw down.
+    """
+    net_value = numpy.asarray(net_value, dtype=float)
+    prev_high, last_index = _draw_down_states(net_value)
+    high = numpy.fmax(prev_high, net_value)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        draw_down = numpy.where(net_value > prev_high, 0.0, 1 - net_value / prev_high)
+    draw_down = numpy.where(numpy.isnan(draw_down), -numpy.inf, draw_down)
+    draw_down = numpy.where(high > 0, draw_down, -numpy.inf)
+    ed_index = numpy.argmax(draw_down, axis=0) if len(net_value) else numpy.zeros(net_value.shape[1:], int)
+    draw_down_max = numpy.take_along_axis(draw_down, numpy.expand_dims(ed_index, 0), axis=0)[0] \
+        if len(net_value) else numpy.zeros(net_value.shape[1:])
+    has_draw_down = draw_down_max > 0
+    draw_down_max = numpy.where(has_draw_down, draw_down_max, 0.0)
+    st_index = numpy.take_along_axis(last_index(net_value > prev_high), numpy.expand_dims(ed_index, 0),
+                                     axis=0)[0] if len(net_value) else ed_index
+    return draw_down_max, numpy.where(has_draw_down, st_index, -1), numpy.where(has_draw_down, ed_index, -1)
+
+
+def draw_down_durations(net_value):
+    """
+    longest draw down duration of net value curves, the same as
+    PerformanceMeasure.max_draw_down_duration.
+    Args:
+        net_value: <numpy.ndarray>: (days) or (days x curves).
+    Returns:
+        duration_max: <numpy.ndarray: int>: number of trading days of the longest draw down.
+        st_index: <numpy.ndarray: int>: index of the day of the high it started from, -1 if none.
+        ed_index: <numpy.ndarray: int>: index of its last day, -1 if no draw down.
+    """
+    net_value = numpy.asarray(net_value, dtype=float)
+    if not len(net_value):
+        empty = numpy.zeros(net_value.shape[1:], dtype=int)
+        return empty, empty - 1, empty - 1
+    prev_high, last_index = _draw_down_states(net_value)
+    # using ">=" to exclude duration without holding stock.
+    high_index = last_index(net_value >= prev_high)
+    days = numpy.arange(len(net_value)).reshape((-1,) + (1,) * (net_value.ndim - 1))
+    duration = days - high_index
+    ed_index = numpy.argmax(duration, axis=0)
+    duration_max = numpy.take_along_axis(duration, numpy.expand_dims(ed_index, 0), axis=0)[0]
+    st_index = numpy.take_along_axis(high_index, numpy.expand_dims(ed_index, 0), axis=0)[0]
+    has_draw_down = duration_max > 0
+    return duration_max, numpy.where(has_draw_down, st_index, -1), numpy.where(has_draw_down, ed_index, -1)
+
+
+def performance_metrics(net_value, years, daily_return=None, hold=None, window=ct.TRADE_DAYS):
+    """
+    performance measures of net value curves, all computed on arrays.
+    Args:
+        net_value: <numpy.ndarray>: (days) or (days x curves), starting from 1.0 before the first day.
+        years: <float>: fractional years of the test.
+        daily_return: <numpy.ndarray>: the same shape as net_value. default: from net_value.
+        hold: <numpy.ndarray>: positions(e.g. 1 for holding, 0 for not), the same shape as
+              net_value, used for turnover and exposure. default: days with returns are
+              taken as holding days.
+        window: <int>: number of days of rolling Sharpe ratios.
+    Returns:
+        <dict>: scalars for a 1-D net_value, arrays of curves for a 2-D one:
+            "net_value": the last net value.
+            "cagr": compound average growth rate.
+            "sharp_ratio": the same as PerformanceMeasure.sharp_ratio.
+            "sortino_ratio": excess CAGR over annualized downside deviation.
+            "calmar_ratio": CAGR over max draw down.
+            "max_draw_down", "max_draw_down_duration"
+            "win_rate": ratio of days with positive returns to days with returns.
+            "turnover": yearly number of position changes.
+            "exposure": ratio of holding days.
+            "rolling_sharp_ratio": <numpy.ndarray>: (days) or (days x curves), annualized
+                                   Sharpe ratios of daily returns in the rolling window.
+    """
+    net_value = numpy.asarray(net_value, dtype=float)
+    is_1d = net_value.ndim == 1
+    if is_1d:
+        net_value = net_value[:, None]
+    if daily_return is None:
+        prev_value = numpy.vstack([numpy.ones((1, net_value.shape[1])), net_value[:-1]])
+        daily_return = net_value / prev_value - 1
+    daily_return = numpy.asarray(daily_return, dtype=float).reshape(net_value.shape)
+    if hold is None:
+        hold = daily_return != 0
+    hold = numpy.asarray(hold, dtype=float).reshape(net_value.shape)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        cagr = net_value[-1] ** (1.0 / years) - 1
+        annual_std = numpy.std(daily_return, axis=0) * numpy.sqrt(ct.TRADE_DAYS)
+        downside = numpy.sqrt(numpy.mean(numpy.minimum(daily_return, 0.0) ** 2, axis=0)) * numpy.sqrt(ct.TRADE_DAYS)
+        draw_down_max = draw_downs(net_value)[0]
+        has_return = daily_return != 0
+        rolling = pd.DataFrame(daily_return).rolling(window=window)
+        rolling_sharp = ((rolling.mean() - ct.REF_RETURN / ct.TRADE_DAYS) / rolling.std(ddof=0)).values \
+            * numpy.sqrt(ct.TRADE_DAYS)
+        metrics = {
+            "net_value": net_value[-1],
+            "cagr": cagr,
+            "sharp_ratio": (cagr - ct.REF_RETURN) / annual_std,
+            "sortino_ratio": (cagr - ct.REF_RETURN) / downside,
+            "calmar_ratio": cagr / draw_down_max,
+            "max_draw_down": draw_down_max,
+            "max_draw_down_duration": draw_down_durations(net_value)[0],
+            "win_rate": (daily_return > 0).sum(axis=0) / has_return.sum(axis=0).astype(float),
+            "turnover": numpy.abs(numpy.diff(hold, axis=0, prepend=0.0)).sum(axis=0) / years,
+            "exposure": hold.mean(axis=0),
+            "rolling_sharp_ratio": rolling_sharp,
+        }
+    if is_1d:
+        metrics = dict((key, value[:, 0] if key == "rolling_sharp_ratio" else value[0])
+                       for key, value in metrics.items())
+    return metrics
+
+
 class PerformanceMeasure:
     """
     class for performance measures for a strategy.
@@ -61,50 +361,36 @@ class PerformanceMeasure:
                 ed_date_max: the end date of the longest-draw-down.
 
         """
-        draw_down_duration = 0
-        draw_down_duration_max = 0
-        high_value = 0
-        st_date = None
-        st_date_max = None
-        ed_date_max = None
-
-        for iday in range(self.ndays):
-            net_value = self.result.net_value.iloc[iday]
-            # using ">=" to exclude duration without holding stock.
-            if net_value >= high_value:
-                draw_down_duration = 0
-                high_value = net_value
-                st_date = self.dates[iday]
-            else:
-                draw_down_duration += 1
-                if draw_down_duration > draw_down_duration_max:
-                    draw_down_duration_max = draw_down_duration
-                    st_date_max = st_date
-                    ed_date_max = self.dates[iday]
-
-        return draw_down_duration_max, st_date_max, ed_date_max
+        duration_max, st_index, ed_index = [int(value) for value in
+                                            draw_down_durations(self.result.net_value.values)]
+        return (duration_max, self.dates[st_index] if st_index >= 0 else None,
+                self.dates[ed_index] if ed_index >= 0 else None)
 
     def max_draw_down(self):
         """
         calculate max draw down in the test period.
         """
-        draw_down_max = 0
-        high_value = 0
-        st_date_max = None
-        ed_date_max = None
-        st_date = None
-        for iday in range(self.ndays):
-            net_value = self.result.net_value.iloc[iday]
-            if net_value > high_value:
-                high_value = net_value
-                st_date = self.dates[iday]
-            else:
-                draw_down = 1 - net_value / high_value
-                if draw_down_max < draw_down:
-                    draw_down_max = draw_down
-                    st_date_max = st_date
-                    ed_date_max = self.dates[iday]
-        return draw_down_max, st_date_max, ed_date_max
+        draw_down_max, st_index, ed_index = draw_downs(self.result.net_value.values)
+        st_index, ed_index = int(st_index), int(ed_index)
+        return (float(draw_down_max) if draw_down_max > 0 else 0, self.dates[st_index] if st_index >= 0 else None,
+                self.dates[ed_index] if ed_index >= 0 else None)
+
+    def metrics(self, window=ct.TRADE_DAYS):
+        """
+        all the performance measures in one pass(see performance_metrics).
+        Args:
+            window: <int>: number of days of rolling Sharpe ratios.
+        Returns:
+            <dict>: "rolling_sharp_ratio" is a <pandas.Series> with dates as index.
+        """
+        hold = getattr(self, "hold_list", None)
+        if hold is not None and len(hold) != self.ndays:
+            hold = None
+        metrics = performance_metrics(self.result.net_value.values, self.years,
+                                      daily_return=self.result.daily_return.values, hold=hold,
+                                      window=window)
+        metrics["rolling_sharp_ratio"] = pd.Series(metrics["rolling_sharp_ratio"], index=self.dates)
+        return metrics
 
     @property
     def sharp_ratio(self):
@@ -135,13 +421,14 @@ class PerformanceMeasure:
         # font = fm.FontProperties(fname=ct.FONT_PATH)
         # ax.set_title(label="%s (%s)" % (ct.get_code_name(self.code), self.code), fontproperties=font)
         self.result.net_value.plot()
-        ax.annotate("max draw down: %0.2f%%" % (self.max_draw_down()[0]*100), xy=(0.05, 0.9),
+        metrics = self.metrics()
+        ax.annotate("max draw down: %0.2f%%" % (metrics["max_draw_down"]*100), xy=(0.05, 0.9),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
-        ax.annotate("max draw down duration: %d days" % self.max_draw_down_duration()[0], xy=(0.05, 0.85),
+        ax.annotate("max draw down duration: %d days" % metrics["max_draw_down_duration"], xy=(0.05, 0.85),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
-        ax.annotate("Sharp ratio: %0.2f" % self.sharp_ratio, xy=(0.05, 0.8),
+        ax.annotate("Sharp ratio: %0.2f" % metrics["sharp_ratio"], xy=(0.05, 0.8),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
-        ax.annotate("Compound Average Growth Rate: %0.2f%%" % (self.cagr*100), xy=(0.05, 0.75),
+        ax.annotate("Compound Average Growth Rate: %0.2f%%" % (metrics["cagr"]*100), xy=(0.05, 0.75),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
         if save_name is not None:
             save_dir = os.path.join(cfg.technical_pic_dir, self.strategy)
@@ -177,7 +464,7 @@ class BackTest(Strategy, PerformanceMeasure):
     """
 
     def __init__(self, code, date_range=None, brokerage=0.001,
-                 stamp_duty=0.001):
+                 stamp_duty=0.001, k_line=None):
         """
         initialization...
         Args:
@@ -185,13 +472,19 @@ class BackTest(Strategy, PerformanceMeasure):
             date_range: <str>: date range of the test.
             brokerage: <float>: the brokerage of stock exchanging.
             stamp_duty: <float>: the stamp duty of stock exchanging.
+            k_line: <DailyKLineIO.KLine>: K line to test on, e.g. shared by many tests, so
+                    indicators are computed once. It should be cut to date_range already.
+                    default: load the K line of code.
         """
 
         self.code = code
         self.date_range = date_range
-        self.k_line = KLine(code)
-        if date_range is not None:
-            self.k_line.date_cut(date_range)
+        if k_line is None:
+            self.k_line = KLine(code)
+            if date_range is not None:
+                self.k_line.date_cut(date_range)
+        else:
+            self.k_line = k_line
         PerformanceMeasure.__init__(self, self.k_line.date)
         if self.ndays == 0:
             print('warning: stock data empty!')
@@ -219,8 +512,9 @@ class BackTest(Strategy, PerformanceMeasure):
         """
         calculate the return of reference line.
         """
-        st_net_value = self.ref_line().open.ix[0]
-        ed_net_value = self.ref_line().close.ix[-1]
+        ref_k_line = self.ref_line()
+        st_net_value = ref_k_line.open.ix[0]
+        ed_net_value = ref_k_line.close.ix[-1]
         return ed_net_value/st_net_value
 
     def trade_open(self, strategy, show_value=True, **kwargs):
@@ -240,17 +534,17 @@ class BackTest(Strategy, PerformanceMeasure):
 
         # strategy initialization
         if hasattr(self, '_init_%s' % strategy):
-            getattr(self, '_init_%s' % strategy)(self.k_line)
+            getattr(self, '_init_%s' % strategy)([self.code], {self.code: self.k_line})
 
         is_hold = False
         
-        open_price = self.k_line.stock_data['open']
-        close_price = self.k_line.stock_data['close']
+        open_price = self.k_line.stock_data['open'].values
+        close_price = self.k_line.stock_data['close'].values
 
         for iday in range(0, self.ndays):
             date = self.dates[iday]
             # back test begin if strategy indicators exits
-            if not getattr(self, strategy)('exist', self.k_line, date, **kwargs):
+            if not getattr(self, strategy)('exist', self.k_line, date, row=iday, **kwargs):
                 daily_return_list.append(0)
                 self.hold_list.append(0)
                 net_value_list.append(self.net_value)
@@ -268,7 +562,7 @@ class BackTest(Strategy, PerformanceMeasure):
                     self.net_value *= (1+daily_return)
                 self.hold_list.append(1)
                 # prepare to sell stock the next day
-                if getattr(self, strategy)('sell', self.k_line, date, **kwargs):
+                if getattr(self, strategy)('sell', self.k_line, date, row=iday, **kwargs):
                     is_hold = False
         
             else:
@@ -283,7 +577,7 @@ class BackTest(Strategy, PerformanceMeasure):
                     daily_return = 0
                 self.hold_list.append(0)
                 # prepare to buy the stock the next day
-                if getattr(self, strategy)('buy', self.k_line, date, **kwargs):
+                if getattr(self, strategy)('buy', self.k_line, date, row=iday, **kwargs):
                     is_hold = True
             net_value_list.append(self.net_value)
             daily_return_list.append(daily_return)
@@ -297,6 +591,36 @@ class BackTest(Strategy, PerformanceMeasure):
         else:
             return self.result
 
+    def trade_open_vectorized(self, strategy, show_value=True, **kwargs):
+        """
+        the same test as trade_open, with signals of the whole dates given by
+        the array version of the strategy("<strategy>_signals", see Strategy class).
+        Inputs:
+            strategy: <str>: string of strategy function name, e.g. "dual_ma_strategy".
+            show_value: <logic>: weather to print the latest net value.
+        """
+        if self.result is not None:
+            self.__init__(self.code, date_range=self.date_range)
+
+        exist, buy, sell = getattr(self, strategy + "_signals")(self.k_line, **kwargs)
+        hold = hold_states(exist, buy, sell)
+        daily_return = open_trade_returns(exist, hold, self.k_line.stock_data['open'].values,
+                                          self.k_line.stock_data['close'].values,
+                                          self.brokerage, self.stamp_duty)
+        net_value = self.net_value * numpy.cumprod(1 + daily_return)
+        if self.ndays:
+            self.net_value = net_value[-1]
+        self.hold_list = hold.astype(int).tolist()
+
+        self.result = pd.DataFrame({'net_value': net_value,
+                                    'daily_return': daily_return},
+                                   index=self.dates)
+        self.strategy = strategy
+        if show_value:
+            return 20*"*" + "%s Net Value: %f" % (strategy, self.result['net_value'].iloc[-1]) + 20*"*"
+        else:
+            return self.result
+
     def plot(self, save_name=None):
         """
         plot the result of back test.
@@ -310,13 +634,14 @@ class BackTest(Strategy, PerformanceMeasure):
         font = fm.FontProperties(fname=ct.FONT_PATH)
         ax.set_title(label="%s (%s)" % (ct.get_code_name(self.code), self.code), fontproperties=font)
         self.result.net_value.plot()
-        ax.annotate("max draw down: %0.2f%%" % (self.max_draw_down()[0]*100), xy=(0.05, 0.9),
+        metrics = self.metrics()
+        ax.annotate("max draw down: %0.2f%%" % (metrics["max_draw_down"]*100), xy=(0.05, 0.9),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
-        ax.annotate("max draw down duration: %d days" % self.max_draw_down_duration()[0], xy=(0.05, 0.85),
+        ax.annotate("max draw down duration: %d days" % metrics["max_draw_down_duration"], xy=(0.05, 0.85),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
-        ax.annotate("Sharp ratio: %0.2f" % self.sharp_ratio, xy=(0.05, 0.8),
+        ax.annotate("Sharp ratio: %0.2f" % metrics["sharp_ratio"], xy=(0.05, 0.8),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
-        ax.annotate("Compound Average Growth Rate: %0.2f%%" % (self.cagr*100), xy=(0.05, 0.75),
+        ax.annotate("Compound Average Growth Rate: %0.2f%%" % (metrics["cagr"]*100), xy=(0.05, 0.75),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
         if save_name is not None:
             save_dir = os.path.join(cfg.technical_pic_dir, self.strategy)
@@ -338,8 +663,10 @@ class Portfolio(Strategy, PerformanceMeasure):
         """
         Args:
             pools: <list: str>: list of pool names.
+        Members:
+            calendar_rows: <dict>: key: <str>: code. value: <numpy.ndarray: int>: row of
+                           each day of self.dates in the K line of the code, -1 if not traded.
         """
-        dates = pd.DatetimeIndex([])
         self.code_pools = dict()
         self.klines = dict()
         self.codes = list()
@@ -347,18 +674,27 @@ class Portfolio(Strategy, PerformanceMeasure):
         # extract codes and dates in pools.
         for pool in pools:
             data_path = os.path.join(cfg.pool_dir, pool)
-            codes = pd.read_csv(data_path, header=None, names=["code", " "], delim_whitespace=True,
+            codes = pd.read_csv(data_path, header=None, names=["code", " "], sep=r"\s+",
                                 dtype={"code": "str"}, index_col=False).code
             self.code_pools[pool] = codes
             for code in codes:
                 self.codes.append(code)
+                if code in self.klines:
+                    continue
                 kline_cl = KLine(code)
                 if date_range is not None:
                     kline_cl.date_cut(date_range)
-                date = kline_cl.date
-                dates = dates.append(date)
                 self.klines[code] = kline_cl
-        dates = dates.sort_values().drop_duplicates()
+
+        # trading days of the pools: days of the master calendar any of the stocks was traded.
+        calendar = trade_calendar().union([k_line.date for k_line in self.klines.values()])
+        self.calendar_rows = dict((code, k_line.calendar_rows(calendar)) for code, k_line in self.klines.items())
+        traded = numpy.zeros(len(calendar), dtype=bool)
+        for rows in self.calendar_rows.values():
+            traded |= rows >= 0
+        for code in self.calendar_rows:
+            self.calendar_rows[code] = self.calendar_rows[code][traded]
+        dates = calendar.dates[traded]
 
         PerformanceMeasure.__init__(self, dates)
         if self.ndays == 0:
@@ -413,6 +749,9 @@ class Portfolio(Strategy, PerformanceMeasure):
         if hasattr(self, '_init_%s' % strategy):
             getattr(self, '_init_%s' % strategy)(self.codes, self.klines)
 
+        prices = dict((code, [k_line.stock_data[field].values for field in ["open", "close", "high", "low"]])
+                      for code, k_line in self.klines.items())
+        codes = self.unique_codes
         stock_held = dict()
         for iday in range(0, self.ndays):
             date = self.dates[iday]
@@ -420,96 +759,89 @@ class Portfolio(Strategy, PerformanceMeasure):
             stock_held_list.append(stock_held.copy())
             delta_net_value = 0.0
 
-            for code_pool in self.code_pools:
-                codes = self.code_pools[code_pool]
+            # codes in more than one pool are traded once.
+            for code in codes:
+                k_line = self.klines[code]
+                row = self.calendar_rows[code][iday]
+
+                # back test begin if strategy indicators exist
+                if row < 0 or not getattr(self, strategy)('exist', k_line, date, row=row, **kwargs):
+                    # hold the stock while stock was suspended or its indicators don't exist.
+                    if code in stock_held_list[iday-1]:
+                        stock_held_list[iday][code] = stock_held_list[iday-1][code]
+                    # pause until the stock was available to buy.
+                    else:
+                        stock_held_list[iday].pop(code, None)
+                    continue
+
+                open_price, close_price, high_price, low_price = prices[code]
+
+                prev_date_ind = row - 1
+                if code in stock_held:
+                    # also held the stock the last day, so go on holding.
+                    if code in stock_held_list[iday-1]:
+                        daily_return += (close_price[row] - close_price[prev_date_ind]) / \
+                                        close_price[prev_date_ind] * stock_held_list[iday-1][code] / \
+                                        net_value_list[iday-1]
+                        delta_net_value += (close_price[row] - close_price[prev_date_ind]) / \
+                            close_price[prev_date_ind] * stock_held_list[iday-1][code]
+                        stock_held_list[iday][code] = close_price[row] / close_price[prev_date_ind] \
+                            * stock_held_list[iday-1][code]
+                    # buy in the stock once open.
+                    else:
+                        position = self.unit_position  # TODO: configure position.
+                        # not enough money or fail to trade.
+                        if Dec(str(self.cash_held)) < Dec(str(position)) or \
+                                not self.deal_success("buy", high_price[row], low_price[row],
+                                                      close_price[prev_date_ind]):
+                            stock_held.pop(code)
+                            stock_held_list[iday].pop(code)
+                            continue
 
-                for code in codes:
-                    k_line = self.klines[code]
+                        self.cash_held -= position
+                        daily_return += (close_price[row] / open_price[row]
+                                         / (1 + self.brokerage) - 1) * position / net_value_list[iday-1]
+                        delta_net_value += (close_price[row] / open_price[row]
+                                            / (1 + self.brokerage) - 1) * position
 
-                    if date not in k_line.date:
-                        # hold the stock while stock was suspended.
-                        if code in stock_held_list[iday-1]:
-                            stock_held_list[iday][code] = stock_held_list[iday-1][code]
-                        # pause until the stock was available to buy.
-                        else:
-                            stock_held_list[iday].pop(code, None)
-                        continue
-
-                    # back test begin if strategy indicators exist
-                    if not getattr(self, strategy)('exist', k_line, date, **kwargs):
-                        continue
-
-                    open_price = k_line.stock_data['open']
-                    close_price = k_line.stock_data['close']
-                    high_price = k_line.stock_data['high']
-                    low_price = k_line.stock_data['low']
-
-                    prev_date_ind = k_line.date.get_loc(date) - 1
-                    if code in stock_held:
-                        # also held the stock the last day, so go on holding.
-                        if code in stock_held_list[iday-1]:
-                            daily_return += (close_price.ix[date] - close_price.iloc[prev_date_ind]) / \
-                                            close_price.iloc[prev_date_ind] * stock_held_list[iday-1][code] / \
-                                            net_value_list[iday-1]
-                            delta_net_value += (close_price.ix[date] - close_price.iloc[prev_date_ind]) / \
-                                close_price.iloc[prev_date_ind] * stock_held_list[iday-1][code]
-                            stock_held_list[iday][code] = close_price.ix[date] / close_price.iloc[prev_date_ind] \
-                                * stock_held_list[iday-1][code]
-                        # buy in the stock once open.
-                        else:
-                            position = self.unit_position  # TODO: configure position.
-                            # not enough money or fail to trade.
-                            if Dec(str(self.cash_held)) < Dec(str(position)) and \
-                                    not self.deal_success("buy", high_price.ix[date], low_price.ix[date],
-                                                          close_price.iloc[prev_date_ind]):
-                                stock_held.pop(code)
-                                stock_held_list[iday].pop(code)
-                                continue
-
-                            self.cash_held -= position
-                            daily_return += (close_price.ix[date] / open_price.ix[date]
-                                             / (1 + self.brokerage) - 1) * position / net_value_list[iday-1]
-                            delta_net_value += (close_price.ix[date] / open_price.ix[date]
-                                                / (1 + self.brokerage) - 1) * position
-
-                            stock_held_list[iday][code] = close_price.ix[date] * position \
-                                / open_price.ix[date] / (1 + self.brokerage)
-
-                        # prepare to sell stock the next day
-                        if getattr(self, strategy)('sell', k_line, date, **kwargs):
-                            stock_held.pop(code)
+                        stock_held_list[iday][code] = close_price[row] * position \
+                            / open_price[row] / (1 + self.brokerage)
 
-                    else:
-                        #  held the stock the last day, sell the stock once open
-                        if iday > 0 and code in stock_held_list[iday-1]:
-                            # fail to sell, go on holding.
-                            if not self.deal_success("sell", high_price.ix[date], low_price.ix[date],
-                                                     close_price.iloc[prev_date_ind]):
-                                daily_return += (close_price.ix[date] - close_price.iloc[prev_date_ind]) / \
-                                    close_price.iloc[prev_date_ind] * stock_held_list[iday - 1][code] / \
-                                    net_value_list[iday - 1]
-                                delta_net_value += (close_price.ix[date] - close_price.iloc[prev_date_ind]) / \
-                                    close_price.iloc[prev_date_ind] * stock_held_list[iday - 1][code]
-                                stock_held_list[iday][code] = close_price.ix[date] / close_price.iloc[prev_date_ind] \
-                                    * stock_held_list[iday - 1][code]
-
-                            daily_return += (open_price.ix[date] / close_price.iloc[prev_date_ind]
+                    # prepare to sell stock the next day
+                    if getattr(self, strategy)('sell', k_line, date, row=row, **kwargs):
+                        stock_held.pop(code)
+
+                else:
+                    #  held the stock the last day, sell the stock once open
+                    if iday > 0 and code in stock_held_list[iday-1]:
+                        # fail to sell, go on holding.
+                        if not self.deal_success("sell", high_price[row], low_price[row],
+                                                 close_price[prev_date_ind]):
+                            daily_return += (close_price[row] - close_price[prev_date_ind]) / \
+                                close_price[prev_date_ind] * stock_held_list[iday - 1][code] / \
+                                net_value_list[iday - 1]
+                            delta_net_value += (close_price[row] - close_price[prev_date_ind]) / \
+                                close_price[prev_date_ind] * stock_held_list[iday - 1][code]
+                            stock_held_list[iday][code] = close_price[row] / close_price[prev_date_ind] \
+                                * stock_held_list[iday - 1][code]
+                        else:
+                            daily_return += (open_price[row] / close_price[prev_date_ind]
                                              * (1 - self.brokerage - self.stamp_duty) - 1) \
                                 * stock_held_list[iday-1][code] / net_value_list[iday-1]
-                            delta_net_value += (open_price.ix[date] / close_price.iloc[prev_date_ind] *
+                            delta_net_value += (open_price[row] / close_price[prev_date_ind] *
                                                 (1 - self.brokerage - self.stamp_duty) - 1) \
                                 * stock_held_list[iday-1][code]
 
-                            self.cash_held += open_price.ix[date] / close_price.iloc[prev_date_ind]  \
+                            self.cash_held += open_price[row] / close_price[prev_date_ind]  \
                                 * (1 - self.brokerage - self.stamp_duty) \
                                 * stock_held_list[iday-1][code]
-                        # not hold stock
-                        else:
-                            pass
+                    # not hold stock
+                    else:
+                        pass
 
-                        # prepare to buy the stock the next day
-                        if getattr(self, strategy)('buy', k_line, date, **kwargs):
-                            stock_held[code] = self.unit_position     # the value for stock_held[code] doesn't matter.
+                    # prepare to buy the stock the next day
+                    if getattr(self, strategy)('buy', k_line, date, row=row, **kwargs):
+                        stock_held[code] = self.unit_position     # the value for stock_held[code] doesn't matter.
 
             self.net_value += delta_net_value
             net_value_list.append(self.net_value)
@@ -528,6 +860,77 @@ class Portfolio(Strategy, PerformanceMeasure):
         else:
             return self.result
 
+    @property
+    def unique_codes(self):
+        """
+        codes in pools without duplicates, in the order of pools.
+        """
+        return list(pd.unique(pd.Series(self.codes, dtype=object)))
+
+    def price_matrices(self, fields=("open", "high", "low", "close")):
+        """
+        Returns:
+            <dict>: key: <str>: field. value: <numpy.ndarray>: (days x codes) prices
+                    of unique_codes, NaN while suspended or not listed.
+        """
+        codes = self.unique_codes
+        matrices = dict((field, numpy.full((self.ndays, len(codes)), numpy.nan)) for field in fields)
+        for icode, code in enumerate(codes):
+            rows = self.calendar_rows[code]
+            traded = rows >= 0
+            for field in fields:
+                matrices[field][traded, icode] = self.klines[code].stock_data[field].values[rows[traded]]
+        return matrices
+
+    def signal_matrices(self, strategy, **kwargs):
+        """
+        signals of the array version of a strategy("<strategy>_signals", see Strategy class).
+        Returns:
+            exist, buy, sell: <numpy.ndarray: bool>: (days x codes) signals of unique_codes.
+        """
+        codes = self.unique_codes
+        exist, buy, sell = [numpy.zeros((self.ndays, len(codes)), dtype=bool) for _ in range(3)]
+        for icode, code in enumerate(codes):
+            rows = self.calendar_rows[code]
+            traded = rows >= 0
+            signals = getattr(self, strategy + "_signals")(self.klines[code], **kwargs)
+            for matrix, signal in zip([exist, buy, sell], signals):
+                matrix[traded, icode] = numpy.asarray(signal)[rows[traded]]
+        return exist, buy, sell
+
+    def trade_open_vectorized(self, strategy, show_value=True, **kwargs):
+        """
+        the same test as trade_open, computed on (days x codes) matrices(see
+        portfolio_open_trades), with signals given by the array version of the
+        strategy("<strategy>_signals", see Strategy class).
+        Members set:
+            holdings: <pandas.DataFrame>: values of stocks held at close, dates as index,
+                      codes as columns.
+        """
+        exist, buy, sell = self.signal_matrices(strategy, **kwargs)
+        prices = self.price_matrices()
+        trades = portfolio_open_trades(exist, buy, sell, prices["open"], prices["close"],
+                                       prices["high"], prices["low"],
+                                       self.brokerage, self.stamp_duty)
+        codes = self.unique_codes
+        self.holdings = pd.DataFrame(trades["holdings"], index=self.dates, columns=codes)
+        stock_held_list = [dict((codes[icode], day_values[icode]) for icode in numpy.flatnonzero(day_values))
+                           for day_values in trades["holdings"]]
+        if self.ndays:
+            self.net_value = trades["net_value"][-1]
+            self.cash_held = trades["cash_held"][-1]
+
+        self.result = pd.DataFrame({'net_value': trades["net_value"],
+                                    'daily_return': trades["daily_return"],
+                                    'cash_held': trades["cash_held"],
+                                    'stock_held': stock_held_list},
+                                   index=self.dates)
+        self.strategy = strategy
+        if show_value:
+            return 20 * "*" + "%s Net Value: %f" % (strategy, self.result['net_value'].iloc[-1]) + 20 * "*"
+        else:
+            return self.result
+
     def plot(self, save_name=None, y_scale="linear"):
         """
         plot the result of back test.
@@ -542,13 +945,14 @@ class Portfolio(Strategy, PerformanceMeasure):
         # font = fm.FontProperties(fname=ct.FONT_PATH)
         # ax.set_title(label="%s (%s)" % (ct.get_code_name(self.code), self.code), fontproperties=font)
         self.result.net_value.plot()
-        ax.annotate("max draw down: %0.2f%%" % (self.max_draw_down()[0]*100), xy=(0.05, 0.9),
+        metrics = self.metrics()
+        ax.annotate("max draw down: %0.2f%%" % (metrics["max_draw_down"]*100), xy=(0.05, 0.9),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
-        ax.annotate("max draw down duration: %d days" % self.max_draw_down_duration()[0], xy=(0.05, 0.85),
+        ax.annotate("max draw down duration: %d days" % metrics["max_draw_down_duration"], xy=(0.05, 0.85),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
-        ax.annotate("Sharp ratio: %0.2f" % self.sharp_ratio, xy=(0.05, 0.8),
+        ax.annotate("Sharp ratio: %0.2f" % metrics["sharp_ratio"], xy=(0.05, 0.8),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
-        ax.annotate("Compound Average Growth Rate: %0.2f%%" % (self.cagr*100), xy=(0.05, 0.75),
+        ax.annotate("Compound Average Growth Rate: %0.2f%%" % (metrics["cagr"]*100), xy=(0.05, 0.75),
                     horizontalalignment='left', verticalalignment='center', xycoords="axes fraction")
         if y_scale is not None:
             ax.set_yscale(y_scale)
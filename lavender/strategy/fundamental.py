@@ -18,6 +18,8 @@ import matplotlib.font_manager as fm
 from matplotlib.pyplot import *
 from sklearn import covariance, cluster
 from lavender.util.DailyKLineIO import KLine
+from lavender.util.StatementStore import statement_store, statement_name
+from lavender.strategy.screening import screen, write_pool
 
 
 matplotlib.style.use('ggplot')
@@ -43,6 +45,30 @@ def join_pools(pools):
     merge_pool.to_csv()
 
 
+def _read_statement(table_name, code, items, season=4, optional=()):
+    """
+    read items of a financial statement of a stock.
+    Args:
+        table_name: <str>: name of financial statement database, e.g. "Statement_CashFlow".
+        code: <str>: stock code.
+        items: <list: str>: items in the financial statement.
+        season: <int>: the season(1-4) of financial statement, None for all the seasons.
+        optional: <list: str>: items filled with NaN if they have no value.
+    Returns:
+        <pd.DataFrame>: years as index, items as columns.
+    Raises:
+        KeyError: if some item not optional has no value.
+    """
+    state_data = statement_store.query(statement_name(table_name), codes=[code], items=items,
+                                       seasons=None if season is None else [season])
+    state_data = state_data.reset_index()
+    state_data.index = state_data.year
+    for item in optional:
+        if item not in state_data.columns:
+            state_data[item] = np.nan
+    return state_data[items]
+
+
 def show_single_code_statement(code, indicators, season=4, draw_pic=True,
                                save_name=None):
     """
@@ -60,14 +86,8 @@ def show_single_code_statement(code, indicators, season=4, draw_pic=True,
     """
     ind_data = pd.DataFrame()
     for table_name in indicators:
-        engine = ct.gen_engine(table_name)
-        state_data = pd.read_sql_table(code, engine)
-        if season is not None:
-            state_data = state_data[(state_data.season == season)]
-        indicator_chars = [indicator.decode("utf8") for indicator in indicators[table_name]]
-        indicators[table_name] = indicator_chars
-        state_data.index = state_data.year
-        ind_data = pd.concat([ind_data, state_data[indicator_chars].copy()], axis=1)
+        state_data = _read_statement(table_name, code, indicators[table_name], season)
+        ind_data = pd.concat([ind_data, state_data], axis=1)
     if draw_pic:
         print(ind_data)
         font = fm.FontProperties(fname=ct.FONT_PATH)
@@ -164,21 +184,23 @@ def _cal_free_cash_flow(code, season=4):
     """
     Calculate series of free cash flow of the selected stock.
     """
-    engine = ct.gen_engine("Statement_CashFlow")
-    state_data = pd.read_sql_table(code, engine)
-    state_data = state_data[(state_data.season == season)]
-
-    cfo = state_data["经营活动产生的现金流量净额".decode("utf8")]
-    cfi1 = state_data["购建固定资产、无形资产和其他长期资产所支付的现金".decode("utf8")]
-    cfi2 = state_data["取得子公司及其他营业单位支付的现金净额".decode("utf8")]
-    cfi3 = state_data["处置固定资产、无形资产和其他长期资产所收回的现金净额".decode("utf8")]
-    cfi4 = state_data["处置子公司及其他营业单位收到的现金净额".decode("utf8")]
-    cfi1[np.isnan(cfi1)] = 0
-    cfi2[np.isnan(cfi2)] = 0
-    cfi3[np.isnan(cfi3)] = 0
-    cfi4[np.isnan(cfi4)] = 0
+    state_data = _read_statement("Statement_CashFlow", code,
+                                 ["经营活动产生的现金流量净额",
+                                  "购建固定资产、无形资产和其他长期资产所支付的现金",
+                                  "取得子公司及其他营业单位支付的现金净额",
+                                  "处置固定资产、无形资产和其他长期资产所收回的现金净额",
+                                  "处置子公司及其他营业单位收到的现金净额"], season,
+                                 optional=["购建固定资产、无形资产和其他长期资产所支付的现金",
+                                           "取得子公司及其他营业单位支付的现金净额",
+                                           "处置固定资产、无形资产和其他长期资产所收回的现金净额",
+                                           "处置子公司及其他营业单位收到的现金净额"])
+
+    cfo = state_data["经营活动产生的现金流量净额"]
+    cfi1 = state_data["购建固定资产、无形资产和其他长期资产所支付的现金"].fillna(0)
+    cfi2 = state_data["取得子公司及其他营业单位支付的现金净额"].fillna(0)
+    cfi3 = state_data["处置固定资产、无形资产和其他长期资产所收回的现金净额"].fillna(0)
+    cfi4 = state_data["处置子公司及其他营业单位收到的现金净额"].fillna(0)
     fcf = cfo - cfi1 - cfi2 + cfi3 + cfi4
-    fcf.index = state_data.year
     return fcf
 
 
@@ -198,10 +220,7 @@ def cash_flow_valuation(code, growth_rate=None,
     if growth_rate is not None:
         # TODO: simulate growth rate of free cash flow.
         pass
-    engine = ct.gen_engine("Statement_BalanceSheet")
-    state_data = pd.read_sql_table(code, engine)
-    state_data = state_data[(state_data.season == season)]
-    shares = state_data["实收资本(或股本)".decode("utf8")]
+    shares = _read_statement("Statement_BalanceSheet", code, ["实收资本(或股本)"], season)["实收资本(或股本)"]
     price = fcf.iloc[-1] / shares.iloc[-1] * (1 + growth_rate) / (required_return - growth_rate)
 
     print(price)
@@ -211,19 +230,13 @@ def dupont_decomposition(code, season=4, draw_pic=True, save_name=None):
     """
     Show time series for DuPont Analysis.
     """
-    engine = ct.gen_engine("Statement_ProfitStatement")
-    state_data = pd.read_sql_table(code, engine)
-    state_data = state_data[(state_data.season == season)]
-    state_data.index = state_data.year
-    revenue = state_data["营业收入".decode("utf8")]
-    net_income = state_data["归属于母公司所有者的净利润".decode("utf8")]
+    state_data = _read_statement("Statement_ProfitStatement", code, ["营业收入", "归属于母公司所有者的净利润"], season)
+    revenue = state_data["营业收入"]
+    net_income = state_data["归属于母公司所有者的净利润"]
 
-    engine = ct.gen_engine("Statement_BalanceSheet")
-    state_data = pd.read_sql_table(code, engine)
-    state_data = state_data[(state_data.season == season)]
-    state_data.index = state_data.year
-    asset = state_data["资产总计".decode("utf8")]
-    equity = state_data["归属于母公司股东权益合计".decode("utf8")]
+    state_data = _read_statement("Statement_BalanceSheet", code, ["资产总计", "归属于母公司股东权益合计"], season)
+    asset = state_data["资产总计"]
+    equity = state_data["归属于母公司股东权益合计"]
 
     net_profit_ratio = net_income/revenue * 100
     asset_turnover = revenue/asset
@@ -268,17 +281,13 @@ def cash_ps(code, season=4):
         season: 
     Returns:
     """
-    engine = ct.gen_engine("Statement_BalanceSheet")
-    state_data = pd.read_sql_table(code, engine)
-    state_data = state_data[(state_data.season == season)]
-    state_data.index = state_data.year
-    cash = state_data["货币资金".decode("utf8")]
-    equity = state_data["交易性金融资产".decode("utf8")]
-    notes_receivable = state_data["应收票据".decode("utf8")]
-    shares = state_data["实收资本(或股本)".decode("utf8")]
-    cash[np.isnan(cash)] = 0
-    equity[np.isnan(equity)] = 0
-    notes_receivable[np.isnan(notes_receivable)] = 0
+    state_data = _read_statement("Statement_BalanceSheet", code,
+                                 ["货币资金", "交易性金融资产", "应收票据", "实收资本(或股本)"], season,
+                                 optional=["交易性金融资产", "应收票据"])
+    cash = state_data["货币资金"].fillna(0)
+    equity = state_data["交易性金融资产"].fillna(0)
+    notes_receivable = state_data["应收票据"].fillna(0)
+    shares = state_data["实收资本(或股本)"]
     t_cash = (cash + equity + notes_receivable)/shares
 
     return t_cash
@@ -339,27 +348,6 @@ def plot_category_heatmap(table_name, indicator, classify_stand, category, **kwa
     _plot_codes_heatmap(banks, table_name, indicator, save_name="bank_%s.png" % indicator, **kwargs)
 
 
-def _if_has_year(code, year):
-    """
-    check if a stock has K-line data in the selected year.
-    Args:
-        code: <str>: code of the stock to be checked.
-        year: <int>: the selected year.
-    Returns:
-        <bool>
-    """
-    kline_file = "%s.csv" % code
-    kline_path = os.path.join(cfg.kline_dir, kline_file)
-    try:
-        kline_cl = KLine(kline_path)
-    except IOError:
-        return False
-    if kline_cl[:].index[0].year <= year:
-        return True
-    else:
-        return False
-
-
 def _first_year(code):
     """
     return the first year of IPO
@@ -370,7 +358,7 @@ def _first_year(code):
     """
     kline_file = "%s.csv" % code
     kline_path = os.path.join(cfg.kline_dir, kline_file)
-    kline_cl = KLine(kline_path)
+    kline_cl = KLine(kline_path, columns=["close"])
     return kline_cl.date[0].year
 
 
@@ -383,44 +371,15 @@ def get_condition_indicator(table_name, indicator_conditions, save_name,
         save_name: <str>: txt file name to save stocks filtered.
         num_year: <int>: the number of the latest years to check the condition.
         nyear_conditions: <str>: the conditions to be satisfied by the number of the latest
-                                years that satisfied the conditions.
+                                years that satisfied the conditions, e.g. ">=4".
         indicator_conditions: <dict>: key: <str>: fundamental indicators.
                                     value: <str>: the conditions to be satisfied by the indicators.
         first_year: <int>: the year that the stocks should have been listed.
     """
-    engine = ct.gen_engine(table_name)
-    table_data = pd.read_sql_table('%s' % table_name, engine)
-
-    if nyear_conditions is None:
-        nyear_conditions = "==%s" % num_year
-
-    years = np.unique(table_data.year)
-    last_n_years = years[(-1*num_year-1):-1]     # 2012, 2013, 2014, 2015, 2016
-
-    picked_codes = list()
-    codes = np.unique(table_data.code)
-    for code in codes:
-        table_data_s4 = table_data[(table_data.code == code) & (table_data.season == 4)
-                                   & (table_data.year.isin(last_n_years))].copy()
-
-        select_table = table_data_s4.query(" and ".join(["({} {})".format(indict, condit)
-                                                         for indict, condit in indicator_conditions.iteritems()]))
-
-        # stock exchange history longer than n year.
-        if eval("%s%s" % (len(select_table), nyear_conditions)) and _if_has_year(code, first_year):
-            picked_codes.append(code)
-    print("Number of stocks picked: %d" % len(picked_codes))
-
-    fout = open(os.path.join(cfg.pool_dir, save_name), "w")
-    for code in picked_codes:
-        stock_name = np.unique(table_data[table_data.code == code].name)[0]
-
-        fout.write("%s " % code)
-        fout.write(stock_name.encode("utf8"))
-        fout.write("\n")
-        # sentence below don't work, maybe because of unicode to string.
-        # fout.write('%s %s\n' % (code, stock_name.encode("utf8")))
-    fout.close()
+    picked = screen(table_name, indicator_conditions, num_year=num_year,
+                    nyear_conditions=nyear_conditions, first_year=first_year)
+    print("Number of stocks picked: %d" % len(picked))
+    write_pool(picked, save_name)
 
 
 def plot_pooled_codes_heatmap(pool_name, save_name, table_name, indicator, **kwargs):
@@ -460,8 +419,7 @@ def stock_variation_cluster(pool_name, date_range="2012:2017",
 
     pool_variations = pd.DataFrame()
     for code in pooled_codes:
-        kline = KLine(code)
-        kline.date_cut(date_range)
+        kline = KLine(code, columns=["open", "close"], date_range=date_range)
         variation = kline.stock_data.close - kline.stock_data.open
         variation /= variation.std(axis=0)
         pool_variations = pd.concat([pool_variations, variation], axis=1)
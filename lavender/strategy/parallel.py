@@ -0,0 +1,263 @@
+"""
+Parallel runners of back tests.
+The whole K-line data of the stocks tested is put in one block of shared
+memory by the main process, and worker processes attach to it instead of
+loading csv files or receiving pickled DataFrames. A worker keeps one KLine
+of each stock, so indicators are computed once for all the tests run on it.
+Back tests of all the codes in pools run one code per task, the results
+being saved as soon as each test finishes.
+"""
+
+import os
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+import lavender.config as cfg
+import lavender.constant as ct
+from lavender.strategy.backtest import BackTest
+from lavender.util.DailyKLineIO import KLine
+from lavender.util.PanelStore import read_pool_codes
+
+SHARED_FIELDS = ["open", "high", "low", "close"]
+METRICS = ["net_value", "cagr", "sharp_ratio", "max_draw_down", "max_draw_down_duration"]
+SUMMARY_FILE = "summary" + ct.FILE_EXT["csv"]
+
+
+class SharedKLines:
+    """
+    K-line data of stocks in one block of shared memory: dates(int64) of all the
+    stocks, followed by a (fields x rows) float64 matrix.
+    Members:
+        layout: <dict>: picklable description of the block for attach():
+                "name", "fields", "n_rows", and "codes": (code, offset, length) of stocks.
+        missing: <dict>: key: <str>: code without data, left out of the block. value: <str>: error.
+    """
+    def __init__(self, codes, fields=SHARED_FIELDS):
+        frames = list()
+        self.missing = dict()
+        for code in codes:
+            try:
+                frames.append((code, KLine(code, columns=list(fields))._stock_whole_data))
+            except IOError as err:
+                self.missing[code] = "%s: %s" % (type(err).__name__, err)
+        n_rows = sum(len(frame) for _, frame in frames)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(8 * n_rows * (len(fields) + 1), 1))
+        dates, values = self._arrays(self._shm, len(fields), n_rows)
+
+        code_layout = list()
+        offset = 0
+        for code, frame in frames:
+            dates[offset: offset + len(frame)] = frame.index.values.astype("datetime64[ns]").view(np.int64)
+            values[:, offset: offset + len(frame)] = frame[list(fields)].values.T
+            code_layout.append((code, offset, len(frame)))
+            offset += len(frame)
+        self.layout = {"name": self._shm.name, "fields": list(fields), "n_rows": n_rows,
+                       "codes": code_layout}
+
+    @staticmethod
+    def _arrays(shm, n_fields, n_rows):
+        dates = np.ndarray((n_rows,), dtype=np.int64, buffer=shm.buf)
+        values = np.ndarray((n_fields, n_rows), dtype=np.float64, buffer=shm.buf, offset=8 * n_rows)
+        return dates, values
+
+    @classmethod
+    def attach(cls, layout):
+        """
+        attach to the block in another process.
+        Returns:
+            shm: <multiprocessing.shared_memory.SharedMemory>: keep it while the K lines are used.
+            k_lines: <dict>: key: <str>: code. value: <DailyKLineIO.KLine>: data on the shared block.
+        """
+        shm = shared_memory.SharedMemory(name=layout["name"])
+        dates, values = cls._arrays(shm, len(layout["fields"]), layout["n_rows"])
+        dates.flags.writeable = False
+        values.flags.writeable = False
+        k_lines = dict()
+        for code, offset, length in layout["codes"]:
+            index = pd.DatetimeIndex(dates[offset: offset + length].view("datetime64[ns]"), name="date")
+            # (rows x fields) view of the block, not copied.
+            data = pd.DataFrame(values[:, offset: offset + length].T, index=index,
+                                columns=layout["fields"], copy=False)
+            k_lines[code] = KLine.from_frame(code, data)
+        return shm, k_lines
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+def measure(test):
+    """
+    performance measures of a finished back test.
+    Args:
+        test: <backtest.PerformanceMeasure>
+    Returns:
+        <dict>: key: metric in METRICS.
+    """
+    return {"net_value": test.net_value, "cagr": test.cagr, "sharp_ratio": test.sharp_ratio,
+            "max_draw_down": test.max_draw_down()[0],
+            "max_draw_down_duration": test.max_draw_down_duration()[0]}
+
+
+def run_test(test, strategy, **kwargs):
+    """
+    run trade_open of a back test, the vectorized version if the strategy has one.
+    """
+    if hasattr(test, strategy + "_signals"):
+        return test.trade_open_vectorized(strategy, show_value=False, **kwargs)
+    return test.trade_open(strategy, show_value=False, **kwargs)
+
+
+# state of worker processes, set by _init_worker.
+_worker = dict()
+
+
+def _init_worker(layout, date_range, brokerage, stamp_duty):
+    shm, k_lines = SharedKLines.attach(layout)
+    if date_range is not None:
+        for k_line in k_lines.values():
+            k_line.date_cut(date_range)
+    _worker.update(shm=shm, k_lines=k_lines, date_range=date_range,
+                   brokerage=brokerage, stamp_duty=stamp_duty)
+
+
+def _sweep_task(task):
+    code, strategy, params = task
+    test = BackTest(code, date_range=_worker["date_range"], brokerage=_worker["brokerage"],
+                    stamp_duty=_worker["stamp_duty"], k_line=_worker["k_lines"][code])
+    run_test(test, strategy, **params)
+    row = {"code": code}
+    row.update(params)
+    row.update(measure(test))
+    return row
+
+
+def parameter_sweep(strategy, param_grid, code=None, pools=None, date_range=None,
+                    n_process=None, brokerage=0.001, stamp_duty=0.001):
+    """
+    back test a strategy with every combination of parameters, in a process pool.
+    Args:
+        strategy: <str>: name of strategy function, e.g. "dual_ma_strategy".
+        param_grid: <dict>: key: <str>: parameter name. value: <list>: values to test,
+                    e.g. {"ma_fast": [20, 60], "ma_slow": [120, 250]}.
+        code: <str>: code of the stock to test.
+        pools: <list: str>: names of pools in cfg.pool_dir, to test all the codes in them
+                            instead of one code.
+        date_range: <str>: date range of the tests.
+        n_process: <int>: number of worker processes. default: number of cpu cores.
+        brokerage: <float>
+        stamp_duty: <float>
+    Returns:
+        <pandas.DataFrame>: one row for each code and combination of parameters, with
+                            columns "code", parameters, METRICS and "error".
+                            A code without data is reported in one row with its "error",
+                            which is empty for the others.
+    """
+    codes = [code] if code is not None else read_pool_codes(pools)
+    names = sorted(param_grid)
+    grid = [dict(zip(names, values)) for values in itertools.product(*[param_grid[name] for name in names])]
+
+    n_process = multiprocessing.cpu_count() if n_process is None else n_process
+    shared = SharedKLines(codes)
+    for missing_code, error in shared.missing.items():
+        print("%s failed: %s" % (missing_code, error))
+    # tasks of the same code stay together, so workers reuse indicators of it.
+    tasks = [(task_code, strategy, params) for task_code in codes if task_code not in shared.missing
+             for params in grid]
+    rows = list()
+    try:
+        pool = multiprocessing.Pool(n_process, initializer=_init_worker,
+                                    initargs=(shared.layout, date_range, brokerage, stamp_duty))
+        try:
+            rows = pool.map(_sweep_task, tasks, chunksize=max(1, len(tasks) // (4 * n_process)))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shared.close()
+    # rows of missing codes take their places in the order of codes.
+    rows_of = dict((task_code, list()) for task_code in codes)
+    for row in rows:
+        rows_of[row["code"]].append(row)
+    for missing_code, error in shared.missing.items():
+        rows_of[missing_code].append({"code": missing_code, "error": error})
+    result = pd.DataFrame([row for task_code in rows_of for row in rows_of[task_code]],
+                          columns=["code"] + names + METRICS + ["error"])
+    result["error"] = result["error"].fillna("")
+    return result
+
+
+def _backtest_task(task):
+    code, strategy, kwargs, options = task
+    row = dict((metric, np.nan) for metric in METRICS)
+    row.update(code=code, error="")
+    # a failed code is reported in the summary instead of stopping the others.
+    try:
+        test = BackTest(code, date_range=options["date_range"], brokerage=options["brokerage"],
+                        stamp_duty=options["stamp_duty"])
+        if test.ndays == 0:
+            raise ValueError("stock data empty!")
+        run_test(test, strategy, **kwargs)
+        test.result.to_csv(os.path.join(options["save_dir"], code + ct.FILE_EXT["csv"]))
+        row.update(measure(test))
+    except Exception as err:
+        row["error"] = "%s: %s" % (type(err).__name__, err)
+    return row
+
+
+def backtest_pools(pools, strategy, date_range=None, n_process=None, save_dir=None,
+                   brokerage=0.001, stamp_duty=0.001, **kwargs):
+    """
+    back test a strategy on every code in pools, in a process pool.
+    The result of each code is saved as "<save_dir>/<code>.csv" once its test
+    finishes, and a row is appended to "<save_dir>/summary.csv" at the same time,
+    which is sorted in the order of pools when all the tests finish.
+    Args:
+        pools: <list: str>: names of pools in cfg.pool_dir.
+        strategy: <str>: name of strategy function, e.g. "dual_ma_strategy".
+        date_range: <str>: date range of the tests.
+        n_process: <int>: number of worker processes. default: number of cpu cores.
+        save_dir: <str>: default: "<cfg.backtest_result_dir>/<strategy>".
+        brokerage: <float>
+        stamp_duty: <float>
+        **kwargs: parameters of the strategy.
+    Returns:
+        <pandas.DataFrame>: summary, codes as index, METRICS and "error" as columns.
+                            "error" is empty for successful tests.
+    """
+    codes = read_pool_codes(pools)
+    save_dir = os.path.join(cfg.backtest_result_dir, strategy) if save_dir is None else save_dir
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    options = {"date_range": date_range, "brokerage": brokerage, "stamp_duty": stamp_duty,
+               "save_dir": save_dir}
+    tasks = [(code, strategy, kwargs, options) for code in codes]
+
+    columns = ["code"] + METRICS + ["error"]
+    summary_path = os.path.join(save_dir, SUMMARY_FILE)
+    rows = list()
+    pool = multiprocessing.Pool(n_process)
+    try:
+        with open(summary_path, "w") as summary_file:
+            summary_file.write(",".join(columns) + "\n")
+            for row in pool.imap_unordered(_backtest_task, tasks):
+                rows.append(row)
+                pd.DataFrame([row], columns=columns).to_csv(summary_file, header=False, index=False)
+                summary_file.flush()
+                if row["error"]:
+                    print("%s failed: %s" % (row["code"], row["error"]))
+    finally:
+        pool.close()
+        pool.join()
+
+    summary = pd.DataFrame(rows, columns=columns).set_index("code").reindex(codes)
+    summary.to_csv(summary_path)
+    return summary
+
+
+if __name__ == "__main__":
+    print(parameter_sweep("dual_ma_strategy", {"ma_fast": [20, 40, 60], "ma_slow": [120, 250]},
+                          code="600519"))
@@ -0,0 +1,135 @@
+"""
+Screening stocks by conditions of fundamental indicators.
+
+A table(see DataCollecting/basics.py) is read once, only the indicators
+and years the conditions need, and the conditions are evaluated on all the
+stocks at once: a (code x year) table of whether a stock met all the
+conditions in a year is pivoted from the rows, and its row sums are checked
+against the rule on the number of years, e.g. ">=4" of the last 5 years.
+Listing dates come from the listing index(see util/ListingIndex.py).
+Conditions are parsed, never evaluated as code.
+"""
+
+import os
+import re
+import sqlite3
+import operator
+import numpy as np
+import pandas as pd
+
+import lavender.config as cfg
+from lavender.util.ListingIndex import listed_by
+
+_OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+              "==": operator.eq, "!=": operator.ne}
+_RE_CONDITION = re.compile(r"^\s*(<=|>=|==|!=|<|>)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$")
+
+
+def parse_condition(condition):
+    """
+    parse a condition on numbers, e.g. ">20", ">= 4" or "<-1.5".
+    Args:
+        condition: <str>: a comparison operator followed by a number.
+    Returns:
+        <function>: called with an array, returns an array of <bool>, False for NaN.
+    Raises:
+        ValueError: condition is not a comparison with a number.
+    """
+    match = _RE_CONDITION.match(str(condition))
+    if match is None:
+        raise ValueError("invalid condition: %r" % (condition,))
+    compare = _OPERATORS[match.group(1)]
+    value = float(match.group(2))
+    return lambda values: compare(values, value)
+
+
+def read_indicators(table_name, indicators, num_year=5, season=4):
+    """
+    read indicators of a season of the years checked, i.e. the num_year years
+    before the latest year of the table.
+    Args:
+        table_name: <str>: e.g. "report".
+        indicators: <list: str>: columns of the table.
+        num_year: <int>
+        season: <int>
+    Returns:
+        data: <pandas.DataFrame>: columns "code", "year" and indicators.
+        names: <pandas.Series>: names of all the codes in the table, codes as index, sorted.
+    """
+    conn = sqlite3.connect(os.path.join(cfg.table_dir, "%s.db" % table_name))
+    try:
+        years = [year for year, in conn.execute("SELECT DISTINCT year FROM '%s' ORDER BY year" % table_name)]
+        last_n_years = years[(-1 * num_year - 1):-1]     # 2012, 2013, 2014, 2015, 2016
+        data = pd.read_sql_query(
+            "SELECT code, year, %s FROM '%s' WHERE season = ? AND year IN (%s)" % (
+                ", ".join('"%s"' % indicator for indicator in indicators), table_name,
+                ", ".join("?" * len(last_n_years))),
+            conn, params=[season] + list(last_n_years))
+        names = pd.read_sql_query("SELECT code, MIN(name) AS name FROM '%s' GROUP BY code ORDER BY code"
+                                  % table_name, conn, index_col="code")["name"]
+    finally:
+        conn.close()
+    return data, names
+
+
+def count_years(data, indicator_conditions, codes=None):
+    """
+    count the years in which each stock met all the conditions.
+    Args:
+        data: <pandas.DataFrame>: columns "code", "year" and indicators.
+        indicator_conditions: <dict>: key: <str>: indicator. value: <str>: condition(see parse_condition).
+        codes: <list: str>: stocks to count. default: the codes in data.
+    Returns:
+        <pandas.Series: int>: codes as index.
+    """
+    passed = np.ones(len(data), dtype=bool)
+    for indicator, condition in indicator_conditions.items():
+        passed &= np.asarray(parse_condition(condition)(pd.to_numeric(data[indicator], errors="coerce")))
+    met = pd.DataFrame({"code": data["code"].values, "year": data["year"].values, "passed": passed})
+    table = met.pivot_table(index="code", columns="year", values="passed", aggfunc="max", fill_value=False)
+    counts = table.sum(axis=1).astype(int)
+    if codes is not None:
+        counts = counts.reindex(codes, fill_value=0)
+    return counts
+
+
+def screen(table_name, indicator_conditions, num_year=5, nyear_conditions=None, first_year=2012, season=4):
+    """
+    Pick stocks whose indicators met the conditions in enough of the last n years.
+    Args:
+        table_name: <str>: table which is to be read and filter indicators from.
+        indicator_conditions: <dict>: key: <str>: fundamental indicators.
+                                    value: <str>: the conditions to be satisfied by the indicators.
+        num_year: <int>: the number of the latest years to check the condition.
+        nyear_conditions: <str>: the condition on the number of the years in which all the
+                                 conditions are met, e.g. ">=4". default: "==<num_year>".
+        first_year: <int>: the year that the stocks should have been listed, None for no check.
+        season: <int>: season of the data checked.
+    Returns:
+        <pandas.Series>: names of the stocks picked, codes as index, sorted.
+    """
+    if nyear_conditions is None:
+        nyear_conditions = "==%s" % num_year
+    year_rule = parse_condition(nyear_conditions)
+
+    data, names = read_indicators(table_name, list(indicator_conditions), num_year, season)
+    counts = count_years(data, indicator_conditions, codes=names.index)
+    picked = np.asarray(year_rule(counts))
+    if first_year is not None:
+        # stock exchange history longer than n year.
+        picked = picked & listed_by(names.index, first_year)
+    return names[picked]
+
+
+def write_pool(picked, save_name):
+    """
+    save stocks picked as a pool file in cfg.pool_dir, a line of "<code> <name>" for each stock.
+    Args:
+        picked: <pandas.Series>: names of stocks, codes as index.
+        save_name: <str>: file name.
+    """
+    if not os.path.exists(cfg.pool_dir):
+        os.makedirs(cfg.pool_dir)
+    with open(os.path.join(cfg.pool_dir, save_name), "w", encoding="utf-8") as fout:
+        for code, name in picked.items():
+            fout.write("%s %s\n" % (code, name) if isinstance(name, str) else "%s\n" % code)
@@ -8,13 +8,51 @@ import lavender.config as cfg
 import numpy as np
 
 
+def _shift(values):
+    """
+    values of the previous days, NaN on the first day.
+    """
+    shifted = np.full(len(values), np.nan)
+    shifted[1:] = values[:-1]
+    return shifted
+
+
+def _last_pivots(pivots, cut_dates, n_pivots=4):
+    """
+    mean and standard deviation of the last pivots up to each cut date.
+    Args:
+        pivots: <pandas.Series>: prices of pivots, dates as index.
+        cut_dates: <pandas.DatetimeIndex>
+        n_pivots: <int>
+    Returns:
+        count, mean, std: <numpy.ndarray>: number of pivots(at most n_pivots), and
+                          mean, std(ddof=1) of them, NaN if less than n_pivots.
+    """
+    values = pivots.values.astype(float)
+    ends = pivots.index.searchsorted(cut_dates, side="right")
+    mean = np.full(len(cut_dates), np.nan)
+    std = np.full(len(cut_dates), np.nan)
+    enough = ends >= n_pivots
+    if len(values) >= n_pivots and enough.any():
+        windows = np.lib.stride_tricks.sliding_window_view(values, n_pivots)[ends[enough] - n_pivots]
+        window_mean = windows.sum(axis=1) / n_pivots
+        mean[enough] = window_mean
+        std[enough] = np.sqrt(((window_mean[:, None] - windows) ** 2).sum(axis=1) / (n_pivots - 1))
+    return np.minimum(ends, n_pivots), mean, std
+
+
 # TODO: use a completed object as input attributes of strategies.
 class Strategy:
     """
     Edit strategies here.
+    A strategy "xxx_strategy(signal_type, k_line, date, row=None, **kwargs)" judges one
+    signal on one day, row being the row of date in k_line.stock_data if known
+    already, e.g. by a back test. Its array version "xxx_strategy_signals(k_line, **kwargs)"
+    returns the "exist", "buy" and "sell" signals on all the dates of k_line
+    as boolean arrays, which is used by BackTest.trade_open_vectorized.
     """
     @staticmethod
-    def holding_strategy(signal_type, k_line, date):
+    def holding_strategy(signal_type, k_line, date, row=None):
         """
         holding all the time.
         """
@@ -28,13 +66,22 @@ class Strategy:
             return True
 
     @staticmethod
-    def random_strategy(signal_type, k_line, date):
+    def holding_strategy_signals(k_line):
+        """
+        array version of holding_strategy.
+        """
+        ndays = len(k_line.date)
+        return np.ones(ndays, dtype=bool), np.ones(ndays, dtype=bool), np.zeros(ndays, dtype=bool)
+
+    @staticmethod
+    def random_strategy(signal_type, k_line, date, row=None):
         """
         random buy or sell orders.
         Args:
             signal_type:
             k_line:
             date:
+            row:
         """
         if signal_type == "sell":
             random_num = np.random.uniform(-1, 1)
@@ -54,7 +101,7 @@ class Strategy:
             return True
 
     @staticmethod
-    def bollinger_breakout_strategy(signal_type, k_line, date, bl_days=350, scale=2.5):
+    def bollinger_breakout_strategy(signal_type, k_line, date, bl_days=350, scale=2.5, row=None):
         """
         Args:
             k_line: <DailyKLineIO.Kline>: K line class for stock.
@@ -62,22 +109,24 @@ class Strategy:
             signal_type: <str>: type of signal to judge.
             bl_days: <int>: number of days used for moving window.
             scale: <float>: scale for standard error.
+            row: <int>: row of date in k_line.stock_data. default: looked up by k_line.row_of.
         Returns:
             <logic>
         """
         bl_ma = k_line.ma(bl_days)
         close_price = k_line.stock_data['close']
         bl_std = k_line.std_dev(bl_days)
-        prev_date = k_line.date.get_loc(date) - 1
+        idate = k_line.row_of(date) if row is None else row
+        prev_date = idate - 1
 
         if signal_type == 'sell':
-            if close_price.ix[date] < bl_ma.ix[date]:
+            if close_price.iloc[idate] < bl_ma.iloc[idate]:
                 return True
             else:
                 return False
 
         if signal_type == 'buy':
-            if close_price.ix[date] > bl_ma.ix[date] + scale * bl_std.ix[date] and \
+            if close_price.iloc[idate] > bl_ma.iloc[idate] + scale * bl_std.iloc[idate] and \
                             close_price.iloc[prev_date] <= bl_ma.iloc[prev_date] + scale * bl_std.iloc[prev_date]:
                 return True
             else:
@@ -91,6 +140,28 @@ class Strategy:
             else:
                 return True
 
+    @staticmethod
+    def bollinger_breakout_strategy_signals(k_line, bl_days=350, scale=2.5):
+        """
+        array version of bollinger_breakout_strategy.
+        Args:
+            k_line: <DailyKLineIO.Kline>: K line class for stock.
+            bl_days: <int>: number of days used for moving window.
+            scale: <float>: scale for standard error.
+        Returns:
+            exist, buy, sell: <numpy.ndarray: bool>: signals on all the dates of k_line.
+        """
+        bl_ma = k_line.ma(bl_days).values
+        close_price = k_line.stock_data['close'].values
+        bl_std = k_line.std_dev(bl_days).values
+        upper_band = bl_ma + scale * bl_std
+        prev_close, prev_ma, prev_std = _shift(close_price), _shift(bl_ma), _shift(bl_std)
+
+        exist = ~(np.isnan(prev_ma) | np.isnan(prev_std) | np.isnan(prev_close))
+        buy = (close_price > upper_band) & (prev_close <= _shift(upper_band))
+        sell = close_price < bl_ma
+        return exist, buy, sell
+
     def _init_extremum_contrary_strategy(self, codes, k_lines):
         # TODO: should be modified for portfolio class.
         """
@@ -106,17 +177,18 @@ class Strategy:
         setattr(self, '_support', support_dict)
         setattr(self, '_resistance', resistance_dict)
 
-    def extremum_contrary_strategy(self, signal_type, k_line, date):
+    def extremum_contrary_strategy(self, signal_type, k_line, date, row=None):
         """
         Args:
             k_line: <DailyKLineIO.Kline>: K line class for stock.
             date: <pd.DatetimeIndex>: date of trading day.
             signal_type: <str>: whether to judge if sell or
                judge if buy or judge if the indicators exist.
+            row: <int>: row of date in k_line.stock_data. default: looked up by k_line.row_of.
         Returns:
             <logic>
         """
-        idate = k_line.date.get_loc(date)
+        idate = k_line.row_of(date) if row is None else row
         if signal_type == 'exist':
             if idate < cfg.support_window or idate < cfg.resistance_window:
                 return False
@@ -135,14 +207,14 @@ class Strategy:
 
         if signal_type == 'sell':
             cv_res = resistance.std() / resistance.mean()
-            if close_price[idate] > resistance.mean() and cv_res < 0.1:
+            if close_price.iloc[idate] > resistance.mean() and cv_res < 0.1:
                 return True
             else:
                 return False
 
         if signal_type == 'buy':
             cv_sup = support.std() / support.mean()
-            if close_price[idate] <= support.mean() and cv_sup < 0.08:
+            if close_price.iloc[idate] <= support.mean() and cv_sup < 0.08:
                 return True
             else:
                 return False
@@ -154,7 +226,39 @@ class Strategy:
                 return True
 
     @staticmethod
-    def dual_ma_strategy(signal_type, k_line, date, ma_fast=60, ma_slow=250):
+    def extremum_contrary_strategy_signals(k_line):
+        """
+        array version of extremum_contrary_strategy.
+        Args:
+            k_line: <DailyKLineIO.Kline>: K line class for stock.
+        Returns:
+            exist, buy, sell: <numpy.ndarray: bool>: signals on all the dates of k_line.
+        """
+        ndays = len(k_line.date)
+        close_price = k_line.stock_data['close'].values
+        exist = np.zeros(ndays, dtype=bool)
+        buy = np.zeros(ndays, dtype=bool)
+        sell = np.zeros(ndays, dtype=bool)
+        window = max(cfg.support_window, cfg.resistance_window)
+        if ndays <= window:
+            return exist, buy, sell
+
+        # pivots confirmed "window" days before, to avoid future information.
+        support = k_line.support[~np.isnan(k_line.support)]
+        resistance = k_line.resistance[~np.isnan(k_line.resistance)]
+        n_sup, sup_mean, sup_std = _last_pivots(support, k_line.date[window - cfg.support_window:
+                                                                     ndays - cfg.support_window])
+        n_res, res_mean, res_std = _last_pivots(resistance, k_line.date[window - cfg.resistance_window:
+                                                                        ndays - cfg.resistance_window])
+        close_price = close_price[window:]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            exist[window:] = (n_sup >= 4) & (n_res >= 4)
+            sell[window:] = (close_price > res_mean) & (res_std / res_mean < 0.1)
+            buy[window:] = (close_price <= sup_mean) & (sup_std / sup_mean < 0.08)
+        return exist, buy, sell
+
+    @staticmethod
+    def dual_ma_strategy(signal_type, k_line, date, ma_fast=60, ma_slow=250, row=None):
         """
         ma_fast < ma_slow: sell
         ma_fast > ma_slow: buy
@@ -166,22 +270,24 @@ class Strategy:
                 signal_type = 'buy': determine whether to buy shares
                 signal_type = 'exist': determine whether indicators exist
             date: <pd.DatetimeIndex>: date of trading day.
+            row: <int>: row of date in k_line.stock_data. default: looked up by k_line.row_of.
         """
 
         ma_f = k_line.ma(ma_fast)
         ma_s = k_line.ma(ma_slow)
 
-        prev_date = k_line.date.get_loc(date) - 1
+        idate = k_line.row_of(date) if row is None else row
+        prev_date = idate - 1
 
         # if sell stock
         if signal_type == 'sell':
-            if ma_f.ix[date] < ma_s.ix[date]:
+            if ma_f.iloc[idate] < ma_s.iloc[idate]:
                 return True
             else:
                 return False
         # if buy stock
         if signal_type == 'buy':
-            if ma_f.ix[date] > ma_s.ix[date] and \
+            if ma_f.iloc[idate] > ma_s.iloc[idate] and \
                             ma_f.iloc[prev_date] <= ma_s.iloc[prev_date]:
                 return True
             else:
@@ -194,3 +300,23 @@ class Strategy:
                 return False
             else:
                 return True
+
+    @staticmethod
+    def dual_ma_strategy_signals(k_line, ma_fast=60, ma_slow=250):
+        """
+        array version of dual_ma_strategy.
+        Args:
+            k_line: <DailyKLineIO.Kline>: K line class for stock.
+            ma_fast: <int>
+            ma_slow: <int>
+        Returns:
+            exist, buy, sell: <numpy.ndarray: bool>: signals on all the dates of k_line.
+        """
+        ma_f = k_line.ma(ma_fast).values
+        ma_s = k_line.ma(ma_slow).values
+        prev_ma_f, prev_ma_s = _shift(ma_f), _shift(ma_s)
+
+        exist = ~(np.isnan(prev_ma_f) | np.isnan(prev_ma_s))
+        buy = (ma_f > ma_s) & (prev_ma_f <= prev_ma_s)
+        sell = ma_f < ma_s
+        return exist, buy, sell
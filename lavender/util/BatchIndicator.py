@@ -0,0 +1,260 @@
+"""
+Batch indicators over a (days x codes) price matrix.
+
+Moving averages, standard deviations and average true ranges of many
+windows are computed for all the stocks in one pass, every window being
+taken from a single cumulative sum. Days with NaN close prices (suspended
+or not listed) are skipped, so the windows cover the last N trading days
+of each stock, the same as KLine.ma/std_dev/atr on the stock's own data.
+
+Values taken from cumulative sums agree with pandas rolling windows up to
+round-off: within 1e-12 of the price level for averages, but only within
+1e-6 of it for standard deviations(a variance is a difference of two large
+sums), which is large against the deviation of a nearly flat window. They
+are meant for screening and analysis. IndicatorCube.attach computes the windows it puts into
+KLine.stock_data again with pandas rolling windows, so strategies compare
+exactly the numbers KLine.ma/std_dev/atr would give.
+"""
+
+import numpy as np
+import pandas as pd
+
+from lavender.util.DailyKLineIO import true_range
+
+INDICATOR_KEYS = {"ma": "MA%d", "std": "STD%d", "atr": "ATR%d"}
+# methods of pandas rolling windows giving the indicators, as in KLine.
+ROLLING_METHODS = {"ma": "mean", "std": "std", "atr": "mean"}
+
+
+class IndicatorCube:
+    """
+    class of indicators labelled by window, date and code.
+    Members:
+        name: <str>: "ma", "std" or "atr".
+        values: <numpy.ndarray>: shape (windows x dates x codes).
+        windows: <list: int>
+        dates: <pandas.DatetimeIndex>
+        codes: <pandas.Index>
+    """
+    def __init__(self, name, values, windows, dates, codes, inputs=None):
+        """
+        Args:
+            inputs: <tuple>: (compressed input values, order, valid_compressed) the
+                    values were computed from(see _compress), kept for exact().
+        """
+        self.name = name
+        self.values = values
+        self.windows = list(windows)
+        self.dates = dates
+        self.codes = codes
+        self._inputs = inputs
+
+    def __getitem__(self, window):
+        """
+        Returns:
+            <pandas.DataFrame>: indicator of the window, dates as index, codes as columns.
+        """
+        return pd.DataFrame(self.values[self.windows.index(window)], index=self.dates,
+                            columns=self.codes)
+
+    def key(self, window):
+        """
+        column name of the indicator in KLine.stock_data, e.g. "MA60".
+        """
+        return INDICATOR_KEYS[self.name] % window
+
+    def code(self, code):
+        """
+        Returns:
+            <pandas.DataFrame>: indicators of a stock, dates as index, keys as columns.
+        """
+        icode = self.codes.get_loc(code)
+        return pd.DataFrame(self.values[:, :, icode].T, index=self.dates,
+                            columns=[self.key(window) for window in self.windows])
+
+    def exact(self, window):
+        """
+        indicator of a window computed again with pandas rolling windows, the same
+        numbers as KLine.ma/std_dev/atr give, instead of from cumulative sums.
+        Returns:
+            <numpy.ndarray>: (dates x codes).
+        """
+        if self._inputs is None:
+            return self.values[self.windows.index(window)]
+        compressed, order, valid_compressed = self._inputs
+        rolling = pd.DataFrame(compressed).rolling(window=window, center=False)
+        return _expand(getattr(rolling, ROLLING_METHODS[self.name])().values, order, valid_compressed)
+
+    def to_frame(self):
+        """
+        Returns:
+            <pandas.DataFrame>: dates as index, (key, code) as columns.
+        """
+        columns = pd.MultiIndex.from_product([[self.key(window) for window in self.windows], self.codes])
+        values = self.values.transpose(1, 0, 2).reshape(len(self.dates), -1)
+        return pd.DataFrame(values, index=self.dates, columns=columns)
+
+    def attach(self, k_lines):
+        """
+        add the indicators to KLine.stock_data, so strategies in Strategy class
+        find them there (e.g. k_line.ma(60)) instead of computing them again.
+        The cube should be computed on the whole data of the K lines(see price_frames).
+        Values attached are the exact ones(see exact), not the cumulative sums.
+        Args:
+            k_lines: <dict>: key: <str>: code. value: <DailyKLineIO.KLine>.
+        """
+        codes = [code for code in k_lines if code in self.codes]
+        for window in self.windows:
+            frame = pd.DataFrame(self.exact(window), index=self.dates, columns=self.codes)
+            for code in codes:
+                k_line = k_lines[code]
+                k_line.stock_data[self.key(window)] = frame[code].reindex(k_line.date)
+
+
+def price_frames(k_lines, fields=("open", "high", "low", "close")):
+    """
+    align whole data of K lines into (dates x codes) frames.
+    Args:
+        k_lines: <dict>: key: <str>: code. value: <DailyKLineIO.KLine>.
+        fields: <list: str>
+    Returns:
+        <dict>: key: <str>: field. value: <pandas.DataFrame>: dates as index, codes as columns.
+    """
+    codes = list(k_lines)
+    return dict((field, pd.concat([k_lines[code]._stock_whole_data[field] for code in codes],
+                                  axis=1, keys=codes, sort=True))
+                for field in fields)
+
+
+def _compress(valid):
+    """
+    order to move the valid days of every code to the top, keeping their order.
+    Args:
+        valid: <numpy.ndarray: bool>: (days x codes).
+    Returns:
+        order: <numpy.ndarray: int>: (days x codes), rows taken by np.take_along_axis.
+        valid_compressed: <numpy.ndarray: bool>: (days x codes), True on the first counts rows.
+    """
+    order = np.argsort(~valid, axis=0, kind="stable")
+    counts = valid.sum(axis=0)
+    valid_compressed = np.arange(valid.shape[0])[:, None] < counts[None, :]
+    return order, valid_compressed
+
+
+def _expand(compressed, order, valid_compressed):
+    """
+    put the compressed results back to their days, NaN on invalid days.
+    """
+    values = np.full(compressed.shape, np.nan)
+    np.put_along_axis(values, order, np.where(valid_compressed, compressed, np.nan), axis=0)
+    return values
+
+
+class _RollingSums:
+    """
+    windowed sums of compressed values, all taken from one cumulative sum.
+    The values are shifted by the first non-NaN value of each code before summing,
+    which keeps the round-off of long cumulative sums small.
+    """
+    def __init__(self, values, valid):
+        is_nan = np.isnan(values) | ~valid
+        first = np.argmax(~is_nan, axis=0)
+        self.offset = np.where(is_nan.all(axis=0), 0.0, values[first, np.arange(values.shape[1])])
+        shifted = np.where(is_nan, 0.0, values - self.offset)
+        zeros = np.zeros((1, values.shape[1]))
+        self.sum1 = np.vstack([zeros, np.cumsum(shifted, axis=0)])
+        self.sum2 = np.vstack([zeros, np.cumsum(shifted * shifted, axis=0)])
+        self.n_nan = np.vstack([zeros, np.cumsum(is_nan, axis=0)])
+
+    @staticmethod
+    def _window(cumulative, window):
+        result = np.full((cumulative.shape[0] - 1, cumulative.shape[1]), np.nan)
+        if window <= result.shape[0]:
+            result[window - 1:] = cumulative[window:] - cumulative[:-window]
+        return result
+
+    def mean(self, window):
+        has_nan = self._window(self.n_nan, window) != 0
+        mean = self._window(self.sum1, window) / window + self.offset
+        return np.where(has_nan, np.nan, mean)
+
+    def std(self, window):
+        """
+        sample standard deviation(ddof=1), as pandas rolling std.
+        """
+        if window < 2:
+            return np.full((self.sum1.shape[0] - 1, self.sum1.shape[1]), np.nan)
+        has_nan = self._window(self.n_nan, window) != 0
+        sum1 = self._window(self.sum1, window)
+        variance = (self._window(self.sum2, window) - sum1 * sum1 / window) / (window - 1)
+        return np.where(has_nan, np.nan, np.sqrt(np.maximum(variance, 0.0)))
+
+
+def _as_frame(prices):
+    if isinstance(prices, pd.DataFrame):
+        return prices
+    return pd.DataFrame(prices)
+
+
+def _batch(name, prices, windows):
+    prices = _as_frame(prices)
+    values = prices.values.astype(float)
+    valid = ~np.isnan(values)
+    order, valid_compressed = _compress(valid)
+    compressed = np.take_along_axis(values, order, axis=0)
+    sums = _RollingSums(compressed, valid_compressed)
+    method = sums.mean if name == "ma" else sums.std
+    cube = np.stack([_expand(method(window), order, valid_compressed) for window in windows])
+    return IndicatorCube(name, cube, windows, prices.index, prices.columns,
+                         inputs=(compressed, order, valid_compressed))
+
+
+def batch_ma(close, windows):
+    """
+    moving averages of many windows for all the stocks.
+    Args:
+        close: <pandas.DataFrame>: close prices, dates as index, codes as columns.
+        windows: <list: int>: e.g. range(5, 255, 5).
+    Returns:
+        <IndicatorCube>
+    """
+    return _batch("ma", close, windows)
+
+
+def batch_std(close, windows):
+    """
+    moving standard deviations of many windows for all the stocks.
+    Args:
+        close: <pandas.DataFrame>: close prices, dates as index, codes as columns.
+        windows: <list: int>
+    Returns:
+        <IndicatorCube>
+    """
+    return _batch("std", close, windows)
+
+
+def batch_atr(high, low, close, windows):
+    """
+    average true ranges of many windows for all the stocks. The true range of
+    the first trading day after a suspension uses the close before suspension.
+    Args:
+        high: <pandas.DataFrame>: high prices, dates as index, codes as columns.
+        low: <pandas.DataFrame>: aligned with high.
+        close: <pandas.DataFrame>: aligned with high.
+        windows: <list: int>
+    Returns:
+        <IndicatorCube>
+    """
+    close = _as_frame(close)
+    close_values = close.values.astype(float)
+    valid = ~np.isnan(close_values)
+    order, valid_compressed = _compress(valid)
+
+    def _take(prices):
+        return np.take_along_axis(np.asarray(prices, dtype=float), order, axis=0)
+
+    tr_values = true_range(_take(high), _take(low), _take(close_values))
+    sums = _RollingSums(tr_values, valid_compressed)
+    cube = np.stack([_expand(sums.mean(window), order, valid_compressed) for window in windows])
+    return IndicatorCube("atr", cube, windows, close.index, close.columns,
+                         inputs=(tr_values, order, valid_compressed))
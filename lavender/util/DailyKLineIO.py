@@ -6,14 +6,18 @@ History: 2016.06.19
 """
 
 import os
-import re
 import numpy as np
 import pandas as pd
-from sklearn import linear_model
 
 import lavender.config as cfg
 import lavender.constant as ct
 import lavender.util.plotReturn as Pr
+import lavender.util.KLineStore as Ks
+from lavender.util.KLineCache import kline_cache
+from lavender.util.IndicatorCache import indicator_cache, cache_code, Fingerprint
+import lavender.util.IncrementalIndicator as Ii
+import lavender.util.MarketBeta as Mb
+from lavender.util.TradeCalendar import trade_calendar
 
 
 def linear_weight(shift, slope, intercept):
@@ -33,16 +37,62 @@ def _month_return(daily_stock):
     Returns:
         month_return
     """
-    month_group = daily_stock.groupby(pd.TimeGrouper(freq="M"))
-    last_day = month_group.last()
-    if len(month_group) >= 2:
-        month_return = last_day.close/last_day.shift(1).close
+    month_return = Mb.monthly_returns(daily_stock[["close"]])["close"]
+    if len(month_return) >= 2:
         return month_return
     else:
         print("Stock data is less than two months!")
         raise ValueError
 
 
+def true_range(high, low, close):
+    """
+    True range of each day: the largest of high - low, |low - last close|
+    and |high - last close|. NaN on the first day.
+    Args:
+        high: <array like>: high prices, days along the first axis.
+        low: <array like>: low prices.
+        close: <array like>: close prices.
+    Returns:
+        <numpy.ndarray>: the same shape as close.
+    """
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    close = np.asarray(close, dtype=float)
+    tr_array = np.full(close.shape, np.nan)
+    if len(close) < 2:
+        return tr_array
+    last_close = close[:-1]
+    tr_rest = np.abs(high[1:] - low[1:])
+    # same as the builtin max(): a later range replaces the former one only if
+    # it is strictly larger, so even NaN are handled identically.
+    for price_range in [np.abs(low[1:] - last_close), np.abs(high[1:] - last_close)]:
+        tr_rest = np.where(price_range > tr_rest, price_range, tr_rest)
+    tr_array[1:] = tr_rest
+    return tr_array
+
+
+def pivot_points(prices, half_window, kind):
+    """
+    Find prices which are the extremum of the centered moving window.
+    Args:
+        prices: <array like>: low prices for support, or high prices for resistance.
+        half_window: <int>: the moving window covers 2 * half_window + 1 days.
+        kind: <str>: "support"(minimum) or "resistance"(maximum).
+    Returns:
+        <numpy.ndarray>: prices on pivot days, NaN on other days.
+    """
+    prices = np.asarray(prices, dtype=float)
+    rolling = pd.Series(prices).rolling(window=2 * half_window + 1, center=True)
+    if kind == "support":
+        extremum = rolling.min().values
+    elif kind == "resistance":
+        extremum = rolling.max().values
+    else:
+        raise ValueError("kind should be 'support' or 'resistance'!")
+    return np.where(prices == extremum, prices, np.nan)
+
+
 class KLine:
     """
     class restoring a stock's historical K Lines
@@ -51,7 +101,15 @@ class KLine:
         stock_data: <pandas.DataFrame>: data in specified date
     Methods:
     """
-    def __init__(self, code):
+    def __init__(self, code, use_cache=True, columns=None, date_range=None):
+        """
+        Args:
+            code: <str>: code of a stock, or path of a K-line csv file.
+            use_cache: <bool>: whether to load data through the process-wide K line cache.
+            columns: <list: str>: columns to load, e.g. ["open", "close"]. default: all columns.
+            date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD", dates to load. default: all dates.
+                        Unlike date_cut, indicators are computed only on the dates loaded.
+        """
         if os.path.exists(code):
             # "code" input is already a path
             self.code = os.path.basename(code.split('.')[0])
@@ -60,17 +118,83 @@ class KLine:
             self.code = code
             file_name = code + ct.FILE_EXT['csv']
             file_path = os.path.join(cfg.kline_dir, file_name)
-            if not os.path.exists(file_path):
+            if not os.path.exists(file_path) and not Ks.is_fresh(Ks.store_dir_for(file_path)):
                 raise IOError("no data for %s!" % code)
 
         self.beta_coef = None
         self.market_return = None
-        self._stock_whole_data = pd.read_csv(file_path, index_col=0, parse_dates=True)
-        self.stock_data = pd.read_csv(file_path, index_col=0, parse_dates=True)
+        if use_cache:
+            # the cached frame is shared, never modify it in place.
+            self._stock_whole_data = kline_cache.get(file_path, columns=columns,
+                                                     date_range=date_range).copy(deep=False)
+        else:
+            self._stock_whole_data = Ks.read_kline_file(file_path, columns=columns,
+                                                        date_range=date_range)
+        # a shallow copy: columns added to one frame don't show up in the other.
+        self.stock_data = self._stock_whole_data.copy(deep=False)
+
+        # name of the stock in the indicator cache, e.g. "stocks/600519" or "index/000001".
+        self._cache_code = cache_code(os.path.dirname(os.path.abspath(file_path)), self.code)
+        self._fingerprints = dict()
+        # (calendar, index of stock_data, rows), see calendar_rows.
+        self._calendar_rows = (None, None, None)
+
+    @classmethod
+    def from_frame(cls, code, data):
+        """
+        K line of data already loaded, e.g. attached from shared memory.
+        Its indicators are not cached on disk.
+        Args:
+            code: <str>: code of the stock.
+            data: <pandas.DataFrame>: K-line data with dates as index.
+        Returns:
+            <KLine>
+        """
+        k_line = cls.__new__(cls)
+        k_line.code = code
+        k_line.beta_coef = None
+        k_line.market_return = None
+        k_line._stock_whole_data = data
+        k_line.stock_data = data.copy(deep=False)
+        k_line._cache_code = None
+        k_line._fingerprints = dict()
+        k_line._calendar_rows = (None, None, None)
+        return k_line
 
     def __getitem__(self, item):
         return self.stock_data[item]
 
+    def fingerprint(self, columns):
+        """
+        fingerprint of the whole data in selected columns(see util/IndicatorCache.py).
+        """
+        columns = tuple(columns)
+        if columns not in self._fingerprints:
+            self._fingerprints[columns] = Fingerprint.of(self._stock_whole_data, columns)
+        return self._fingerprints[columns]
+
+    def _whole_indicator(self, key, columns, compute):
+        """
+        values of an indicator on the whole data, from the on-disk indicator
+        cache if the input data is unchanged since it was cached.
+        Args:
+            key: <str>: indicator name with parameters, e.g. "MA250".
+            columns: <list: str>: input columns of the indicator.
+            compute: <function>: compute the values if not cached.
+        Returns:
+            <pandas.Series>: indexed with dates of the whole data.
+        """
+        if not cfg.indicator_cache_enabled or self._cache_code is None:
+            return pd.Series(compute(), index=self._stock_whole_data.index)
+        fingerprint = self.fingerprint(columns)
+        values = indicator_cache.get(self._cache_code, key, fingerprint)
+        if values is None:
+            values = np.asarray(compute(), dtype=float)
+            # with the last input rows, the entry can be extended by new bars(see IncrementalIndicator.py).
+            indicator_cache.put(self._cache_code, key, fingerprint, values,
+                                **Ii.tail_state(key, self._stock_whole_data))
+        return pd.Series(values, index=self._stock_whole_data.index)
+
     def __len__(self):
         return len(self._stock_whole_data)
 
@@ -78,6 +202,39 @@ class KLine:
     def date(self):
         return self.stock_data.index
 
+    def calendar_rows(self, calendar=None):
+        """
+        rows of stock_data on the days of a calendar, kept until stock_data is cut again.
+        Args:
+            calendar: <TradeCalendar.TradeCalendar>: default: the master calendar.
+        Returns:
+            <numpy.ndarray: int>: row of each calendar day, -1 on days the stock was not traded.
+        """
+        calendar = trade_calendar() if calendar is None else calendar
+        cached_calendar, cached_index, rows = self._calendar_rows
+        if cached_calendar is not calendar or cached_index is not self.stock_data.index:
+            rows = calendar.rows(self.stock_data.index)
+            self._calendar_rows = (calendar, self.stock_data.index, rows)
+        return rows
+
+    def row_of(self, date):
+        """
+        row of a date in stock_data, by integer access through the master calendar.
+        Args:
+            date: <pandas.Timestamp>: a date in stock_data.
+        Returns:
+            <int>
+        """
+        calendar = trade_calendar()
+        position = calendar.position(date)
+        if position < 0:
+            # not in the master calendar, e.g. after the index data ends.
+            return self.date.get_loc(date)
+        row = self.calendar_rows(calendar)[position]
+        if row < 0:
+            raise KeyError(date)
+        return int(row)
+
     @property
     def years(self):
         """
@@ -94,16 +251,10 @@ class KLine:
         if 'TR' in self.stock_data:
             return self.stock_data['TR']
         else:
-            tr_list = list()
-            for i, close_price in enumerate(self._stock_whole_data.close.ix[:-1]):
-                high_price = self._stock_whole_data.high.ix[i + 1]
-                low_price = self._stock_whole_data.low.ix[i + 1]  # the last day's close price
-                tr_list.append(max(abs(high_price - low_price),
-                                   abs(low_price - close_price),
-                                   abs(high_price - close_price)))
-
-            tr_series = pd.Series(index=self._stock_whole_data.index)
-            tr_series[1:] = tr_list
+            tr_series = self._whole_indicator(
+                'TR', ['high', 'low', 'close'],
+                lambda: true_range(self._stock_whole_data.high, self._stock_whole_data.low,
+                                   self._stock_whole_data.close))
             self._stock_whole_data.loc[:, 'TR'] = tr_series
             self.stock_data.loc[self.date, 'TR'] = self._stock_whole_data.loc[self.date, 'TR'].copy()
             return self.stock_data.loc[self.date, 'TR']
@@ -117,13 +268,9 @@ class KLine:
             support_up2date = self._stock_whole_data.loc[:self.date[-1], 'support'].copy()
             return support_up2date
         else:
-            support_line = np.full(len(self), np.nan)
-            index = self._stock_whole_data.index
-            minimum = self._stock_whole_data["low"].rolling(window=2 * cfg.support_window + 1, center=True).min()
-            for iday in range(len(self)):
-                if self._stock_whole_data.low[index[iday]] == minimum[index[iday]]:
-                    support_line[iday] = self._stock_whole_data.low[index[iday]]
-            support_line = pd.Series(support_line, index=self._stock_whole_data.index)
+            support_line = self._whole_indicator(
+                'support%d' % cfg.support_window, ['low'],
+                lambda: pivot_points(self._stock_whole_data["low"], cfg.support_window, "support"))
             self._stock_whole_data['support'] = support_line
             self.stock_data.loc[self.date, 'support'] = self._stock_whole_data.loc[self.date, 'support'].copy()
             support_up2date = self._stock_whole_data.loc[:self.date[-1], 'support'].copy()
@@ -138,13 +285,9 @@ class KLine:
             support_up2date = self._stock_whole_data.loc[:self.date[-1], 'resistance'].copy()
             return support_up2date
         else:
-            resistance_line = np.full(len(self), np.nan)
-            index = self._stock_whole_data.index
-            maximum = self._stock_whole_data["high"].rolling(window=2 * cfg.resistance_window + 1, center=True).max()
-            for iday in range(len(self)):
-                if self._stock_whole_data.high[index[iday]] == maximum[index[iday]]:
-                    resistance_line[iday] = self._stock_whole_data.high[index[iday]]
-            resistance_line = pd.Series(resistance_line, index=self._stock_whole_data.index)
+            resistance_line = self._whole_indicator(
+                'resistance%d' % cfg.resistance_window, ['high'],
+                lambda: pivot_points(self._stock_whole_data["high"], cfg.resistance_window, "resistance"))
             self._stock_whole_data['resistance'] = resistance_line
             self.stock_data.loc[self.date, 'resistance'] = self._stock_whole_data.loc[self.date, 'resistance'].copy()
             support_up2date = self._stock_whole_data.loc[:self.date[-1], 'resistance'].copy()
@@ -156,34 +299,11 @@ class KLine:
         regression with monthly return.
         """
         month_return = _month_return(self.stock_data)
-        ref_kline = KLine(os.path.join(cfg.index_dir, ref_index+ct.FILE_EXT["csv"]))
-        ref_month_return = _month_return(ref_kline.stock_data)
-
-        st_date, ed_date = re.split('D+', date_range.strip())
-        if len(st_date) == 0:
-            st_date = None
-        if len(ed_date) == 0:
-            ed_date = None
-
-        month_return = month_return[st_date:ed_date]
-        ref_month_return = ref_month_return[st_date:ed_date]
-        # Assume index series is always more integrated.
-        if len(ref_month_return) != len(month_return):
-            ref_month_return = ref_month_return[month_return.index]
-        month_return_arr = np.array(month_return)
-        ref_month_return_arr = np.array(ref_month_return)
-        # print month_return
-        # print ref_month_return
-        sel_ref_return_arr = ref_month_return_arr[~np.isnan(month_return_arr) & ~np.isnan(ref_month_return_arr)]
-        sel_return_arr = month_return_arr[~np.isnan(month_return_arr) & ~np.isnan(ref_month_return_arr)]
-
-        reg = linear_model.LinearRegression()
-        reg.fit(sel_ref_return_arr.reshape(-1, 1), sel_return_arr)
-
-        self.beta_coef = reg.coef_[0]
-        self.market_return = np.prod(sel_ref_return_arr) ** (12.0/len(sel_ref_return_arr)) - 1
-
-        # print np.prod(sel_return_arr) ** (12.0/len(sel_ref_return_arr)) - 1   # should be the same as required return?
+        # monthly returns of the reference index are read once for all the stocks.
+        result = Mb.betas(month_return.to_frame(), Mb.ref_monthly_returns(ref_index), date_range).iloc[0]
+
+        self.beta_coef = result["beta"]
+        self.market_return = result["market_return"]
         return self.beta_coef
 
     def required_return(self, rf=0.04, date_range="2012:2016",
@@ -218,8 +338,9 @@ class KLine:
         if key in self.stock_data:
             return self.stock_data[key]
         else:
-            self.stock_data[key] = self._stock_whole_data['close'].rolling(
-                                                window=ma_days, center=False).mean()
+            self.stock_data[key] = self._whole_indicator(
+                key, ['close'],
+                lambda: self._stock_whole_data['close'].rolling(window=ma_days, center=False).mean().values)
             return self.stock_data[key]
 
     def atr(self, atr_days):
@@ -233,9 +354,10 @@ class KLine:
         if key in self.stock_data:
             return self.stock_data[key]
         else:
-            _ = self.tr
-            self.stock_data[key] = self._stock_whole_data['TR'].rolling(
-                                                window=atr_days, center=False).mean()
+            def _atr():
+                _ = self.tr
+                return self._stock_whole_data['TR'].rolling(window=atr_days, center=False).mean().values
+            self.stock_data[key] = self._whole_indicator(key, ['high', 'low', 'close'], _atr)
             return self.stock_data[key]
 
     def std_dev(self, std_days):
@@ -243,8 +365,9 @@ class KLine:
         if key in self.stock_data:
             return self.stock_data[key]
         else:
-            self.stock_data[key] = self._stock_whole_data['close'].rolling(
-                                                window=std_days, center=False).std()
+            self.stock_data[key] = self._whole_indicator(
+                key, ['close'],
+                lambda: self._stock_whole_data['close'].rolling(window=std_days, center=False).std().values)
             return self.stock_data[key]
 
     def date_cut(self, date):
@@ -253,12 +376,7 @@ class KLine:
         Args:
             date:
         """
-        st_date, ed_date = re.split('D+', date.strip())
-        if len(st_date) == 0:
-            st_date = None
-        if len(ed_date) == 0:
-            ed_date = None
-
+        st_date, ed_date = ct.split_date_range(date)
         self.stock_data = self._stock_whole_data.loc[st_date:ed_date].copy()
 
     def show(self, *args):
@@ -267,8 +385,16 @@ class KLine:
 
 
 class Indicator(KLine):
-    def __init__(self, code):
-        KLine.__init__(self, code)
+    def __init__(self, code, use_cache=True, columns=None, date_range=None):
+        """
+        Args:
+            code: <str>: code of a stock, or path of a K-line csv file.
+            use_cache: <bool>: whether to load data through the process-wide K line cache.
+            columns: <list: str>: columns to load, e.g. ["open", "close"]. default: all columns.
+            date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD", dates to load. default: all dates.
+                        Unlike date_cut, indicators are computed only on the dates loaded.
+        """
+        KLine.__init__(self, code, use_cache=use_cache, columns=columns, date_range=date_range)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,151 @@
+"""
+Incremental update of cached K-line indicators.
+
+Every entry of the indicator cache(see util/IndicatorCache.py) keeps, beside
+the values, the last input rows the indicator needs to go on: w - 1 close
+prices for MA<w> and STD<w>, the last bar for TR, w bars for ATR<w>, and
+2n prices for support<n>/resistance<n>, whose last n pivots are not
+confirmed until n more days are known. When new bars are appended to a
+stock's data, the entries are extended from that state in O(new bars),
+instead of being recomputed over the whole history.
+"""
+
+import re
+import numpy as np
+import pandas as pd
+
+import lavender.util.DailyKLineIO as Dk
+from lavender.util.IndicatorCache import indicator_cache
+
+
+def _rolling_mean(data, window):
+    return pd.Series(np.asarray(data["close"], dtype=float)).rolling(window=window).mean().values
+
+
+def _rolling_std(data, window):
+    return pd.Series(np.asarray(data["close"], dtype=float)).rolling(window=window).std().values
+
+
+def _true_range(data, _):
+    return Dk.true_range(data["high"], data["low"], data["close"])
+
+
+def _average_true_range(data, window):
+    return pd.Series(_true_range(data, None)).rolling(window=window).mean().values
+
+
+def _support(data, half_window):
+    return Dk.pivot_points(data["low"], half_window, "support")
+
+
+def _resistance(data, half_window):
+    return Dk.pivot_points(data["high"], half_window, "resistance")
+
+
+# name: (input columns, compute(data, param), lookback(param), delay(param)).
+# lookback: number of former rows needed to compute a new row.
+# delay: number of last rows which change when new rows come.
+INDICATORS = {
+    "MA": (["close"], _rolling_mean, lambda w: w - 1, lambda w: 0),
+    "STD": (["close"], _rolling_std, lambda w: w - 1, lambda w: 0),
+    "TR": (["high", "low", "close"], _true_range, lambda _: 1, lambda _: 0),
+    "ATR": (["high", "low", "close"], _average_true_range, lambda w: w, lambda w: 0),
+    "support": (["low"], _support, lambda n: 2 * n, lambda n: n),
+    "resistance": (["high"], _resistance, lambda n: 2 * n, lambda n: n),
+}
+
+
+def parse_key(key):
+    """
+    Args:
+        key: <str>: indicator key in the cache, e.g. "MA60", "TR", "support20".
+    Returns:
+        <tuple>: (name, param), param is None for keys without one.
+                 None if the indicator can't be updated incrementally.
+    """
+    match = re.match(r"^([A-Za-z]+)(\d*)$", key)
+    if match is None or match.group(1) not in INDICATORS:
+        return None
+    return match.group(1), int(match.group(2)) if match.group(2) else None
+
+
+def columns_of(key):
+    """
+    input columns of an indicator.
+    """
+    return INDICATORS[parse_key(key)[0]][0]
+
+
+def tail_state(key, data):
+    """
+    the last input rows an indicator needs to be extended.
+    Args:
+        key: <str>: indicator key, e.g. "MA60".
+        data: <pandas.DataFrame>: the whole input data of the indicator.
+    Returns:
+        <dict>: {"tail": <numpy.ndarray>: (rows x input columns)}, to save with
+                the cache entry. Empty if the indicator isn't incremental.
+    """
+    parsed = parse_key(key)
+    if parsed is None:
+        return dict()
+    name, param = parsed
+    columns, _, lookback, delay = INDICATORS[name]
+    n_tail = lookback(param) + delay(param)
+    values = np.column_stack([np.asarray(data[column], dtype=float) for column in columns])
+    return {"tail": values[max(len(values) - n_tail, 0):]}
+
+
+def extend(key, values, tail, new_data):
+    """
+    extend an indicator by new rows.
+    Args:
+        key: <str>: indicator key, e.g. "MA60".
+        values: <numpy.ndarray>: values of the indicator on the former rows.
+        tail: <numpy.ndarray>: state saved by tail_state.
+        new_data: <pandas.DataFrame>: new rows, having the input columns.
+    Returns:
+        values: <numpy.ndarray>: values on all the rows.
+        tail: <numpy.ndarray>: state of all the rows.
+    """
+    name, param = parse_key(key)
+    columns, compute, lookback, delay = INDICATORS[name]
+    new_values = np.column_stack([np.asarray(new_data[column], dtype=float) for column in columns])
+    inputs = np.vstack([np.asarray(tail, dtype=float).reshape(-1, len(columns)), new_values])
+    computed = compute(pd.DataFrame(inputs, columns=columns), param)
+    # rows of the tail whose values change with the new rows.
+    n_changed = min(delay(param), len(tail))
+    values = np.concatenate([values[:len(values) - n_changed], computed[len(tail) - n_changed:]])
+    n_tail = lookback(param) + delay(param)
+    return values, inputs[max(len(inputs) - n_tail, 0):]
+
+
+def extend_code(code, new_data, last_date, cache=None):
+    """
+    extend all the cached indicators of a stock by newly appended bars.
+    Entries not computed up to last_date are left alone: they are stale and
+    get recomputed when used.
+    Args:
+        code: <str>: code with namespace, e.g. "stocks/600519"(see IndicatorCache.cache_code).
+        new_data: <pandas.DataFrame>: the appended bars, dates as index.
+        last_date: <str>: the last date before the new bars.
+        cache: <IndicatorCache>: default: the process-wide indicator cache.
+    Returns:
+        <int>: number of extended indicators.
+    """
+    cache = indicator_cache if cache is None else cache
+    if new_data.empty:
+        return 0
+    last_date = pd.Timestamp(last_date).value
+    n_extended = 0
+    for key in cache.keys(code):
+        if parse_key(key) is None:
+            continue
+        entry = cache.load(code, key)
+        if entry is None or "tail" not in entry or entry["fingerprint"].last_date != last_date:
+            continue
+        values, tail = extend(key, entry["values"], entry["tail"], new_data)
+        fingerprint = entry["fingerprint"].extend(new_data, columns_of(key))
+        cache.put(code, key, fingerprint, values, tail=tail)
+        n_extended += 1
+    return n_extended
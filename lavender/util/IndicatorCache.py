@@ -0,0 +1,254 @@
+"""
+Persistent on-disk cache of K-line indicators.
+
+An entry holds the whole series of one indicator(e.g. "MA250") of one
+stock, saved as "<cfg.indicator_cache_dir>/<namespace>/<code>/<key>.npz"
+with the fingerprint of the data it was computed on. The fingerprint is
+made of the number of rows, the last date and the sum of the row hashes of
+the input columns, so any change of the source data makes the entry stale.
+The total size of the cache is bounded by cfg.indicator_cache_bytes, the
+least recently used entries being evicted first.
+"""
+
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+import lavender.config as cfg
+
+ENTRY_EXT = ".npz"
+
+
+def cache_code(data_dir, code):
+    """
+    name of a stock in the cache: the code with the name of its data
+    directory as namespace, e.g. "stocks/600519" or "index/000001".
+    """
+    return os.path.join(os.path.basename(os.path.normpath(data_dir)), code)
+
+
+class Fingerprint:
+    """
+    fingerprint of the input columns of an indicator.
+    Members:
+        n_rows: <int>: number of rows.
+        last_date: <int>: the last date in nanoseconds, -1 for empty data.
+        hash_sum: <int>: sum of the row hashes (modulo 2**64). Being a sum, it
+                         can be extended by the hashes of appended rows.
+    """
+    def __init__(self, n_rows, last_date, hash_sum):
+        self.n_rows = int(n_rows)
+        self.last_date = int(last_date)
+        self.hash_sum = int(hash_sum)
+
+    def __eq__(self, other):
+        return isinstance(other, Fingerprint) and self.as_tuple() == other.as_tuple()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%d/%d/%016x" % self.as_tuple()
+
+    @classmethod
+    def parse(cls, text):
+        n_rows, last_date, hash_sum = str(text).split("/")
+        return cls(int(n_rows), int(last_date), int(hash_sum, 16))
+
+    def as_tuple(self):
+        return self.n_rows, self.last_date, self.hash_sum
+
+    @staticmethod
+    def row_hashes(data, columns):
+        """
+        hashes of rows(dates and values of columns) of K-line data.
+        Values are taken as float64 and dates as datetime64[ns], so the hashes
+        don't depend on the format the data was read from.
+        """
+        frame = pd.DataFrame(dict((column, np.asarray(data[column], dtype=float)) for column in columns),
+                             index=pd.DatetimeIndex(data.index).astype("datetime64[ns]"),
+                             columns=list(columns))
+        return pd.util.hash_pandas_object(frame, index=True).values
+
+    @classmethod
+    def of(cls, data, columns):
+        """
+        Args:
+            data: <pandas.DataFrame>: K-line data with dates as index.
+            columns: <list: str>: input columns of the indicator.
+        Returns:
+            <Fingerprint>
+        """
+        hashes = cls.row_hashes(data, columns)
+        last_date = pd.Timestamp(data.index[-1]).value if len(data) else -1
+        return cls(len(data), last_date, int(np.sum(hashes, dtype=np.uint64)))
+
+    def extend(self, new_data, columns):
+        """
+        fingerprint of the data after new_data is appended.
+        """
+        hashes = self.row_hashes(new_data, columns)
+        hash_sum = (self.hash_sum + int(np.sum(hashes, dtype=np.uint64))) % 2 ** 64
+        last_date = pd.Timestamp(new_data.index[-1]).value if len(new_data) else self.last_date
+        return Fingerprint(self.n_rows + len(new_data), last_date, hash_sum)
+
+
+class IndicatorCache:
+    """
+    size-bounded on-disk cache of indicators.
+    Members:
+        cache_dir: <str>
+        max_bytes: <int>: size bound of all the entries.
+        hits: <int>
+        misses: <int>
+        evictions: <int>
+    """
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cfg.indicator_cache_dir if cache_dir is None else cache_dir
+        self.max_bytes = cfg.indicator_cache_bytes if max_bytes is None else max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._nbytes = None     # total size, scanned on the first put.
+        self._lock = threading.Lock()
+
+    def entry_path(self, code, key):
+        """
+        Args:
+            code: <str>: code with namespace, e.g. "stocks/600519".
+            key: <str>: indicator name with parameters, e.g. "MA250".
+        """
+        return os.path.join(self.cache_dir, code, key + ENTRY_EXT)
+
+    def load(self, code, key):
+        """
+        load an entry whatever its fingerprint is.
+        Returns:
+            <dict>: "values", "fingerprint" and other arrays saved with the entry.
+                    None if not exists.
+        """
+        path = self.entry_path(code, key)
+        try:
+            with np.load(path) as npz:
+                entry = dict((name, npz[name]) for name in npz.files)
+        except (IOError, OSError, ValueError):
+            return None
+        entry["fingerprint"] = Fingerprint.parse(entry["fingerprint"])
+        return entry
+
+    def keys(self, code):
+        """
+        Returns:
+            <list: str>: keys of the indicators cached for a stock.
+        """
+        code_dir = os.path.dirname(self.entry_path(code, ""))
+        try:
+            file_names = os.listdir(code_dir)
+        except OSError:
+            return list()
+        return sorted(file_name[:-len(ENTRY_EXT)] for file_name in file_names
+                      if file_name.endswith(ENTRY_EXT) and ".tmp" not in file_name)
+
+    def get(self, code, key, fingerprint):
+        """
+        Returns:
+            <numpy.ndarray>: values of the indicator, None if not cached or stale.
+        """
+        entry = self.load(code, key)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            # mark the entry as recently used.
+            os.utime(self.entry_path(code, key), None)
+        except OSError:
+            pass
+        return entry["values"]
+
+    def put(self, code, key, fingerprint, values, **arrays):
+        """
+        save values of an indicator, replacing the former entry.
+        Args:
+            code: <str>: code with namespace, e.g. "stocks/600519".
+            key: <str>: indicator name with parameters, e.g. "MA250".
+            fingerprint: <Fingerprint>: fingerprint of the input data.
+            values: <numpy.ndarray>: values of the indicator.
+            **arrays: other arrays to save with the entry.
+        """
+        path = self.entry_path(code, key)
+        entry_dir = os.path.dirname(path)
+        if not os.path.exists(entry_dir):
+            try:
+                os.makedirs(entry_dir)
+            except OSError:
+                pass
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        tmp_path = path + ".tmp" + ENTRY_EXT
+        np.savez(tmp_path, values=np.asarray(values, dtype=float),
+                 fingerprint=np.array(repr(fingerprint)), **arrays)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._nbytes is not None:
+                self._nbytes += os.path.getsize(path) - old_size
+        self._evict()
+
+    def _entries(self):
+        """
+        Returns:
+            <list: tuple>: (mtime, size, path) of all the entries. mtime is
+                           updated on every hit, so it's the last used time.
+        """
+        entries = list()
+        for root, _, files in os.walk(self.cache_dir):
+            for file_name in files:
+                if not file_name.endswith(ENTRY_EXT):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            if self._nbytes is None:
+                self._nbytes = sum(size for _, size, _ in self._entries())
+            if self._nbytes <= self.max_bytes:
+                return
+            # evict down to 90% of the bound, so evictions don't happen on every put.
+            entries = sorted(self._entries())
+            self._nbytes = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if self._nbytes <= 0.9 * self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._nbytes -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._nbytes = 0
+
+    def info(self):
+        """
+        Returns:
+            <dict>: statistics of the cache.
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "nbytes": self._nbytes, "max_bytes": self.max_bytes}
+
+
+# the cache shared by the whole process.
+indicator_cache = IndicatorCache()
@@ -0,0 +1,137 @@
+"""
+Process-wide cache of loaded K-line data.
+
+Loaded DataFrames are kept by file path, evicted in least-recently-used
+order once the memory budget (cfg.kline_cache_bytes) is exceeded, and
+dropped when the file's mtime or size changes.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import lavender.config as cfg
+import lavender.util.KLineStore as Ks
+
+
+def _file_signature(file_path):
+    """
+    (mtime, size) of the csv file and of its columnar store meta file,
+    None for the missing ones.
+    """
+    signature = list()
+    for path in [file_path, os.path.join(Ks.store_dir_for(file_path), Ks.META_FILE)]:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _data_bytes(data):
+    return int(data.memory_usage(index=True, deep=False).sum())
+
+
+class KLineCache:
+    """
+    LRU cache of K-line DataFrames keyed by file path(and the columns and
+    date range loaded).
+    Members:
+        max_bytes: <int>: memory budget of cached data.
+        hits: <int>: number of loads served from cache.
+        misses: <int>: number of loads read from disk.
+        evictions: <int>: number of entries evicted for memory budget.
+        invalidations: <int>: number of entries dropped since files changed.
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = cfg.kline_cache_bytes if max_bytes is None else max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, file_path):
+        return any(key[0] == os.path.abspath(file_path) for key in self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, file_path, columns=None, date_range=None):
+        """
+        get data of a K-line file, reading it from disk on a miss.
+        Loads of the same file with different columns or date range are
+        cached separately. The cached DataFrame is shared: don't modify it
+        in place, take a copy(deep=False) and add columns on that.
+        Args:
+            file_path: <str>: path of the K-line csv file.
+            columns: <list: str>: columns to load. default: all columns.
+            date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD". default: all dates.
+        Returns:
+            <pandas.DataFrame>
+        """
+        file_path = os.path.abspath(file_path)
+        key = (file_path, None if columns is None else tuple(columns), date_range)
+        signature = _file_signature(file_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == signature:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._pop(key)
+                self.invalidations += 1
+            self.misses += 1
+
+        data = Ks.read_kline_file(file_path, columns=columns, date_range=date_range)
+        nbytes = _data_bytes(data)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if nbytes <= self.max_bytes:
+                self._entries[key] = (signature, data, nbytes)
+                self._nbytes += nbytes
+                while self._nbytes > self.max_bytes:
+                    self._pop(next(iter(self._entries)))
+                    self.evictions += 1
+        return data
+
+    def _pop(self, key):
+        _, _, nbytes = self._entries.pop(key)
+        self._nbytes -= nbytes
+
+    def resize(self, max_bytes):
+        """
+        change the memory budget, evicting entries if necessary.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._entries and self._nbytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def info(self):
+        """
+        Returns:
+            <dict>: statistics of the cache.
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations, "entries": len(self._entries),
+                "nbytes": self._nbytes, "max_bytes": self.max_bytes}
+
+
+# the cache shared by the whole process.
+kline_cache = KLineCache()
@@ -0,0 +1,405 @@
+"""
+Memory-mapped columnar store of daily K lines.
+
+Each stock is saved in a directory of its own, holding one raw binary
+file per field, a date index file and a small json meta file:
+
+    data/stocks_bin/600519/meta.json
+    data/stocks_bin/600519/date.bin      <int64>: dates in nanoseconds.
+    data/stocks_bin/600519/open.bin      <float64>
+    data/stocks_bin/600519/close.bin     ...
+
+Fields are opened with numpy.memmap, so loading a stock costs neither csv
+parsing nor a copy of the data. The store directory of a csv file is
+"<csv directory>_bin/<code>" (see cfg.kline_bin_dir and cfg.index_bin_dir).
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+import lavender.config as cfg
+import lavender.constant as ct
+
+META_FILE = "meta.json"
+DATE_FILE = "date.bin"
+FIELD_FILE = "%s.bin"
+DATE_DTYPE = "<i8"
+
+
+def store_dir_for(csv_path):
+    """
+    get the store directory related to a K-line csv file.
+    Args:
+        csv_path: <str>: path of the csv file, e.g. "data/stocks/600519.csv".
+    Returns:
+        <str>: path of the store directory, e.g. "data/stocks_bin/600519".
+    """
+    csv_dir, file_name = os.path.split(os.path.abspath(csv_path))
+    code = os.path.splitext(file_name)[0]
+    return os.path.join(csv_dir + cfg.bin_dir_suffix, code)
+
+
+def is_fresh(store_dir, csv_path=None):
+    """
+    check if a store exists and is not older than its csv file.
+    Args:
+        store_dir: <str>: path of the store directory.
+        csv_path: <str>: path of the csv file. Ignored if None or not exists.
+    Returns:
+        <bool>
+    """
+    meta_path = os.path.join(store_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    if csv_path is not None and os.path.exists(csv_path):
+        return os.path.getmtime(csv_path) <= os.path.getmtime(meta_path)
+    return True
+
+
+def read_meta(store_dir):
+    with open(os.path.join(store_dir, META_FILE)) as fin:
+        return json.load(fin)
+
+
+def _write_meta(store_dir, meta):
+    """
+    replace the meta file atomically, so readers never see a half-written store.
+    """
+    meta_path = os.path.join(store_dir, META_FILE)
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w") as fout:
+        json.dump(meta, fout)
+    os.replace(tmp_path, meta_path)
+
+
+def _memmap(path, dtype, length, mode="r"):
+    # numpy.memmap refuses to map an empty file.
+    if length == 0:
+        return np.empty(0, dtype=dtype)
+    # a plain ndarray view keeps the mapping alive, but keeps the memmap
+    # subclass out of pandas objects.
+    return np.asarray(np.memmap(path, dtype=dtype, mode=mode, shape=(length,)))
+
+
+def write_store(data, store_dir):
+    """
+    save K-line data in the columnar store.
+    Numeric columns are saved as fields; object columns holding a single
+    value (like the "code" column of tushare data) are saved in meta file;
+    other columns are dropped.
+    Args:
+        data: <pandas.DataFrame>: K-line data with dates as index.
+        store_dir: <str>: path of the store directory.
+    """
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    data = data.sort_index()
+    dates = pd.DatetimeIndex(pd.to_datetime(data.index))
+    meta = {"length": len(data), "index_name": data.index.name,
+            "columns": [], "fields": {}, "constants": {}}
+
+    def _save(file_name, values):
+        file_path = os.path.join(store_dir, file_name)
+        values.tofile(file_path + ".tmp")
+        os.replace(file_path + ".tmp", file_path)
+
+    _save(DATE_FILE, dates.values.astype("datetime64[ns]").view(DATE_DTYPE))
+    for column in data.columns:
+        values = data[column].values
+        if values.dtype.kind in "biuf":
+            dtype = values.dtype.newbyteorder("<").str
+            _save(FIELD_FILE % column, values.astype(dtype))
+            meta["fields"][column] = dtype
+        elif len(data) > 0 and data[column].nunique(dropna=False) == 1:
+            value = values[0]
+            meta["constants"][column] = value.item() if hasattr(value, "item") else value
+        else:
+            print("warning: column %s of %s is not saved!" % (column, store_dir))
+            continue
+        meta["columns"].append(column)
+    _write_meta(store_dir, meta)
+
+
+def first_store_date(store_dir):
+    """
+    get the first date of a store, reading only the first item of the date file.
+    Returns:
+        <pandas.Timestamp>: None if the store is empty.
+    """
+    if read_meta(store_dir)["length"] == 0:
+        return None
+    item_size = np.dtype(DATE_DTYPE).itemsize
+    with open(os.path.join(store_dir, DATE_FILE), "rb") as fin:
+        value = np.frombuffer(fin.read(item_size), dtype=DATE_DTYPE)[0]
+    return pd.Timestamp(int(value))
+
+
+def last_store_date(store_dir):
+    """
+    get the last date of a store, reading only the last item of the date file.
+    Returns:
+        <pandas.Timestamp>: None if the store is empty.
+    """
+    length = read_meta(store_dir)["length"]
+    if length == 0:
+        return None
+    item_size = np.dtype(DATE_DTYPE).itemsize
+    with open(os.path.join(store_dir, DATE_FILE), "rb") as fin:
+        fin.seek((length - 1) * item_size)
+        value = np.frombuffer(fin.read(item_size), dtype=DATE_DTYPE)[0]
+    return pd.Timestamp(int(value))
+
+
+def append_store(data, store_dir):
+    """
+    append K-line data of dates after the last stored date to the store.
+    Rows are appended to every field file beyond the length in meta file, and
+    the meta file is replaced at last, so readers see either the old rows or
+    all the new rows; bytes left behind by an interrupted append are cut off
+    by the next one. The whole store is rewritten if the columns differ.
+    Args:
+        data: <pandas.DataFrame>: K-line data with dates as index.
+        store_dir: <str>: path of the store directory.
+    """
+    meta = read_meta(store_dir)
+    data = data.sort_index()
+    same_constants = all(column in data.columns and (data[column] == value).all()
+                         for column, value in meta["constants"].items())
+    if sorted(data.columns) != sorted(meta["columns"]) or not same_constants:
+        write_store(pd.concat([read_store(store_dir), data.set_axis(pd.to_datetime(data.index))]), store_dir)
+        return
+    if len(data) == 0:
+        return
+
+    length = meta["length"]
+    dates = pd.DatetimeIndex(pd.to_datetime(data.index))
+
+    def _append(file_name, values):
+        with open(os.path.join(store_dir, file_name), "r+b") as fout:
+            fout.truncate(length * values.dtype.itemsize)
+            fout.seek(0, os.SEEK_END)
+            fout.write(values.tobytes())
+
+    _append(DATE_FILE, dates.values.astype("datetime64[ns]").view(DATE_DTYPE))
+    for column, dtype in meta["fields"].items():
+        _append(FIELD_FILE % column, data[column].values.astype(dtype))
+    meta["length"] = length + len(data)
+    _write_meta(store_dir, meta)
+
+
+def _date_positions(index, date_range):
+    """
+    positions of dates in range, the same as slicing index with .loc.
+    Args:
+        index: <pandas.DatetimeIndex>: sorted dates.
+        date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD", see ct.split_date_range.
+    Returns:
+        <slice>
+    """
+    if date_range is None:
+        return slice(0, len(index))
+    st, ed = index.slice_locs(*ct.split_date_range(date_range))
+    return slice(st, ed)
+
+
+def read_store(store_dir, mode="c", columns=None, date_range=None):
+    """
+    load K-line data from the columnar store without copying.
+    Only the fields in columns are mapped, and only the pages of dates in
+    date_range are touched.
+    Args:
+        store_dir: <str>: path of the store directory.
+        mode: <str>: mode of numpy.memmap. The default copy-on-write mode lets
+                     callers modify the data without touching the files.
+        columns: <list: str>: columns to load. default: all columns.
+        date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD". default: all dates.
+    Returns:
+        <pandas.DataFrame>
+    """
+    meta = read_meta(store_dir)
+    length = meta["length"]
+    dates = _memmap(os.path.join(store_dir, DATE_FILE), DATE_DTYPE, length, mode="r")
+    index = pd.DatetimeIndex(dates.view("datetime64[ns]"), name=meta["index_name"])
+    rows = _date_positions(index, date_range)
+    index = index[rows]
+
+    if columns is None:
+        columns = meta["columns"]
+    else:
+        columns = [column for column in meta["columns"] if column in columns]
+    data = dict()
+    for column in columns:
+        if column in meta["fields"]:
+            data[column] = _memmap(os.path.join(store_dir, FIELD_FILE % column),
+                                   meta["fields"][column], length, mode=mode)[rows]
+        else:
+            data[column] = np.full(len(index), meta["constants"][column], dtype=object)
+    return pd.DataFrame(data, index=index, columns=columns, copy=False)
+
+
+def read_csv(file_path, columns=None, date_range=None, chunk_size=1000):
+    """
+    load a K-line csv file, parsing only the columns selected and keeping
+    only the rows in date range. Since the rows are sorted by date, parsing
+    stops at the first chunk beyond the end of the range.
+    Args:
+        file_path: <str>: path of the csv file.
+        columns: <list: str>: columns to load. default: all columns.
+        date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD". default: all dates.
+        chunk_size: <int>: number of rows parsed at a time if date_range is given.
+    Returns:
+        <pandas.DataFrame>
+    """
+    use_cols = None
+    if columns is not None:
+        header = pd.read_csv(file_path, nrows=0).columns
+        use_cols = [header[0]] + [column for column in header[1:] if column in columns]
+    if date_range is None:
+        return pd.read_csv(file_path, index_col=0, parse_dates=True, usecols=use_cols)
+
+    st_date, ed_date = ct.split_date_range(date_range)
+    ed_time = None if ed_date is None else pd.Period(ed_date).end_time
+    chunks = list()
+    for chunk in pd.read_csv(file_path, index_col=0, parse_dates=True, usecols=use_cols,
+                             chunksize=chunk_size):
+        if len(chunk) == 0:
+            continue
+        chunks.append(chunk.loc[st_date:ed_date])
+        if ed_time is not None and chunk.index[-1] > ed_time:
+            break
+    if len(chunks) == 0:
+        return pd.read_csv(file_path, index_col=0, parse_dates=True, usecols=use_cols, nrows=0)
+    return pd.concat(chunks)
+
+
+def first_csv_date(file_path):
+    """
+    get the first date of a K-line csv file, reading only the first lines of the file.
+    Returns:
+        <str>: the first field of the first row, None if the file has no rows.
+    """
+    with open(file_path, "rb") as fin:
+        fin.readline()      # header
+        for line in fin:
+            if line.strip():
+                return line.split(b",")[0].decode()
+    return None
+
+
+def last_csv_date(file_path, block_size=4096):
+    """
+    get the last date of a K-line csv file, reading only the end of the file.
+    Args:
+        file_path: <str>: path of the csv file.
+        block_size: <int>: number of bytes read at a time from the end.
+    Returns:
+        <str>: the first field of the last row, None if the file has no rows.
+    """
+    with open(file_path, "rb") as fin:
+        fin.seek(0, os.SEEK_END)
+        position = fin.tell()
+        tail = b""
+        # read backwards until a line break comes before the last non-empty line.
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            fin.seek(position)
+            tail = fin.read(read_size) + tail
+            if len(tail.rstrip().splitlines()) > 1:
+                break
+    lines = tail.rstrip().splitlines()
+    # only the header is left.
+    if len(lines) <= 1 and position == 0:
+        return None
+    return lines[-1].split(b",")[0].decode()
+
+
+def append_csv(data, file_path):
+    """
+    append K-line data to a csv file in one write, without rewriting the rows
+    already saved. The file is cut back to its former size if the write fails.
+    Args:
+        data: <pandas.DataFrame>: K-line data with dates as index, having the
+                                  same columns as the file.
+        file_path: <str>: path of the csv file.
+    """
+    header = pd.read_csv(file_path, nrows=0).columns
+    if sorted(header[1:]) != sorted(data.columns):
+        raise ValueError("columns %s don't match %s!" % (list(data.columns), file_path))
+    text = data[list(header[1:])].to_csv(header=False).encode()
+    with open(file_path, "r+b") as fout:
+        fout.seek(0, os.SEEK_END)
+        size = fout.tell()
+        if size > 0:
+            fout.seek(size - 1)
+            if fout.read(1) not in b"\r\n":
+                text = os.linesep.encode() + text
+        try:
+            fout.write(text)
+            fout.flush()
+        except Exception:
+            fout.truncate(size)
+            raise
+
+
+def read_kline_file(file_path, columns=None, date_range=None):
+    """
+    load a K-line csv file, through its store if the store is up to date.
+    Args:
+        file_path: <str>: path of the csv file.
+        columns: <list: str>: columns to load. default: all columns.
+        date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD". default: all dates.
+    Returns:
+        <pandas.DataFrame>
+    """
+    store_dir = store_dir_for(file_path)
+    if is_fresh(store_dir, file_path):
+        return read_store(store_dir, columns=columns, date_range=date_range)
+    return read_csv(file_path, columns=columns, date_range=date_range)
+
+
+def convert_dir(csv_dir, bin_dir=None, overwrite=False):
+    """
+    one-shot conversion of a directory of K-line csv files to the store.
+    Args:
+        csv_dir: <str>: directory of csv files, e.g. cfg.kline_dir.
+        bin_dir: <str>: directory of stores. default: csv_dir + cfg.bin_dir_suffix.
+        overwrite: <bool>: whether to convert files already having a fresh store.
+    Returns:
+        <int>: number of files converted.
+    """
+    if bin_dir is None:
+        bin_dir = csv_dir.rstrip(os.sep) + cfg.bin_dir_suffix
+    if not os.path.exists(csv_dir):
+        print(ct.DATA_MISSING_MESSAGE % ("K line", csv_dir))
+        return 0
+
+    n_converted = 0
+    for file_name in sorted(os.listdir(csv_dir)):
+        code, ext = os.path.splitext(file_name)
+        if ext != ct.FILE_EXT['csv']:
+            continue
+        csv_path = os.path.join(csv_dir, file_name)
+        store_dir = os.path.join(bin_dir, code)
+        if not overwrite and is_fresh(store_dir, csv_path):
+            continue
+        write_store(pd.read_csv(csv_path, index_col=0, parse_dates=True), store_dir)
+        n_converted += 1
+        ct.write_console()
+    return n_converted
+
+
+def convert_all(overwrite=False):
+    """
+    convert all the stock and index csv files to the store.
+    """
+    for csv_dir in [cfg.kline_dir, cfg.index_dir]:
+        n_converted = convert_dir(csv_dir, overwrite=overwrite)
+        print("%s%d files converted in %s" % (ct.NEW_LINE_CHAR, n_converted, csv_dir))
+
+
+if __name__ == "__main__":
+    convert_all()
@@ -0,0 +1,113 @@
+"""
+Index of listing dates of stocks.
+
+The first trading date of every stock, read from the first row of its K
+line in cfg.kline_dir(csv file, or columnar store if there's no csv), is
+saved with the modification time of the file it came from in
+cfg.listing_index_path. Loading the index reads again only the K lines
+changed since, so checking when the stocks of the whole market were listed
+reads one small file instead of a K line per stock.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+import lavender.config as cfg
+import lavender.constant as ct
+import lavender.util.KLineStore as Ks
+from lavender.util.PanelStore import _list_codes
+
+_COLUMNS = ["code", "first_date", "mtime"]
+
+
+def _source(code, kline_dir):
+    """
+    the file a stock's first date is read from, with its modification time.
+    """
+    csv_path = os.path.join(kline_dir, code + ct.FILE_EXT['csv'])
+    if os.path.exists(csv_path):
+        return csv_path, os.path.getmtime(csv_path)
+    store_dir = Ks.store_dir_for(csv_path)
+    return store_dir, os.path.getmtime(os.path.join(store_dir, Ks.META_FILE))
+
+
+def _first_date(path):
+    if os.path.isdir(path):
+        return Ks.first_store_date(path)
+    first_date = Ks.first_csv_date(path)
+    return None if first_date is None else pd.Timestamp(first_date)
+
+
+def _read_index(save_path):
+    if not os.path.exists(save_path):
+        return pd.DataFrame(columns=_COLUMNS[1:], index=pd.Index([], name="code"))
+    return pd.read_csv(save_path, dtype={"code": "str"}, parse_dates=["first_date"], index_col="code")
+
+
+def load_listing_index(kline_dir=None, save_path=None):
+    """
+    load the saved index, reading the first dates of stocks new or changed
+    since it was saved, and save it again if anything changed.
+    Args:
+        kline_dir: <str>: default: cfg.kline_dir.
+        save_path: <str>: default: cfg.listing_index_path.
+    Returns:
+        <pandas.Series>: codes as index, first trading dates as values, NaT if no data.
+    """
+    kline_dir = cfg.kline_dir if kline_dir is None else kline_dir
+    save_path = cfg.listing_index_path if save_path is None else save_path
+    index = _read_index(save_path)
+
+    codes = _list_codes(kline_dir)
+    rows = dict()
+    changed = len(index) != len(codes) or not index.index.isin(codes).all()
+    for code in codes:
+        path, mtime = _source(code, kline_dir)
+        if code in index.index and index.at[code, "mtime"] == mtime:
+            rows[code] = (index.at[code, "first_date"], mtime)
+            continue
+        rows[code] = (_first_date(path), mtime)
+        changed = True
+
+    index = pd.DataFrame.from_dict(rows, orient="index", columns=_COLUMNS[1:])
+    index.index.name = "code"
+    index["first_date"] = pd.to_datetime(index["first_date"])
+    if changed:
+        save_dir = os.path.dirname(save_path)
+        if save_dir and not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        tmp_path = save_path + ".tmp"
+        index.to_csv(tmp_path, date_format="%Y-%m-%d")
+        os.replace(tmp_path, save_path)
+    return index["first_date"]
+
+
+# the listing dates, loaded by listing_dates().
+_listing = dict()
+
+
+def listing_dates(reload=False):
+    """
+    the listing dates of the process, loaded once.
+    Args:
+        reload: <bool>: whether to check the K lines for changes again.
+    Returns:
+        <pandas.Series>: see load_listing_index.
+    """
+    if reload or "master" not in _listing:
+        _listing["master"] = load_listing_index()
+    return _listing["master"]
+
+
+def listed_by(codes, year):
+    """
+    check whether stocks had been listed in a year.
+    Args:
+        codes: <list: str>
+        year: <int>
+    Returns:
+        <numpy.ndarray: bool>: False for stocks without K-line data.
+    """
+    first_dates = listing_dates().reindex(pd.Index(codes, dtype=object))
+    return np.asarray(first_dates.dt.year <= year)
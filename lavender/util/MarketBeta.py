@@ -0,0 +1,170 @@
+"""
+Beta coefficients and CAPM required returns of the whole market.
+
+Daily close prices of all the stocks, as a (days x codes) frame, are turned
+into monthly returns in one groupby, and the betas against a reference index
+are solved for all the stocks at once with the closed-form least squares
+    beta = (n * Sxy - Sx * Sy) / (n * Sxx - Sx ** 2)
+where the sums run over months both returns exist. Rolling betas use the
+same sums taken from cumulative sums along months.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+import lavender.config as cfg
+import lavender.constant as ct
+import lavender.util.DailyKLineIO as Dk
+from lavender.util.PanelStore import MarketPanel, _list_codes
+
+# monthly returns of reference indexes, by index code, with the file signature.
+_ref_returns = dict()
+
+
+def monthly_returns(closes):
+    """
+    monthly returns(ratios of close prices on the last trading days of adjacent months).
+    Months without trading give NaN, as well as the months after them.
+    Args:
+        closes: <pandas.DataFrame>: close prices, daily dates as index, codes as columns.
+    Returns:
+        <pandas.DataFrame>: month ends as index, codes as columns.
+    """
+    months = closes.index.to_period("M")
+    last_close = closes.groupby(months).last()
+    if len(last_close):
+        last_close = last_close.reindex(pd.period_range(last_close.index[0], last_close.index[-1], freq="M"))
+    last_close.index = last_close.index.to_timestamp(how="end").normalize()
+    return last_close / last_close.shift(1)
+
+
+def ref_monthly_returns(ref_index="000001"):
+    """
+    monthly returns of a reference index, read once until the index file changes.
+    Args:
+        ref_index: <str>: code of index in cfg.index_dir.
+    Returns:
+        <pandas.Series>
+    """
+    file_path = os.path.join(cfg.index_dir, ref_index + ct.FILE_EXT["csv"])
+    signature = os.stat(file_path).st_mtime if os.path.exists(file_path) else None
+    if ref_index not in _ref_returns or _ref_returns[ref_index][0] != signature:
+        ref_k_line = Dk.KLine(file_path, columns=["close"])
+        _ref_returns[ref_index] = (signature, monthly_returns(ref_k_line.stock_data[["close"]])["close"])
+    return _ref_returns[ref_index][1]
+
+
+def market_closes(codes=None, date_range=None):
+    """
+    daily close prices of stocks, from the market panel(see util/PanelStore.py) if
+    it has been built, otherwise from the K-line data of each stock.
+    Args:
+        codes: <list: str>: default: all the stocks.
+        date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD".
+    Returns:
+        <pandas.DataFrame>: dates as index, codes as columns.
+    """
+    if os.path.exists(cfg.market_panel_path):
+        return MarketPanel().sub_panel(codes, date_range=date_range, fields=["close"])["close"]
+    codes = _list_codes(cfg.kline_dir) if codes is None else codes
+    closes = pd.concat([Dk.KLine(code, columns=["close"], date_range=date_range).stock_data["close"]
+                        for code in codes], axis=1, keys=codes)
+    closes.columns.name = "code"
+    return closes
+
+
+def _aligned(month_returns, ref_returns, date_range=None):
+    """
+    returns of stocks(y) and of reference(x) on the same months, NaN set on both
+    where either is missing.
+    """
+    st_date, ed_date = ct.split_date_range(date_range) if date_range is not None else (None, None)
+    month_returns = month_returns.loc[st_date:ed_date]
+    y = month_returns.values.astype(float)
+    x = ref_returns.reindex(month_returns.index).values.astype(float)[:, None]
+    mask = ~np.isnan(y) & ~np.isnan(x)
+    return np.where(mask, x, np.nan), np.where(mask, y, np.nan), mask, month_returns
+
+
+def betas(month_returns, ref_returns, date_range=None):
+    """
+    beta coefficients of stocks from monthly returns, the same as the slope
+    of linear regression in KLine.beta.
+    Args:
+        month_returns: <pandas.DataFrame>: see monthly_returns.
+        ref_returns: <pandas.Series>: monthly returns of the reference index.
+        date_range: <str>: e.g. "2012:2016".
+    Returns:
+        <pandas.DataFrame>: codes as index, columns:
+            "beta": beta coefficient.
+            "market_return": yearly return of the reference index in the months used.
+            "n_months": number of months used.
+    """
+    x, y, mask, month_returns = _aligned(month_returns, ref_returns, date_range)
+    n = mask.sum(axis=0).astype(float)
+    sum_x, sum_y = np.nansum(x, axis=0), np.nansum(y, axis=0)
+    sum_xx, sum_xy = np.nansum(x * x, axis=0), np.nansum(x * y, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        beta = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x)
+        market_return = np.prod(np.where(mask, x, 1.0), axis=0) ** (12.0 / n) - 1
+    beta[n < 2] = np.nan
+    return pd.DataFrame({"beta": beta, "market_return": np.where(n > 0, market_return, np.nan),
+                         "n_months": n.astype(int)}, index=month_returns.columns)
+
+
+def rolling_betas(month_returns, ref_returns, window=36, min_periods=None):
+    """
+    beta coefficients of stocks in rolling windows of months.
+    Args:
+        month_returns: <pandas.DataFrame>: see monthly_returns.
+        ref_returns: <pandas.Series>: monthly returns of the reference index.
+        window: <int>: number of months in a window.
+        min_periods: <int>: least number of months with returns in a window. default: window.
+    Returns:
+        <pandas.DataFrame>: betas of the windows ending at each month, month ends as index,
+                            codes as columns.
+    """
+    min_periods = window if min_periods is None else min_periods
+    x, y, mask, month_returns = _aligned(month_returns, ref_returns)
+
+    def _window_sum(values):
+        cumulative = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(np.nan_to_num(values), axis=0)])
+        start = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+        return cumulative[1:] - cumulative[start]
+
+    n = _window_sum(mask.astype(float))
+    sum_x, sum_y = _window_sum(x), _window_sum(y)
+    sum_xx, sum_xy = _window_sum(x * x), _window_sum(x * y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        beta = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x)
+    beta[(n < max(min_periods, 2))] = np.nan
+    return pd.DataFrame(beta, index=month_returns.index, columns=month_returns.columns)
+
+
+def required_returns(codes=None, rf=0.04, date_range="2012:2016", ref_index="000001",
+                     market_return=None, closes=None):
+    """
+    required returns of stocks based on CAPM model: RR = Rf + beta * (Rm - Rf).
+    Args:
+        codes: <list: str>: default: all the stocks.
+        rf: <float>: risk-free rate of return.
+        date_range: <str>: months to compute betas.
+        ref_index: <str>: code of the reference index.
+        market_return: <float>: expected return of market.
+                        default: None(use return of past years as expected return)
+        closes: <pandas.DataFrame>: daily close prices, dates as index, codes as columns.
+                default: loaded by market_closes.
+    Returns:
+        <pandas.DataFrame>: codes as index, columns "beta", "market_return",
+                            "n_months" and "required_return".
+    """
+    closes = market_closes(codes) if closes is None else closes
+    result = betas(monthly_returns(closes), ref_monthly_returns(ref_index), date_range)
+    expected = result["market_return"] if market_return is None else market_return
+    result["required_return"] = rf + result["beta"] * (expected - rf)
+    return result
+
+
+if __name__ == "__main__":
+    print(required_returns(ref_index="000300", market_return=0.08).sort_values("required_return"))
@@ -0,0 +1,237 @@
+"""
+Whole-market panel of daily K lines.
+
+All the stocks are consolidated in one file holding a dense float64 array of
+shape (fields x trading days x codes), NaN on days a stock was not traded
+(suspended or not yet listed). Layout of the file:
+
+    magic (8 bytes) | header length (uint64) | json header | padding
+    | dates (int64, ns) | panel data (float64, C order)
+
+The file is opened with numpy.memmap, so a (days x codes) slice of a field is
+a contiguous block of memory instead of thousands of separate DataFrames.
+"""
+
+import os
+import json
+import struct
+import numpy as np
+import pandas as pd
+
+import lavender.config as cfg
+import lavender.constant as ct
+import lavender.util.KLineStore as Ks
+
+MAGIC = b"LVPANEL1"
+ALIGNMENT = 64
+PANEL_FIELDS = ["open", "high", "low", "close", "volume"]
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _list_codes(kline_dir):
+    """
+    codes having data in kline_dir, as csv files or columnar stores.
+    """
+    codes = set()
+    if os.path.exists(kline_dir):
+        codes.update(os.path.splitext(name)[0] for name in os.listdir(kline_dir)
+                     if name.endswith(ct.FILE_EXT['csv']))
+    bin_dir = kline_dir.rstrip(os.sep) + cfg.bin_dir_suffix
+    if os.path.exists(bin_dir):
+        codes.update(name for name in os.listdir(bin_dir)
+                     if os.path.exists(os.path.join(bin_dir, name, Ks.META_FILE)))
+    return sorted(codes)
+
+
+def read_pool_codes(pools):
+    """
+    read codes from pool files in cfg.pool_dir, duplicates dropped.
+    Args:
+        pools: <list: str>: list of pool names.
+    Returns:
+        <list: str>
+    """
+    codes = list()
+    for pool in pools:
+        data_path = os.path.join(cfg.pool_dir, pool)
+        pool_codes = pd.read_csv(data_path, header=None, names=["code", " "], sep=r"\s+",
+                                 dtype={"code": "str"}, index_col=False).code
+        codes.extend(code for code in pool_codes if code not in codes)
+    return codes
+
+
+def build_panel(codes=None, save_path=None, fields=None, kline_dir=None):
+    """
+    build the panel file from the K-line data of stocks.
+    Args:
+        codes: <list: str>: codes to include. default: all codes in kline_dir.
+        save_path: <str>: path of the panel file. default: cfg.market_panel_path.
+        fields: <list: str>: fields to include. default: PANEL_FIELDS.
+        kline_dir: <str>: directory of K-line csv files. default: cfg.kline_dir.
+    Returns:
+        <MarketPanel>
+    """
+    kline_dir = cfg.kline_dir if kline_dir is None else kline_dir
+    save_path = cfg.market_panel_path if save_path is None else save_path
+    fields = PANEL_FIELDS if fields is None else list(fields)
+    codes = _list_codes(kline_dir) if codes is None else list(codes)
+
+    klines = dict()
+    dates = np.array([], dtype=np.int64)
+    for code in codes:
+        file_path = os.path.join(kline_dir, code + ct.FILE_EXT['csv'])
+        try:
+            k_line = Ks.read_kline_file(file_path)
+        except IOError:
+            print(ct.DATA_MISSING_MESSAGE % (code, kline_dir))
+            continue
+        klines[code] = k_line
+        dates = np.union1d(dates, k_line.index.values.astype("datetime64[ns]").view(np.int64))
+    codes = [code for code in codes if code in klines]
+
+    header = json.dumps({"fields": fields, "codes": codes, "n_dates": len(dates)}).encode("utf8")
+    dates_offset = _align(len(MAGIC) + 8 + len(header))
+    data_offset = _align(dates_offset + dates.nbytes)
+    shape = (len(fields), len(dates), len(codes))
+
+    save_dir = os.path.dirname(save_path)
+    if save_dir and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    tmp_path = save_path + ".tmp"
+    with open(tmp_path, "wb") as fout:
+        fout.write(MAGIC)
+        fout.write(struct.pack("<Q", len(header)))
+        fout.write(header)
+        fout.seek(dates_offset)
+        fout.write(dates.astype("<i8").tobytes())
+        fout.truncate(data_offset + int(np.prod(shape)) * 8)
+
+    if all(shape):
+        panel = np.memmap(tmp_path, dtype="<f8", mode="r+", offset=data_offset, shape=shape)
+        panel[:] = np.nan
+        for icode, code in enumerate(codes):
+            k_line = klines[code]
+            rows = np.searchsorted(dates, k_line.index.values.astype("datetime64[ns]").view(np.int64))
+            for ifield, field in enumerate(fields):
+                if field in k_line:
+                    panel[ifield, rows, icode] = k_line[field].values
+        panel.flush()
+        del panel
+    os.replace(tmp_path, save_path)
+    return MarketPanel(save_path)
+
+
+class MarketPanel:
+    """
+    class of the memory-mapped whole-market panel.
+    Members:
+        fields: <list: str>: names of fields.
+        codes: <pandas.Index>: codes of stocks.
+        dates: <pandas.DatetimeIndex>: trading days of the whole market.
+        data: <numpy.memmap>: panel data, shape (fields x dates x codes).
+    """
+    def __init__(self, path=None):
+        self.path = cfg.market_panel_path if path is None else path
+        with open(self.path, "rb") as fin:
+            if fin.read(len(MAGIC)) != MAGIC:
+                raise IOError("%s is not a panel file!" % self.path)
+            header_len = struct.unpack("<Q", fin.read(8))[0]
+            header = json.loads(fin.read(header_len).decode("utf8"))
+        n_dates = header["n_dates"]
+        dates_offset = _align(len(MAGIC) + 8 + header_len)
+        data_offset = _align(dates_offset + n_dates * 8)
+
+        self.fields = header["fields"]
+        self.codes = pd.Index(header["codes"], name="code")
+        shape = (len(self.fields), n_dates, len(self.codes))
+        if all(shape):
+            dates = np.memmap(self.path, dtype="<i8", mode="r", offset=dates_offset, shape=(n_dates,))
+            self.data = np.memmap(self.path, dtype="<f8", mode="r", offset=data_offset, shape=shape)
+        else:
+            dates = np.empty(n_dates, dtype="<i8")
+            self.data = np.empty(shape)
+        self.dates = pd.DatetimeIndex(np.asarray(dates).view("datetime64[ns]"), name="date")
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _date_slice(self, date_range):
+        """
+        Args:
+            date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD", see ct.split_date_range.
+        Returns:
+            <slice>: positions of dates in range.
+        """
+        if date_range is None:
+            return slice(0, len(self.dates))
+        # same as slicing with .loc, so "2012:2017" includes the whole year of 2017.
+        st, ed = self.dates.slice_locs(*ct.split_date_range(date_range))
+        return slice(st, ed)
+
+    def _code_positions(self, codes):
+        """
+        positions of codes in the panel, -1 for codes not in panel.
+        """
+        if codes is None:
+            return None
+        positions = self.codes.get_indexer(pd.Index(codes))
+        for code in np.asarray(codes)[positions < 0]:
+            print(ct.DATA_MISSING_MESSAGE % (code, self.path))
+        return positions
+
+    def array(self, field, codes=None, date_range=None):
+        """
+        get a (dates x codes) array of a field, aligned with the codes given.
+        A view of the mapped file if codes is None.
+        Args:
+            field: <str>: one of self.fields.
+            codes: <list: str>: codes of stocks, NaN columns for codes not in panel.
+            date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD".
+        Returns:
+            <numpy.ndarray>
+        """
+        values = np.asarray(self.data[self.fields.index(field), self._date_slice(date_range)])
+        positions = self._code_positions(codes)
+        if positions is None:
+            return values
+        values = values[:, np.maximum(positions, 0)]
+        values[:, positions < 0] = np.nan
+        return values
+
+    def sub_panel(self, codes=None, date_range=None, fields=None):
+        """
+        get aligned data of selected codes, dates and fields.
+        Args:
+            codes: <list: str>: codes of stocks. default: all codes.
+            date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD". default: all dates.
+            fields: <list: str>: default: all fields.
+        Returns:
+            <dict>: key: <str>: field.
+                    value: <pandas.DataFrame>: dates as index, codes as columns.
+        """
+        fields = self.fields if fields is None else fields
+        dates = self.dates[self._date_slice(date_range)]
+        columns = self.codes if codes is None else pd.Index(codes, name="code")
+        return dict((field, pd.DataFrame(self.array(field, codes, date_range), index=dates,
+                                         columns=columns, copy=False))
+                    for field in fields)
+
+    def pool_panel(self, pools, date_range=None, fields=None):
+        """
+        get aligned data of the codes in pool files(see cfg.pool_dir).
+        Args:
+            pools: <list: str>: list of pool names.
+            date_range: <str>: "YYYY-MM-DD:YYYY-MM-DD".
+            fields: <list: str>
+        Returns:
+            <dict>: see sub_panel.
+        """
+        return self.sub_panel(read_pool_codes(pools), date_range=date_range, fields=fields)
+
+
+if __name__ == "__main__":
+    market_panel = build_panel()
+    print("panel of %d codes in %d days built." % (len(market_panel.codes), len(market_panel)))
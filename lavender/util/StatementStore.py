@@ -0,0 +1,449 @@
+"""
+Normalized database of financial statements.
+
+All the statements of all the stocks are kept in one SQLite file
+(cfg.statement_db_path) in long format, one row per value:
+
+    items(item_id, statement, name)                  dictionary of statement items.
+    statement_values(code, year, season, item_id, value)
+
+The primary key (code, year, season, item_id) serves reading the statements
+of a stock, and the index (item_id, year, season, code) serves reading an
+item of all the stocks in a period, e.g. every company's "营业收入" in 2018 S4.
+Missing values are not saved. A hash of the values of each period of a
+statement of a stock is kept in period_hashes(statement, code, year, season,
+hash), so upsert_rows() writes only the periods new or revised. migrate()
+copies the former databases of one table per stock("Statement_<type>.db")
+into it.
+"""
+
+import os
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+import lavender.config as cfg
+import lavender.constant as ct
+
+# columns of the former per-stock tables which are not items.
+_NON_ITEM_COLUMNS = ["index", "level_0", "year", "season"]
+# more values than this in a filter are put in a temporary table.
+_MAX_IN_VALUES = 500
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS items (
+        item_id INTEGER PRIMARY KEY,
+        statement TEXT NOT NULL,
+        name TEXT NOT NULL,
+        UNIQUE (statement, name))""",
+    """CREATE TABLE IF NOT EXISTS statement_values (
+        code TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        season INTEGER NOT NULL,
+        item_id INTEGER NOT NULL REFERENCES items(item_id),
+        value REAL NOT NULL,
+        PRIMARY KEY (code, year, season, item_id)) WITHOUT ROWID""",
+    """CREATE INDEX IF NOT EXISTS ix_values_item_period
+        ON statement_values (item_id, year, season, code)""",
+    """CREATE TABLE IF NOT EXISTS period_hashes (
+        statement TEXT NOT NULL,
+        code TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        season INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        PRIMARY KEY (statement, code, year, season)) WITHOUT ROWID""",
+]
+
+
+def statement_name(table_name):
+    """
+    statement type of a former database name, e.g. "Statement_CashFlow" -> "CashFlow".
+    """
+    return table_name[len("Statement_"):] if table_name.startswith("Statement_") else table_name
+
+
+def to_long(data):
+    """
+    split a statement in wide format into periods, items and values.
+    Args:
+        data: <pandas.DataFrame>: a row for each period with columns "year", "season"
+                                  and items, e.g. returned by basics._get_fin_statement.
+    Returns:
+        periods: <numpy.ndarray: int>: (n_values x 2) year and season of values.
+        names: <list: str>: item of each value.
+        values: <numpy.ndarray: float>: values, NaN and non-numeric ones dropped.
+    """
+    items = [column for column in data.columns if column not in _NON_ITEM_COLUMNS]
+    values = data[items].apply(pd.to_numeric, errors="coerce").values.astype(float)
+    years = data["year"].values.astype(int)
+    seasons = np.round(data["season"].values.astype(float)).astype(int)
+    rows, columns = np.nonzero(~np.isnan(values))
+    periods = np.column_stack([years[rows], seasons[rows]])
+    return periods, [items[column] for column in columns], values[rows, columns]
+
+
+def _hash_values(values):
+    """
+    Args:
+        values: <dict>: key: <str>: item. value: <float>.
+    Returns:
+        <str>: sha1 of the items and values, whatever their order.
+    """
+    return hashlib.sha1(repr(sorted(values.items())).encode("utf-8")).hexdigest()
+
+
+def period_hashes(data):
+    """
+    hash of the values of each period of a statement.
+    Args:
+        data: <pandas.DataFrame>: see to_long.
+    Returns:
+        <dict>: key: <tuple>: (year, season). value: <str>: hash, the same as
+                the one of the values saved from data.
+    """
+    periods, names, values = to_long(data)
+    period_values = dict((period, dict()) for period in zip(
+        data["year"].values.astype(int).tolist(),
+        np.round(data["season"].values.astype(float)).astype(int).tolist()))
+    # duplicated items or periods in data: the last value is kept, as write_rows does.
+    for (year, season), name, value in zip(periods.tolist(), names, values.tolist()):
+        period_values[(year, season)][name] = float(value)
+    return dict((period, _hash_values(values)) for period, values in period_values.items())
+
+
+class StatementStore:
+    """
+    database of financial statements in long format.
+    """
+    def __init__(self, db_path=None):
+        """
+        Args:
+            db_path: <str>: path of the database file. default: cfg.statement_db_path,
+                            read when the database is opened.
+        """
+        self._db_path = db_path
+        self._item_ids = dict()     # (statement, name): item_id, items known so far.
+        self._lock = threading.Lock()
+
+    @property
+    def db_path(self):
+        return cfg.statement_db_path if self._db_path is None else self._db_path
+
+    def connect(self):
+        """
+        open the database, creating the tables if needed.
+        Returns:
+            <sqlite3.Connection>
+        """
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for sql in _SCHEMA:
+            conn.execute(sql)
+        return conn
+
+    def item_ids(self, conn, statement, names, create=False):
+        """
+        Args:
+            conn: <sqlite3.Connection>
+            statement: <str>: e.g. "BalanceSheet".
+            names: <list: str>: item names.
+            create: <bool>: whether to add items not in the dictionary.
+        Returns:
+            <dict>: key: <str>: name. value: <int>: item_id, only for items in the dictionary.
+        """
+        with self._lock:
+            # new items get ids in the order given, i.e. the order in the statement.
+            missing = [name for name in dict.fromkeys(names) if (statement, name) not in self._item_ids]
+            if missing:
+                if create:
+                    conn.executemany("INSERT OR IGNORE INTO items (statement, name) VALUES (?, ?)",
+                                     [(statement, name) for name in missing])
+                for item_id, name in conn.execute("SELECT item_id, name FROM items WHERE statement = ?",
+                                                  (statement,)):
+                    self._item_ids[(statement, name)] = item_id
+            return dict((name, self._item_ids[(statement, name)]) for name in names
+                        if (statement, name) in self._item_ids)
+
+    def write_rows(self, conn, statement, code, data):
+        """
+        save a statement of a stock in an open transaction, replacing the values
+        of the periods in data.
+        Args:
+            conn: <sqlite3.Connection>
+            statement: <str>: e.g. "BalanceSheet".
+            code: <str>
+            data: <pandas.DataFrame>: see to_long.
+        Returns:
+            <int>: number of values saved.
+        """
+        if len(data) == 0:
+            return 0
+        hashes = period_hashes(data)
+        periods, names, values = to_long(data)
+        item_ids = self.item_ids(conn, statement, [column for column in data.columns
+                                                   if column not in _NON_ITEM_COLUMNS and column in names],
+                                 create=True)
+        all_periods = set(zip(data["year"].values.astype(int),
+                              np.round(data["season"].values.astype(float)).astype(int)))
+        conn.executemany("DELETE FROM statement_values WHERE code = ? AND year = ? AND season = ? AND "
+                         "item_id IN (SELECT item_id FROM items WHERE statement = ?)",
+                         [(code, int(year), int(season), statement) for year, season in sorted(all_periods)])
+        # duplicated items or periods in data: the last value is kept.
+        conn.executemany("INSERT OR REPLACE INTO statement_values (code, year, season, item_id, value) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         [(code, int(year), int(season), item_ids[name], float(value))
+                          for (year, season), name, value in zip(periods, names, values)])
+        conn.executemany("INSERT OR REPLACE INTO period_hashes (statement, code, year, season, hash) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         [(statement, code, year, season, period_hash)
+                          for (year, season), period_hash in sorted(hashes.items())])
+        return len(values)
+
+    def _stored_hashes(self, conn, statement, code):
+        """
+        hashes of the periods of a statement of a stock in the database. Periods
+        saved before hashes were kept are hashed from their values.
+        Returns:
+            <dict>: key: <tuple>: (year, season). value: <str>: hash.
+        """
+        hashes = dict(((year, season), period_hash) for year, season, period_hash in conn.execute(
+            "SELECT year, season, hash FROM period_hashes WHERE statement = ? AND code = ?",
+            (statement, code)))
+        period_values = dict()
+        for year, season, name, value in conn.execute(
+                "SELECT v.year, v.season, i.name, v.value FROM statement_values v "
+                "JOIN items i ON i.item_id = v.item_id WHERE v.code = ? AND i.statement = ?",
+                (code, statement)):
+            if (year, season) not in hashes:
+                period_values.setdefault((year, season), dict())[name] = value
+        hashes.update((period, _hash_values(values)) for period, values in period_values.items())
+        return hashes
+
+    def upsert_rows(self, conn, statement, code, data):
+        """
+        save the periods of a statement of a stock which are new or revised
+        in an open transaction, leaving the periods unchanged alone.
+        Args:
+            conn: <sqlite3.Connection>
+            statement: <str>: e.g. "BalanceSheet".
+            code: <str>
+            data: <pandas.DataFrame>: see to_long.
+        Returns:
+            <dict>: key: "inserted", "revised", "unchanged". value: <int>: number of periods.
+        """
+        counts = {"inserted": 0, "revised": 0, "unchanged": 0}
+        if len(data) == 0:
+            return counts
+        stored = self._stored_hashes(conn, statement, code)
+        changed = set()
+        unchanged = list()
+        for period, period_hash in period_hashes(data).items():
+            if period not in stored:
+                counts["inserted"] += 1
+            elif stored[period] != period_hash:
+                counts["revised"] += 1
+            else:
+                counts["unchanged"] += 1
+                unchanged.append((statement, code, period[0], period[1], period_hash))
+                continue
+            changed.add(period)
+        # hashes of periods saved before hashes were kept.
+        conn.executemany("INSERT OR IGNORE INTO period_hashes (statement, code, year, season, hash) "
+                         "VALUES (?, ?, ?, ?, ?)", unchanged)
+        rows = [(int(year), int(round(float(season)))) in changed
+                for year, season in zip(data["year"].values, data["season"].values)]
+        self.write_rows(conn, statement, code, data[rows])
+        return counts
+
+    def write(self, statement, code, data):
+        """
+        save a statement of a stock in one transaction, replacing the values of
+        the periods in data.
+        Args:
+            statement: <str>: e.g. "BalanceSheet".
+            code: <str>
+            data: <pandas.DataFrame>: see to_long.
+        Returns:
+            <int>: number of values saved.
+        """
+        conn = self.connect()
+        try:
+            with conn:
+                return self.write_rows(conn, statement, code, data)
+        except Exception:
+            self.forget_items()
+            raise
+        finally:
+            conn.close()
+
+    def forget_items(self):
+        """
+        drop the items known, after a transaction which may have added some is rolled back.
+        """
+        with self._lock:
+            self._item_ids = dict()
+
+    def codes(self, statement):
+        """
+        codes having values of a statement.
+        """
+        conn = self.connect()
+        try:
+            return [code for code, in conn.execute(
+                "SELECT DISTINCT code FROM statement_values WHERE item_id IN "
+                "(SELECT item_id FROM items WHERE statement = ?) ORDER BY code", (statement,))]
+        finally:
+            conn.close()
+
+    def last_years(self, statement):
+        """
+        the last year of a statement of every stock.
+        Returns:
+            <dict>: key: <str>: code. value: <int>: year.
+        """
+        conn = self.connect()
+        try:
+            return dict(conn.execute(
+                "SELECT code, MAX(year) FROM statement_values WHERE item_id IN "
+                "(SELECT item_id FROM items WHERE statement = ?) GROUP BY code", (statement,)))
+        finally:
+            conn.close()
+
+    def last_periods(self, statement):
+        """
+        the last period of a statement of every stock.
+        Returns:
+            <dict>: key: <str>: code. value: <tuple>: (year, season).
+        """
+        conn = self.connect()
+        try:
+            return dict((code, divmod(period, 10)) for code, period in conn.execute(
+                "SELECT code, MAX(year * 10 + season) FROM statement_values WHERE item_id IN "
+                "(SELECT item_id FROM items WHERE statement = ?) GROUP BY code", (statement,)))
+        finally:
+            conn.close()
+
+    def items(self, statement):
+        """
+        names of the items of a statement, in the order they were first saved.
+        """
+        conn = self.connect()
+        try:
+            return self._all_items(conn, statement)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _in_filter(conn, column, values, name):
+        """
+        sql condition of column in values, with its parameters.
+        Long lists of values are put in a temporary table instead of parameters.
+        """
+        values = list(values)
+        if len(values) <= _MAX_IN_VALUES:
+            return "%s IN (%s)" % (column, ", ".join("?" * len(values))), values
+        conn.execute("DROP TABLE IF EXISTS temp.%s" % name)
+        conn.execute("CREATE TEMP TABLE %s (value PRIMARY KEY)" % name)
+        conn.executemany("INSERT OR IGNORE INTO temp.%s VALUES (?)" % name, [(value,) for value in values])
+        return "%s IN (SELECT value FROM temp.%s)" % (column, name), []
+
+    def query(self, statement, codes=None, items=None, years=None, seasons=None):
+        """
+        read items of a statement in wide format.
+        Args:
+            statement: <str>: e.g. "ProfitStatement".
+            codes: <list: str>: default: all the stocks.
+            items: <list: str>: default: all the items.
+            years: <list: int>: default: all the years.
+            seasons: <list: int>: default: all the seasons.
+        Returns:
+            <pandas.DataFrame>: (code, year, season) as index, items as columns,
+                                in the order of items given or of the dictionary.
+                                Items without any value are left out.
+        """
+        conn = self.connect()
+        try:
+            if items is None:
+                item_ids = self.item_ids(conn, statement, self._all_items(conn, statement))
+            else:
+                item_ids = self.item_ids(conn, statement, list(items))
+            columns = [name for name in (items if items is not None else item_ids) if name in item_ids]
+
+            conditions, params = list(), list()
+            for column, values, name in [("item_id", [item_ids[name] for name in columns], "sel_items"),
+                                         ("code", codes, "sel_codes"), ("year", years, "sel_years"),
+                                         ("season", seasons, "sel_seasons")]:
+                if values is None and column != "item_id":
+                    continue
+                condition, values = self._in_filter(conn, column, [str(value) if column == "code"
+                                                                   else int(value) for value in values], name)
+                conditions.append(condition)
+                params += values
+            data = pd.read_sql_query("SELECT code, year, season, item_id, value FROM statement_values WHERE "
+                                     + " AND ".join(conditions), conn, params=params)
+        finally:
+            conn.close()
+
+        names = dict((item_id, name) for name, item_id in item_ids.items())
+        data["item"] = data.item_id.map(names)
+        wide = data.set_index(["code", "year", "season", "item"])["value"].unstack("item")
+        wide = wide.reindex(columns=[name for name in columns if name in wide.columns]).sort_index()
+        wide.columns.name = None
+        return wide
+
+    def _all_items(self, conn, statement):
+        return [name for name, in conn.execute(
+            "SELECT name FROM items WHERE statement = ? ORDER BY item_id", (statement,))]
+
+    def migrate(self, table_dir=None, statements=ct.FIN_STATE_NAME):
+        """
+        copy the former databases of one table per stock("<table_dir>/Statement_<type>.db")
+        into the store. Periods already in the store are replaced, so it can run again.
+        Args:
+            table_dir: <str>: default: cfg.table_dir.
+            statements: <list: str>: statement types.
+        Returns:
+            <dict>: key: <str>: statement. value: <int>: number of values copied.
+        """
+        table_dir = cfg.table_dir if table_dir is None else table_dir
+        counts = dict()
+        conn = self.connect()
+        try:
+            for statement in statements:
+                old_path = os.path.join(table_dir, "Statement_%s.db" % statement)
+                if not os.path.exists(old_path):
+                    print(ct.DATA_MISSING_MESSAGE % (statement, old_path))
+                    continue
+                old_conn = sqlite3.connect(old_path)
+                counts[statement] = 0
+                try:
+                    codes = [name for name, in old_conn.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+                    with conn:
+                        for code in codes:
+                            data = pd.read_sql_query("SELECT * FROM '%s'" % code, old_conn)
+                            counts[statement] += self.write_rows(conn, statement, code, data)
+                            ct.write_console()
+                except Exception:
+                    self.forget_items()
+                    raise
+                finally:
+                    old_conn.close()
+                print("%s: %d values of %d stocks migrated." % (statement, counts[statement], len(codes)))
+        finally:
+            conn.close()
+        return counts
+
+
+# the process-wide statement store.
+statement_store = StatementStore()
+
+
+if __name__ == "__main__":
+    statement_store.migrate()
@@ -0,0 +1,159 @@
+"""
+Master trading calendar of the exchange.
+
+The calendar is the union of the dates of all the index K lines in
+cfg.index_dir, saved as int64 nanoseconds in cfg.calendar_path and rebuilt
+when any index file is newer. A K line maps calendar positions to its own
+rows(see KLine.calendar_rows), -1 on days the stock was not traded, so
+back tests look up dates by integer array access.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+import lavender.config as cfg
+import lavender.constant as ct
+import lavender.util.KLineStore as Ks
+from lavender.util.PanelStore import _list_codes
+
+
+def _index_files(index_dir):
+    return [os.path.join(index_dir, code + ct.FILE_EXT['csv']) for code in _list_codes(index_dir)]
+
+
+def _latest_mtime(index_dir):
+    mtimes = list()
+    for file_path in _index_files(index_dir):
+        for path in [file_path, os.path.join(Ks.store_dir_for(file_path), Ks.META_FILE)]:
+            if os.path.exists(path):
+                mtimes.append(os.path.getmtime(path))
+    return max(mtimes) if mtimes else 0.0
+
+
+def build_calendar(index_dir=None, save_path=None):
+    """
+    build the calendar from the dates of index K lines and save it.
+    Args:
+        index_dir: <str>: default: cfg.index_dir.
+        save_path: <str>: default: cfg.calendar_path.
+    Returns:
+        <TradeCalendar>
+    """
+    index_dir = cfg.index_dir if index_dir is None else index_dir
+    save_path = cfg.calendar_path if save_path is None else save_path
+    dates = [Ks.read_kline_file(file_path, columns=[]).index.values.astype("datetime64[ns]").view(np.int64)
+             for file_path in _index_files(index_dir)]
+    dates = np.unique(np.concatenate(dates)) if dates else np.empty(0, dtype=np.int64)
+
+    save_dir = os.path.dirname(save_path)
+    if save_dir and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    tmp_path = save_path + ".tmp"
+    with open(tmp_path, "wb") as fout:
+        np.save(fout, dates)
+    os.replace(tmp_path, save_path)
+    return TradeCalendar(dates)
+
+
+def load_calendar(index_dir=None, save_path=None):
+    """
+    load the saved calendar, rebuilding it if missing or older than index files.
+    Returns:
+        <TradeCalendar>
+    """
+    index_dir = cfg.index_dir if index_dir is None else index_dir
+    save_path = cfg.calendar_path if save_path is None else save_path
+    if not os.path.exists(save_path) or os.path.getmtime(save_path) < _latest_mtime(index_dir):
+        return build_calendar(index_dir, save_path)
+    return TradeCalendar(np.load(save_path))
+
+
+class TradeCalendar:
+    """
+    class of trading days.
+    Members:
+        dates: <pandas.DatetimeIndex>: sorted trading days.
+    """
+    def __init__(self, dates):
+        """
+        Args:
+            dates: <array like>: sorted unique dates, or int64 nanoseconds.
+        """
+        dates = np.asarray(dates)
+        if dates.dtype == np.int64:
+            dates = dates.view("datetime64[ns]")
+        self.dates = pd.DatetimeIndex(dates, name="date")
+        self._values = self.dates.values.astype("datetime64[ns]").view(np.int64)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def positions(self, dates):
+        """
+        Args:
+            dates: <array like>: dates.
+        Returns:
+            <numpy.ndarray: int>: positions of dates in the calendar, -1 for dates not in it.
+        """
+        values = pd.DatetimeIndex(dates).values.astype("datetime64[ns]").view(np.int64)
+        positions = np.searchsorted(self._values, values)
+        inside = positions < len(self._values)
+        found = np.zeros(len(values), dtype=bool)
+        found[inside] = self._values[positions[inside]] == values[inside]
+        return np.where(found, positions, -1)
+
+    def position(self, date):
+        """
+        position of a date in the calendar, -1 if not a trading day.
+        """
+        value = pd.Timestamp(date).value
+        position = int(np.searchsorted(self._values, value))
+        if position < len(self._values) and self._values[position] == value:
+            return position
+        return -1
+
+    def union(self, dates_list):
+        """
+        calendar extended by dates not in it, e.g. of stocks traded after the index data ends.
+        Args:
+            dates_list: <list: pandas.DatetimeIndex>
+        Returns:
+            <TradeCalendar>: self if no date is missing.
+        """
+        missing = [dates[self.positions(dates) < 0] for dates in dates_list]
+        missing = [dates for dates in missing if len(dates)]
+        if not missing:
+            return self
+        values = [self._values] + [dates.values.astype("datetime64[ns]").view(np.int64) for dates in missing]
+        return TradeCalendar(np.unique(np.concatenate(values)))
+
+    def rows(self, dates):
+        """
+        map calendar positions to rows of data having the dates.
+        Args:
+            dates: <pandas.DatetimeIndex>: sorted dates of data, e.g. KLine.date.
+        Returns:
+            <numpy.ndarray: int>: shape (len(calendar)), row of each calendar day in the
+                                  data, -1 on days not in dates.
+        """
+        rows = np.full(len(self._values), -1, dtype=np.int64)
+        positions = self.positions(dates)
+        found = positions >= 0
+        rows[positions[found]] = np.flatnonzero(found)
+        return rows
+
+
+# the master calendar, loaded by trade_calendar().
+_calendar = dict()
+
+
+def trade_calendar():
+    """
+    the master calendar of the process, loaded once.
+    Returns:
+        <TradeCalendar>
+    """
+    if "master" not in _calendar:
+        _calendar["master"] = load_calendar()
+    return _calendar["master"]
@@ -0,0 +1,70 @@
+"""
+Equivalence of BackTest.trade_open_vectorized, with the array versions of
+strategies("<strategy>_signals"), and the day-by-day loop of BackTest.trade_open.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lavender.strategy.backtest import BackTest
+from lavender.util.DailyKLineIO import KLine
+
+STRATEGIES = [
+    ("holding_strategy", {}),
+    ("dual_ma_strategy", {"ma_fast": 5, "ma_slow": 20}),
+    ("bollinger_breakout_strategy", {"bl_days": 20, "scale": 1.0}),
+    ("extremum_contrary_strategy", {}),
+]
+
+
+def synthetic_kline(seed, n_days=600):
+    """
+    daily open, high, low and close prices swinging around a random walk, rounded to cents,
+    so that there are both trends and pivots close to each other.
+    """
+    rng = np.random.default_rng(seed)
+    trend = np.cumsum(rng.normal(0, 0.01, n_days))
+    swing = 0.1 * np.sin(2 * np.pi * np.arange(n_days) / rng.uniform(40, 80))
+    close = np.round(10 * np.exp(trend + swing + rng.normal(0, 0.01, n_days)), 2)
+    open_price = np.round(close * np.exp(rng.normal(0, 0.01, n_days)), 2)
+    high = np.maximum(open_price, close) + np.round(np.abs(rng.normal(0, 0.05, n_days)), 2)
+    low = np.minimum(open_price, close) - np.round(np.abs(rng.normal(0, 0.05, n_days)), 2)
+    dates = pd.bdate_range("2010-01-04", periods=n_days, name="date")
+    return pd.DataFrame({"open": open_price, "high": high, "low": low, "close": close}, index=dates)
+
+
+def back_test(data):
+    return BackTest("000000", k_line=KLine.from_frame("000000", data.copy()))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("strategy, kwargs", STRATEGIES)
+def test_trade_open_vectorized_equals_loop(seed, strategy, kwargs):
+    data = synthetic_kline(seed)
+    loop = back_test(data)
+    loop_result = loop.trade_open(strategy, show_value=False, **kwargs)
+    vectorized = back_test(data)
+    vectorized_result = vectorized.trade_open_vectorized(strategy, show_value=False, **kwargs)
+
+    assert vectorized.hold_list == loop.hold_list
+    pd.testing.assert_index_equal(vectorized_result.index, loop_result.index)
+    for column in ["net_value", "daily_return"]:
+        np.testing.assert_allclose(vectorized_result[column].values, loop_result[column].values,
+                                   rtol=1e-12, atol=1e-15)
+    assert vectorized.net_value == pytest.approx(loop.net_value, rel=1e-12)
+
+
+@pytest.mark.parametrize("strategy, kwargs", STRATEGIES)
+def test_strategies_trade(strategy, kwargs):
+    """
+    the synthetic prices give the strategies trades to compare.
+    """
+    test = back_test(synthetic_kline(0))
+    test.trade_open_vectorized(strategy, show_value=False, **kwargs)
+    assert 0 < sum(test.hold_list) < test.ndays
+
+
+def test_trade_open_vectorized_shows_net_value():
+    test = back_test(synthetic_kline(0))
+    assert "holding_strategy Net Value" in test.trade_open_vectorized("holding_strategy")
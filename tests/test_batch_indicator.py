@@ -0,0 +1,86 @@
+"""
+Batch indicators of BatchIndicator against KLine.ma/std_dev/atr of each stock:
+the cumulative-sum cubes within the documented round-off, and the values
+IndicatorCube.attach puts into stock_data exactly.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lavender.util.BatchIndicator import batch_ma, batch_std, batch_atr, price_frames
+from lavender.util.DailyKLineIO import KLine
+
+WINDOWS = [2, 5, 20, 60]
+N_CODES = 20
+# round-off of the cumulative sums relative to the price level, see the module docstring of BatchIndicator.
+TOLERANCE = {"ma": 1e-12, "std": 1e-6, "atr": 1e-12}
+
+
+def synthetic_klines(seed, n_days=1500):
+    """
+    K lines of stocks listed on different days, with suspended days dropped.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2005-01-04", periods=n_days, name="date")
+    k_lines = dict()
+    for icode in range(N_CODES):
+        close = np.round(rng.uniform(2, 200) * np.exp(np.cumsum(rng.normal(0, 0.02, n_days))), 2)
+        high = close + np.round(np.abs(rng.normal(0, 0.02, n_days)) * close, 2)
+        low = close - np.round(np.abs(rng.normal(0, 0.02, n_days)) * close, 2)
+        traded = np.ones(n_days, dtype=bool)
+        traded[:rng.integers(0, 300)] = False
+        for start in rng.integers(0, n_days - 30, 4):
+            traded[start:start + rng.integers(1, 30)] = False
+        data = pd.DataFrame({"high": high, "low": low, "close": close}, index=dates)[traded]
+        code = "%06d" % icode
+        k_lines[code] = KLine.from_frame(code, data)
+    return k_lines
+
+
+def kline_values(k_line, name, window):
+    k_line = KLine.from_frame(k_line.code, k_line._stock_whole_data[["high", "low", "close"]].copy())
+    return getattr(k_line, {"ma": "ma", "std": "std_dev", "atr": "atr"}[name])(window).values
+
+
+def cube_of(name, k_lines):
+    frames = price_frames(k_lines, fields=("high", "low", "close"))
+    if name == "atr":
+        return batch_atr(frames["high"], frames["low"], frames["close"], WINDOWS)
+    return {"ma": batch_ma, "std": batch_std}[name](frames["close"], WINDOWS)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("name", ["ma", "std", "atr"])
+def test_cube_close_to_kline(seed, name):
+    k_lines = synthetic_klines(seed)
+    cube = cube_of(name, k_lines)
+    for window in WINDOWS:
+        frame = cube[window]
+        for code, k_line in k_lines.items():
+            expected = kline_values(k_line, name, window)
+            values = frame[code].reindex(k_line.date).values
+            price_level = k_line.stock_data["close"].max()
+            assert np.array_equal(np.isnan(values), np.isnan(expected))
+            np.testing.assert_allclose(values, expected, rtol=0, atol=TOLERANCE[name] * price_level)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("name", ["ma", "std", "atr"])
+def test_attach_equals_kline(seed, name):
+    k_lines = synthetic_klines(seed)
+    cube = cube_of(name, k_lines)
+    cube.attach(k_lines)
+    for window in WINDOWS:
+        for code, k_line in k_lines.items():
+            assert np.array_equal(k_line.stock_data[cube.key(window)].values, kline_values(k_line, name, window),
+                                  equal_nan=True)
+
+
+def test_attached_values_not_computed_again(monkeypatch):
+    k_lines = synthetic_klines(0)
+    cube = cube_of("ma", k_lines)
+    cube.attach(k_lines)
+    monkeypatch.setattr(KLine, "_whole_indicator", lambda *args: pytest.fail("computed again"))
+    for window in WINDOWS:
+        assert k_lines["000000"].ma(window).name == "MA%d" % window
@@ -0,0 +1,136 @@
+"""
+Equivalence of the array draw down measures of backtest(draw_downs,
+draw_down_durations, performance_metrics) with the former loops of
+PerformanceMeasure.max_draw_down and max_draw_down_duration, kept here as
+references, on single curves and on (days x curves) arrays.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lavender.constant as ct
+from lavender.strategy.backtest import PerformanceMeasure, draw_downs, draw_down_durations, performance_metrics
+
+N_CURVES = 2000
+
+
+def loop_draw_down(net_value):
+    """
+    the former PerformanceMeasure.max_draw_down, with day indices instead of dates(-1 for None).
+    """
+    draw_down_max = 0
+    high_value = 0
+    st_max, ed_max, st_index = -1, -1, -1
+    for iday, value in enumerate(net_value):
+        if value > high_value:
+            high_value = value
+            st_index = iday
+        else:
+            draw_down = 1 - value / high_value
+            if draw_down_max < draw_down:
+                draw_down_max = draw_down
+                st_max, ed_max = st_index, iday
+    return draw_down_max, st_max, ed_max
+
+
+def loop_draw_down_duration(net_value):
+    """
+    the former PerformanceMeasure.max_draw_down_duration, with day indices instead of dates.
+    """
+    duration = 0
+    duration_max = 0
+    high_value = 0
+    st_max, ed_max, st_index = -1, -1, -1
+    for iday, value in enumerate(net_value):
+        if value >= high_value:
+            duration = 0
+            high_value = value
+            st_index = iday
+        else:
+            duration += 1
+            if duration > duration_max:
+                duration_max = duration
+                st_max, ed_max = st_index, iday
+    return duration_max, st_max, ed_max
+
+
+def synthetic_curves(seed, n_days=300, n_curves=N_CURVES):
+    """
+    (days x curves) net values with flat stretches(days without holding) and equal highs.
+    """
+    rng = np.random.default_rng(seed)
+    daily_return = np.round(rng.normal(0.0005, 0.02, (n_days, n_curves)), 3)
+    daily_return[rng.uniform(size=(n_days, n_curves)) < 0.3] = 0.0
+    net_value = np.cumprod(1 + daily_return, axis=0)
+    # curves that never rise, or fall back to exactly their former highs.
+    net_value[:, 0] = np.linspace(1.0, 0.5, n_days)
+    net_value[:, 1] = 1.0
+    net_value[:, 2] = np.tile([1.0, 0.9, 1.0, 1.1], n_days // 4 + 1)[:n_days]
+    return net_value
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_draw_downs_equal_loop(seed):
+    net_value = synthetic_curves(seed)
+    draw_down_max, st_index, ed_index = draw_downs(net_value)
+    for icurve in range(net_value.shape[1]):
+        expected = loop_draw_down(net_value[:, icurve])
+        assert draw_down_max[icurve] == expected[0]
+        assert (st_index[icurve], ed_index[icurve]) == expected[1:]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_draw_down_durations_equal_loop(seed):
+    net_value = synthetic_curves(seed)
+    duration_max, st_index, ed_index = draw_down_durations(net_value)
+    for icurve in range(net_value.shape[1]):
+        assert (duration_max[icurve], st_index[icurve], ed_index[icurve]) == \
+            loop_draw_down_duration(net_value[:, icurve])
+
+
+def test_single_curve_equals_column():
+    net_value = synthetic_curves(0, n_curves=20)
+    for measure in [draw_downs, draw_down_durations]:
+        columns = measure(net_value)
+        for icurve in range(net_value.shape[1]):
+            single = measure(net_value[:, icurve])
+            assert [value[()] for value in single] == [value[icurve] for value in columns]
+
+
+@pytest.mark.parametrize("n_days", [0, 1])
+def test_short_curves(n_days):
+    net_value = np.ones((n_days, 3))
+    assert [value.tolist() for value in draw_downs(net_value)] == [[0.0] * 3, [-1] * 3, [-1] * 3]
+    assert [value.tolist() for value in draw_down_durations(net_value)] == [[0] * 3, [-1] * 3, [-1] * 3]
+
+
+def test_performance_measure_dates():
+    net_value = synthetic_curves(1, n_curves=50)
+    dates = pd.bdate_range("2010-01-04", periods=len(net_value))
+    for icurve in range(net_value.shape[1]):
+        measure = PerformanceMeasure(dates)
+        measure.result = pd.DataFrame({"net_value": net_value[:, icurve]}, index=dates)
+        for method, loop in [(measure.max_draw_down, loop_draw_down),
+                             (measure.max_draw_down_duration, loop_draw_down_duration)]:
+            value, st_index, ed_index = loop(net_value[:, icurve])
+            assert method() == (value, dates[st_index] if st_index >= 0 else None,
+                                dates[ed_index] if ed_index >= 0 else None)
+
+
+def test_performance_metrics_columns():
+    net_value = synthetic_curves(2, n_curves=50)
+    years = 1.2
+    metrics = performance_metrics(net_value, years, window=20)
+    for icurve in range(net_value.shape[1]):
+        single = performance_metrics(net_value[:, icurve], years, window=20)
+        for key, value in single.items():
+            np.testing.assert_allclose(metrics[key][..., icurve], value, rtol=1e-12, equal_nan=True)
+        assert single["max_draw_down"] == loop_draw_down(net_value[:, icurve])[0]
+        assert single["max_draw_down_duration"] == loop_draw_down_duration(net_value[:, icurve])[0]
+        # the former PerformanceMeasure.sharp_ratio.
+        daily_return = net_value[:, icurve] / np.concatenate([[1.0], net_value[:-1, icurve]]) - 1
+        cagr = net_value[-1, icurve] ** (1.0 / years) - 1
+        with np.errstate(divide="ignore"):
+            sharp_ratio = (cagr - ct.REF_RETURN) / (np.std(daily_return) * np.sqrt(ct.TRADE_DAYS))
+        assert single["sharp_ratio"] == pytest.approx(sharp_ratio, rel=1e-12)
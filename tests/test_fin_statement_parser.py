@@ -0,0 +1,74 @@
+"""
+parse_fin_statement(lxml XPath) against the former parse_fin_statement_soup
+(BeautifulSoup and pandas.read_html), on the sample pages in cfg.sample_page_dir
+and on small tables of the cases the parsers handle.
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+import lavender.config as cfg
+from lavender.DataCollecting.fin_statement_parser import PAGE_EXT, benchmark, parse_fin_statement, \
+    parse_fin_statement_soup
+
+pytest.importorskip("bs4")
+pytest.importorskip("html5lib")
+
+SAMPLE_PAGES = sorted(name for name in os.listdir(cfg.sample_page_dir) if name.endswith(PAGE_EXT))
+
+TABLES = {
+    "spans": """<tr><td>报表日期</td><td>2016-12-31</td><td>2016-06-30</td></tr>
+                <tr><td colspan="3"><strong>流动资产</strong></td></tr>
+                <tr><td rowspan="2">营业收入</td><td>1,000.50</td><td>--</td></tr>
+                <tr><td>20</td><td>30</td></tr>
+                <tr><td>净利润</td><td>5</td></tr>""",
+    "hidden": """<tr><td>报表日期</td><td>2016-12-31</td></tr>
+                 <tr><td>货币资金<span style="display: none">x</span></td><td>1,024.00</td></tr>
+                 <tr><td>其他综合收益<br/>(税后净额)</td><td>  3.5  </td></tr>""",
+}
+
+
+def read_page(file_name):
+    with open(os.path.join(cfg.sample_page_dir, file_name), encoding="utf-8") as fin:
+        return fin.read()
+
+
+def assert_same_statement(markup):
+    lxml_df = parse_fin_statement(markup)
+    soup_df = parse_fin_statement_soup(markup)
+    pd.testing.assert_frame_equal(lxml_df, soup_df)
+    assert lxml_df.columns.equals(soup_df.columns)
+    return lxml_df
+
+
+def test_sample_pages_saved():
+    assert len(SAMPLE_PAGES) >= 3
+
+
+@pytest.mark.parametrize("file_name", SAMPLE_PAGES)
+def test_sample_page_equals_soup(file_name):
+    statement = assert_same_statement(read_page(file_name))
+    assert len(statement) > 0
+    assert list(statement.index) == sorted(statement.index)
+
+
+@pytest.mark.parametrize("tbody", [True, False])
+@pytest.mark.parametrize("case", sorted(TABLES))
+def test_table_equals_soup(case, tbody):
+    rows = TABLES[case]
+    if tbody:
+        rows = "<tbody>%s</tbody>" % rows
+    assert_same_statement('<html><body><table id="BalanceSheetNewTable0">%s</table></body></html>' % rows)
+
+
+def test_missing_table():
+    with pytest.raises(ValueError):
+        parse_fin_statement("<html><body><table id='other'><tr><td>1</td></tr></table></body></html>")
+
+
+def test_benchmark_on_sample_pages(capsys):
+    result = benchmark(repeat=1)
+    assert list(result.index) == [os.path.splitext(name)[0] for name in SAMPLE_PAGES]
+    assert result.identical.all()
@@ -0,0 +1,75 @@
+"""
+Indicators extended by IncrementalIndicator.extend against the same indicators
+recomputed on the whole data, on random K lines cut at random days, and
+extend_code against the entries a full recompute would put into the cache.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lavender.util.IncrementalIndicator as Ii
+from lavender.util.IndicatorCache import Fingerprint, IndicatorCache
+
+N_CASES = 200
+KEYS = ["MA%d", "STD%d", "TR", "ATR%d", "support%d", "resistance%d"]
+
+
+def synthetic_data(rng, n_days):
+    close = np.round(rng.uniform(2, 100) * np.exp(np.cumsum(rng.normal(0, 0.02, n_days))), 2)
+    high = close + np.round(np.abs(rng.normal(0, 0.02, n_days)) * close, 2)
+    low = close - np.round(np.abs(rng.normal(0, 0.02, n_days)) * close, 2)
+    return pd.DataFrame({"high": high, "low": low, "close": close},
+                        index=pd.bdate_range("2010-01-04", periods=n_days, name="date"))
+
+
+def full_values(key, data):
+    name, param = Ii.parse_key(key)
+    return np.asarray(Ii.INDICATORS[name][1](data, param), dtype=float)
+
+
+def random_case(seed):
+    """
+    a key, its data, and the days the data is cut into: the first part is
+    computed at once, the others are appended one after another.
+    """
+    rng = np.random.default_rng(seed)
+    key = KEYS[seed % len(KEYS)]
+    if "%d" in key:
+        key = key % rng.integers(1, 30)
+    data = synthetic_data(rng, int(rng.integers(1, 200)))
+    cuts = np.sort(rng.integers(0, len(data) + 1, rng.integers(1, 4)))
+    return key, data, [0] + list(cuts) + [len(data)]
+
+
+@pytest.mark.parametrize("seed", range(N_CASES))
+def test_extend_equals_full_recompute(seed):
+    key, data, cuts = random_case(seed)
+    values = full_values(key, data.iloc[:cuts[1]])
+    tail = Ii.tail_state(key, data.iloc[:cuts[1]])["tail"]
+    for st, ed in zip(cuts[1:-1], cuts[2:]):
+        values, tail = Ii.extend(key, values, tail, data.iloc[st:ed])
+        np.testing.assert_allclose(values, full_values(key, data.iloc[:ed]), rtol=1e-10, equal_nan=True)
+        assert np.array_equal(tail, Ii.tail_state(key, data.iloc[:ed])["tail"])
+
+
+def test_extend_code(tmp_path):
+    cache = IndicatorCache(cache_dir=str(tmp_path / "indicators"), max_bytes=2 ** 30)
+    data = synthetic_data(np.random.default_rng(0), 300)
+    former, new_data = data.iloc[:250], data.iloc[250:]
+    keys = ["MA20", "STD5", "TR", "ATR14", "support5", "resistance5"]
+    for key in keys:
+        columns = Ii.columns_of(key)
+        cache.put("stocks/600000", key, Fingerprint.of(former, columns), full_values(key, former),
+                  **Ii.tail_state(key, former))
+    # computed on other data: stale, not extended.
+    cache.put("stocks/600000", "MA60", Fingerprint.of(former.iloc[:-1], ["close"]),
+              full_values("MA60", former.iloc[:-1]), **Ii.tail_state("MA60", former.iloc[:-1]))
+
+    assert Ii.extend_code("stocks/600000", new_data, former.index[-1], cache=cache) == len(keys)
+    for key in keys:
+        fingerprint = Fingerprint.of(data, Ii.columns_of(key))
+        np.testing.assert_allclose(cache.get("stocks/600000", key, fingerprint), full_values(key, data),
+                                   rtol=1e-10, equal_nan=True)
+    assert cache.load("stocks/600000", "MA60")["fingerprint"].n_rows == 249
+    assert Ii.extend_code("stocks/600000", new_data.iloc[:0], data.index[-1], cache=cache) == 0
@@ -0,0 +1,132 @@
+"""
+Fingerprints and the on-disk IndicatorCache of util/IndicatorCache.py: stale
+entries are missed when the source data changes, and the least recently
+used entries are evicted once the size bound is exceeded.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import lavender.config as cfg
+import lavender.util.DailyKLineIO as Dk
+from lavender.util.IndicatorCache import Fingerprint, IndicatorCache, ENTRY_EXT
+
+COLUMNS = ["high", "low", "close"]
+
+
+def synthetic_data(seed, n_days=300):
+    rng = np.random.default_rng(seed)
+    close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.02, n_days))), 2)
+    return pd.DataFrame({"open": close, "high": close + 0.1, "low": close - 0.1, "close": close},
+                        index=pd.bdate_range("2010-01-04", periods=n_days, name="date"))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return IndicatorCache(cache_dir=str(tmp_path / "indicators"), max_bytes=2 ** 30)
+
+
+def test_fingerprint_changes_with_data():
+    data = synthetic_data(0)
+    fingerprint = Fingerprint.of(data, COLUMNS)
+    assert Fingerprint.of(data.copy(), COLUMNS) == fingerprint
+    assert Fingerprint.parse(repr(fingerprint)) == fingerprint
+
+    changed = data.copy()
+    changed.iloc[100, changed.columns.get_loc("close")] += 0.01
+    assert Fingerprint.of(changed, COLUMNS) != fingerprint
+    # a column which is not an input doesn't change it.
+    changed = data.copy()
+    changed["open"] += 1.0
+    assert Fingerprint.of(changed, COLUMNS) == fingerprint
+    # neither the number of rows nor the last date changes here.
+    changed = data.copy()
+    dates = changed.index.values.copy()
+    dates[150] -= np.timedelta64(1, "h")
+    changed.index = pd.DatetimeIndex(dates, name="date")
+    assert Fingerprint.of(changed, COLUMNS) != fingerprint
+    assert Fingerprint.of(data.iloc[:-1], COLUMNS) != fingerprint
+
+
+def test_fingerprint_independent_of_dtype():
+    data = synthetic_data(0)
+    data["close"] = np.round(data["close"])
+    as_int = data.astype({"close": np.int64})
+    assert Fingerprint.of(as_int, COLUMNS) == Fingerprint.of(data, COLUMNS)
+
+
+@pytest.mark.parametrize("n_new", [0, 1, 17])
+def test_fingerprint_extend_equals_whole(n_new):
+    data = synthetic_data(1)
+    former, new_data = data.iloc[:len(data) - n_new], data.iloc[len(data) - n_new:]
+    assert Fingerprint.of(former, COLUMNS).extend(new_data, COLUMNS) == Fingerprint.of(data, COLUMNS)
+
+
+def test_stale_entry_missed(cache):
+    data = synthetic_data(0)
+    fingerprint = Fingerprint.of(data, ["close"])
+    values = data["close"].rolling(20).mean().values
+    assert cache.get("stocks/600000", "MA20", fingerprint) is None
+    cache.put("stocks/600000", "MA20", fingerprint, values)
+    assert np.array_equal(cache.get("stocks/600000", "MA20", fingerprint), values, equal_nan=True)
+    assert cache.get("stocks/600000", "MA20", Fingerprint.of(data.iloc[:-1], ["close"])) is None
+    assert cache.get("stocks/600001", "MA20", fingerprint) is None
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert cache.keys("stocks/600000") == ["MA20"]
+
+
+def test_kline_recomputes_stale_indicator(cache, tmp_path, monkeypatch):
+    kline_dir = tmp_path / "stocks"
+    kline_dir.mkdir()
+    monkeypatch.setattr(cfg, "kline_dir", str(kline_dir))
+    monkeypatch.setattr(cfg, "indicator_cache_enabled", True)
+    monkeypatch.setattr(Dk, "indicator_cache", cache)
+    data = synthetic_data(2)
+    file_path = os.path.join(str(kline_dir), "600000.csv")
+    data.to_csv(file_path)
+
+    expected = data["close"].rolling(20).mean().values
+    assert np.array_equal(Dk.KLine("600000", use_cache=False).ma(20).values, expected, equal_nan=True)
+    assert np.array_equal(Dk.KLine("600000", use_cache=False).ma(20).values, expected, equal_nan=True)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.keys("stocks/600000") == ["MA20"]
+
+    data.iloc[150, data.columns.get_loc("close")] *= 1.1
+    data.to_csv(file_path)
+    expected = data["close"].rolling(20).mean().values
+    assert np.array_equal(Dk.KLine("600000", use_cache=False).ma(20).values, expected, equal_nan=True)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_evict_least_recently_used(cache):
+    fingerprint = Fingerprint.of(synthetic_data(0), ["close"])
+    values = np.arange(1000, dtype=float)
+    codes = ["stocks/%06d" % icode for icode in range(10)]
+    for icode, code in enumerate(codes):
+        cache.put(code, "MA20", fingerprint, values)
+        os.utime(cache.entry_path(code, "MA20"), (1000 + icode, 1000 + icode))
+    entry_size = os.path.getsize(cache.entry_path(codes[0], "MA20"))
+    # the hit makes the oldest entry the most recently used one.
+    assert cache.get(codes[0], "MA20", fingerprint) is not None
+
+    cache.max_bytes = 10 * entry_size
+    cache._nbytes = None
+    cache.put("stocks/000010", "MA20", fingerprint, values)
+    # evicted down to 90% of the bound: the 2 least recently used entries go.
+    assert cache.evictions == 2
+    remaining = [code for code in codes + ["stocks/000010"] if cache.keys(code)]
+    assert remaining == [codes[0]] + codes[3:] + ["stocks/000010"]
+    assert cache.info()["nbytes"] == 9 * entry_size
+    assert cache.info()["nbytes"] <= 0.9 * cache.max_bytes
+
+
+def test_clear(cache):
+    fingerprint = Fingerprint.of(synthetic_data(0), ["close"])
+    for key in ["MA5", "MA20", "STD20"]:
+        cache.put("stocks/600000", key, fingerprint, np.zeros(10))
+    assert cache.keys("stocks/600000") == ["MA20", "MA5", "STD20"]
+    cache.clear()
+    assert cache.keys("stocks/600000") == []
+    assert not any(name.endswith(ENTRY_EXT) for _, _, names in os.walk(cache.cache_dir) for name in names)
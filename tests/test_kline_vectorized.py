@@ -0,0 +1,111 @@
+"""
+Equivalence of the vectorized true range and pivot points of DailyKLineIO
+with the former per-day loops of KLine.tr, KLine.support and KLine.resistance,
+kept here as references.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lavender.util.DailyKLineIO import true_range, pivot_points
+
+HALF_WINDOWS = [1, 3, 20]
+
+
+def loop_true_range(high, low, close):
+    """
+    the former KLine.tr: builtin max() of the three ranges day by day.
+    """
+    tr_list = list()
+    for i, close_price in enumerate(close[:-1]):
+        high_price = high[i + 1]
+        low_price = low[i + 1]  # the last day's close price
+        tr_list.append(max(abs(high_price - low_price),
+                           abs(low_price - close_price),
+                           abs(high_price - close_price)))
+    tr_array = np.full(len(close), np.nan)
+    tr_array[1:] = tr_list
+    return tr_array
+
+
+def loop_support(low, half_window):
+    """
+    the former KLine.support.
+    """
+    support_line = np.full(len(low), np.nan)
+    minimum = pd.Series(low).rolling(window=2 * half_window + 1, center=True).min().values
+    for iday in range(len(low)):
+        if low[iday] == minimum[iday]:
+            support_line[iday] = low[iday]
+    return support_line
+
+
+def loop_resistance(high, half_window):
+    """
+    the former KLine.resistance.
+    """
+    resistance_line = np.full(len(high), np.nan)
+    maximum = pd.Series(high).rolling(window=2 * half_window + 1, center=True).max().values
+    for iday in range(len(high)):
+        if high[iday] == maximum[iday]:
+            resistance_line[iday] = high[iday]
+    return resistance_line
+
+
+def synthetic_prices(seed, n_days=600):
+    """
+    high, low and close prices with NaN gaps, flat stretches and ties.
+    """
+    rng = np.random.default_rng(seed)
+    # prices rounded to cents, so equal prices(ties) are common.
+    close = np.round(10 + np.cumsum(rng.normal(0, 0.2, n_days)), 2)
+    high = np.round(close + np.abs(rng.normal(0, 0.1, n_days)), 2)
+    low = np.round(close - np.abs(rng.normal(0, 0.1, n_days)), 2)
+    # flat stretches, e.g. suspended days.
+    for start in rng.integers(0, n_days - 30, 5):
+        length = rng.integers(3, 30)
+        high[start:start + length] = low[start:start + length] = close[start:start + length] = close[start]
+    # ties of a day's range with its gaps to the last close.
+    tied = rng.integers(1, n_days, 20)
+    low[tied] = close[tied - 1]
+    high[tied[:10]] = close[tied[:10] - 1]
+    # NaN gaps, in single columns and in whole days.
+    for prices in [high, low, close]:
+        prices[rng.integers(0, n_days, 15)] = np.nan
+    gap = rng.integers(0, n_days - 10)
+    high[gap:gap + 5] = low[gap:gap + 5] = close[gap:gap + 5] = np.nan
+    return high, low, close
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_true_range_equals_loop(seed):
+    high, low, close = synthetic_prices(seed)
+    assert np.array_equal(true_range(high, low, close), loop_true_range(high, low, close), equal_nan=True)
+
+
+@pytest.mark.parametrize("n_days", [0, 1, 2])
+def test_true_range_short_series(n_days):
+    high, low, close = [prices[:n_days] for prices in synthetic_prices(0)]
+    assert np.array_equal(true_range(high, low, close), loop_true_range(high, low, close), equal_nan=True)
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("half_window", HALF_WINDOWS)
+def test_support_equals_loop(seed, half_window):
+    high, low, close = synthetic_prices(seed)
+    assert np.array_equal(pivot_points(low, half_window, "support"), loop_support(low, half_window),
+                          equal_nan=True)
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("half_window", HALF_WINDOWS)
+def test_resistance_equals_loop(seed, half_window):
+    high, low, close = synthetic_prices(seed)
+    assert np.array_equal(pivot_points(high, half_window, "resistance"), loop_resistance(high, half_window),
+                          equal_nan=True)
+
+
+def test_pivot_points_rejects_unknown_kind():
+    with pytest.raises(ValueError):
+        pivot_points(np.arange(10.0), 2, "middle")
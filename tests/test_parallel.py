@@ -0,0 +1,67 @@
+"""
+parameter_sweep and SharedKLines of strategy/parallel.py on pools with a code
+without data: the code is reported in the result and the others are tested.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import lavender.config as cfg
+import lavender.util.TradeCalendar as Tc
+from lavender.strategy.parallel import METRICS, SharedKLines, parameter_sweep
+
+CODES = ["600000", "600001", "600002"]
+MISSING = "600009"
+
+
+@pytest.fixture
+def pools(tmp_path, monkeypatch):
+    """
+    a pool file listing CODES and MISSING, and the K lines of CODES only.
+    """
+    kline_dir = tmp_path / "kline"
+    pool_dir = tmp_path / "pool"
+    kline_dir.mkdir()
+    pool_dir.mkdir()
+    monkeypatch.setattr(cfg, "kline_dir", str(kline_dir))
+    monkeypatch.setattr(cfg, "pool_dir", str(pool_dir))
+    monkeypatch.setattr(cfg, "indicator_cache_enabled", False)
+    monkeypatch.setitem(Tc._calendar, "master", Tc.TradeCalendar(np.empty(0, dtype=np.int64)))
+
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range("2010-01-04", periods=300, name="date")
+    for code in CODES:
+        close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.02, len(dates)))), 2)
+        pd.DataFrame({"open": close, "high": close + 0.1, "low": close - 0.1, "close": close},
+                     index=dates).to_csv(os.path.join(str(kline_dir), code + ".csv"))
+    with open(os.path.join(str(pool_dir), "pool_a"), "w") as fout:
+        fout.writelines("%s name_%s\n" % (code, code) for code in CODES[:2] + [MISSING] + CODES[2:])
+    return ["pool_a"]
+
+
+def test_shared_klines_skip_missing(pools):
+    shared = SharedKLines(CODES[:2] + [MISSING] + CODES[2:])
+    try:
+        assert [code for code, _, _ in shared.layout["codes"]] == CODES
+        assert list(shared.missing) == [MISSING]
+        assert shared.missing[MISSING].startswith("OSError: no data for %s" % MISSING)
+        shm, k_lines = SharedKLines.attach(shared.layout)
+        assert sorted(k_lines) == CODES
+        shm.close()
+    finally:
+        shared.close()
+
+
+def test_parameter_sweep_reports_missing(pools, capsys):
+    result = parameter_sweep("dual_ma_strategy", {"ma_fast": [5, 10], "ma_slow": [20]},
+                             pools=pools, n_process=2)
+    assert list(result.code) == [code for code in CODES[:2] for _ in range(2)] + [MISSING] + [CODES[2]] * 2
+    missing = result[result.code == MISSING].iloc[0]
+    assert missing.error.startswith("OSError: no data for %s" % MISSING)
+    assert missing[["ma_fast", "ma_slow"] + METRICS].isna().all()
+    tested = result[result.code != MISSING]
+    assert (tested.error == "").all()
+    assert tested[METRICS].notna().all().all()
+    assert "%s failed: OSError" % MISSING in capsys.readouterr().out
@@ -0,0 +1,98 @@
+"""
+Equivalence of Portfolio.trade_open_vectorized, trading on (days x codes)
+matrices with portfolio_open_trades, and the day-by-day loop of
+Portfolio.trade_open, on synthetic pools with suspensions, limit up/down days,
+stocks listed late, codes in more than one pool and more buys than cash.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import lavender.config as cfg
+import lavender.util.TradeCalendar as Tc
+from lavender.strategy.backtest import Portfolio
+
+N_CODES = 14
+STRATEGIES = [
+    ("holding_strategy", {}),
+    ("dual_ma_strategy", {"ma_fast": 5, "ma_slow": 20}),
+    ("bollinger_breakout_strategy", {"bl_days": 20, "scale": 1.0}),
+    ("extremum_contrary_strategy", {}),
+]
+
+
+def synthetic_kline(rng, dates):
+    """
+    prices swinging around a random walk, with suspended days dropped and
+    days of one price(limit up or down).
+    """
+    n_days = len(dates)
+    trend = np.cumsum(rng.normal(0, 0.01, n_days))
+    swing = 0.1 * np.sin(2 * np.pi * np.arange(n_days) / rng.uniform(40, 80))
+    close = np.round(10 * np.exp(trend + swing + rng.normal(0, 0.01, n_days)), 2)
+    open_price = np.round(close * np.exp(rng.normal(0, 0.01, n_days)), 2)
+    high = np.maximum(open_price, close) + np.round(np.abs(rng.normal(0, 0.05, n_days)), 2)
+    low = np.minimum(open_price, close) - np.round(np.abs(rng.normal(0, 0.05, n_days)), 2)
+    for iday in rng.integers(1, n_days, 30):
+        limit = np.round(close[iday - 1] * (1.1 if rng.uniform() < 0.5 else 0.9), 2)
+        open_price[iday] = high[iday] = low[iday] = close[iday] = limit
+    data = pd.DataFrame({"open": open_price, "high": high, "low": low, "close": close},
+                        index=pd.DatetimeIndex(dates, name="date"))
+    traded = np.ones(n_days, dtype=bool)
+    for start in rng.integers(0, n_days - 20, 3):
+        traded[start:start + rng.integers(1, 20)] = False
+    # listed later than the others.
+    traded[:rng.integers(0, 100)] = False
+    return data[traded]
+
+
+@pytest.fixture
+def pools(tmp_path, monkeypatch):
+    """
+    two pool files sharing some codes, and the K lines of the codes.
+    """
+    kline_dir = tmp_path / "kline"
+    pool_dir = tmp_path / "pool"
+    kline_dir.mkdir()
+    pool_dir.mkdir()
+    monkeypatch.setattr(cfg, "kline_dir", str(kline_dir))
+    monkeypatch.setattr(cfg, "pool_dir", str(pool_dir))
+    monkeypatch.setattr(cfg, "indicator_cache_enabled", False)
+    monkeypatch.setitem(Tc._calendar, "master", Tc.TradeCalendar(np.empty(0, dtype=np.int64)))
+    # Portfolio.trade_open writes its result into the working directory.
+    monkeypatch.chdir(tmp_path)
+
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range("2010-01-04", periods=500)
+    codes = ["%06d" % (600000 + icode) for icode in range(N_CODES)]
+    for code in codes:
+        synthetic_kline(rng, dates).to_csv(os.path.join(str(kline_dir), code + ".csv"))
+    with open(os.path.join(str(pool_dir), "pool_a"), "w") as fout:
+        fout.writelines("%s name_%s\n" % (code, code) for code in codes[:9])
+    with open(os.path.join(str(pool_dir), "pool_b"), "w") as fout:
+        fout.writelines("%s name_%s\n" % (code, code) for code in codes[6:])
+    return ["pool_a", "pool_b"]
+
+
+@pytest.mark.parametrize("strategy, kwargs", STRATEGIES)
+def test_trade_open_vectorized_equals_loop(pools, strategy, kwargs):
+    loop = Portfolio(pools)
+    loop_result = loop.trade_open(strategy, show_value=False, **kwargs)
+    vectorized = Portfolio(pools)
+    vectorized_result = vectorized.trade_open_vectorized(strategy, show_value=False, **kwargs)
+
+    pd.testing.assert_index_equal(vectorized_result.index, loop_result.index)
+    for column in ["net_value", "daily_return", "cash_held"]:
+        np.testing.assert_allclose(vectorized_result[column].values.astype(float),
+                                   loop_result[column].values.astype(float), rtol=1e-9, atol=1e-12)
+    for vectorized_held, loop_held in zip(vectorized_result["stock_held"], loop_result["stock_held"]):
+        assert sorted(vectorized_held) == sorted(loop_held)
+        for code in loop_held:
+            assert vectorized_held[code] == pytest.approx(loop_held[code], rel=1e-9)
+    # the pools were traded, beyond the cash of the unit positions.
+    n_held = vectorized.holdings.gt(0).sum(axis=1)
+    assert n_held.max() > 0
+    if strategy == "holding_strategy":
+        assert n_held.max() < len(vectorized.unique_codes)
@@ -0,0 +1,169 @@
+"""
+Scheduler and RateLimiter of DataCollecting/scheduler.py, run against a fake
+data source in place of tushare.
+"""
+
+import threading
+
+import pytest
+
+import lavender.DataCollecting.scheduler as sd
+from lavender.DataCollecting.scheduler import RateLimiter, Scheduler
+
+
+class FakeSource:
+    """
+    stands in for tushare: get_k_data fails the first n_fails[code] calls of a code.
+    """
+    def __init__(self, n_fails):
+        self.n_fails = dict(n_fails)
+        self.calls = dict()
+        self._lock = threading.Lock()
+
+    def get_k_data(self, code, **kwargs):
+        with self._lock:
+            self.calls[code] = self.calls.get(code, 0) + 1
+            n_call = self.calls[code]
+        if n_call <= self.n_fails.get(code, 0):
+            raise IOError("timed out: %s" % code)
+        return code
+
+
+class FakeClock:
+    """
+    time.monotonic and time.sleep of the scheduler module, without waiting.
+    A sleep takes at least a microsecond, as a real one does, or a wait
+    rounded off to nothing would never end.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.now += max(seconds, 1e-6)
+
+
+class RecordingEvent(threading.Event):
+    """
+    stop event of a scheduler recording the backoff waits, without waiting.
+    """
+    def __init__(self):
+        threading.Event.__init__(self)
+        self.waits = list()
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        return self.is_set()
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(sd.random, "random", lambda: 0.0)
+
+
+def scheduler_of(source, n_thread=1, **kwargs):
+    scheduler = Scheduler(lambda code: source.get_k_data(code), n_thread=n_thread, rate=0, **kwargs)
+    scheduler._stop = RecordingEvent()
+    return scheduler
+
+
+def test_retry_with_backoff(no_jitter):
+    source = FakeSource({"600000": 3})
+    scheduler = scheduler_of(source, max_retry=3, backoff=0.5)
+    report = scheduler.run(["600000"])
+    assert source.calls == {"600000": 4}
+    assert scheduler._stop.waits == [0.5, 1.0, 2.0]
+    assert report["failed"] == {}
+    assert (report["total"], report["done"], report["retries"]) == (1, 1, 3)
+
+
+def test_backoff_capped(no_jitter):
+    source = FakeSource({"600000": 4})
+    scheduler = scheduler_of(source, max_retry=4, backoff=1.0, max_backoff=3.0)
+    scheduler.run(["600000"])
+    assert scheduler._stop.waits == [1.0, 2.0, 3.0, 3.0]
+
+
+def test_backoff_jitter(monkeypatch):
+    monkeypatch.setattr(sd.random, "random", lambda: 1.0)
+    scheduler = scheduler_of(FakeSource({"600000": 1}), max_retry=1, backoff=1.0)
+    scheduler.run(["600000"])
+    assert scheduler._stop.waits == [pytest.approx(1.1)]
+
+
+def test_failed_codes_reported(no_jitter, capsys):
+    codes = ["%06d" % icode for icode in range(20)]
+    source = FakeSource(dict([("000003", 10), ("000011", 10), ("000017", 2)]))
+    scheduler = scheduler_of(source, n_thread=4, max_retry=2, backoff=0.1)
+    report = scheduler.run(codes)
+    assert report["failed"] == {"000003": "OSError: timed out: 000003",
+                                "000011": "OSError: timed out: 000011"}
+    assert report["done"] == report["total"] == len(codes)
+    assert report["retries"] == 2 + 2 + 2
+    # a failed code is tried max_retry + 1 times, the others until they succeed.
+    assert source.calls["000003"] == source.calls["000011"] == 3
+    assert source.calls["000017"] == 3
+    assert all(source.calls[code] == 1 for code in codes if code not in ["000003", "000011", "000017"])
+    out = capsys.readouterr().out
+    assert "failed tasks:" in out and "000003: OSError: timed out: 000003" in out
+
+
+def test_scheduler_run_again_resets_report(no_jitter):
+    source = FakeSource({"000001": 10})
+    scheduler = scheduler_of(source, max_retry=0)
+    assert list(scheduler.run(["000001", "000002"])["failed"]) == ["000001"]
+    report = scheduler.run(["000002"])
+    assert (report["total"], report["done"], report["failed"]) == (1, 1, {})
+
+
+def test_rate_limiter_spaces_requests(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sd.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(sd.time, "sleep", clock.sleep)
+    limiter = RateLimiter(rate=4.0)
+    times = list()
+    for _ in range(9):
+        limiter.acquire()
+        times.append(clock.now)
+    assert times == pytest.approx([0.25 * itime for itime in range(9)], abs=1e-5)
+
+
+def test_rate_limiter_burst_after_idle(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sd.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(sd.time, "sleep", clock.sleep)
+    limiter = RateLimiter(rate=2.0, burst=3)
+    clock.now = 10.0
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.now == 10.0
+    limiter.acquire()
+    assert clock.now == pytest.approx(10.5, abs=1e-5)
+
+
+def test_scheduler_rate_limits_all_workers(no_jitter, monkeypatch):
+    """
+    attempts of all the workers, retries included, pass through one limiter:
+    the k-th attempt is made no earlier than k / rate seconds.
+    """
+    clock = FakeClock()
+    monkeypatch.setattr(sd.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(sd.time, "sleep", clock.sleep)
+    source = FakeSource({"000001": 2, "000002": 1})
+    times = list()
+
+    def worker(code):
+        times.append(clock.monotonic())
+        source.get_k_data(code)
+    scheduler = Scheduler(worker, n_thread=4, max_retry=3, backoff=0.0, rate=10.0)
+    scheduler._stop = RecordingEvent()
+    codes = ["%06d" % icode for icode in range(12)]
+    report = scheduler.run(codes)
+    assert report["failed"] == {}
+    assert len(times) == sum(source.calls.values()) == len(codes) + 3
+    for itime, attempt_time in enumerate(sorted(times)):
+        assert attempt_time >= itime / 10.0 - 1e-9